@@ -0,0 +1,168 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+import numpy as np
+import tracing
+
+# Answer cache settings
+ANSWER_CACHE_PATH = "answer_cache.sqlite"
+ANSWER_CACHE_THRESHOLD = 0.92  # minimum cosine similarity between the new and the cached question
+ANSWER_CACHE_TTL_S = 24 * 3600  # cached answers expire after this many seconds
+ANSWER_CACHE_MAX_ENTRIES = 10_000  # least recently used answers are evicted beyond this (per namespace)
+
+
+# Fingerprint of index files (size + mtime), so answers are dropped whenever the index is rebuilt or updated
+def index_version(*paths):
+    digest = hashlib.blake2b(digest_size=16)
+    for path in paths:
+        stat = os.stat(path) if os.path.exists(path) else None
+        digest.update(f"{path}:{stat.st_size}:{stat.st_mtime_ns}|".encode() if stat else f"{path}:missing|".encode())
+    return digest.hexdigest()
+
+
+# Order-independent key of a retrieved chunk set
+def chunk_set_key(chunk_texts):
+    digest = hashlib.blake2b(digest_size=16)
+    for text in sorted(chunk_texts):
+        digest.update(hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest())
+    return digest.hexdigest()
+
+
+def _normalize(vector):
+    vector = np.asarray(vector, dtype="float32").ravel()
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+# Persistent semantic answer cache: a stored answer is reused when a new question embeds within
+# threshold cosine similarity of a cached one and retrieval returned the same chunk set.
+# version_fn is checked on every call; when it changes (reindex) the namespace is cleared.
+class AnswerCache:
+    def __init__(self, namespace, version_fn, path=ANSWER_CACHE_PATH, threshold=ANSWER_CACHE_THRESHOLD,
+                 ttl_s=ANSWER_CACHE_TTL_S, max_entries=ANSWER_CACHE_MAX_ENTRIES):
+        self.namespace = namespace
+        self.version_fn = version_fn
+        self.threshold = threshold
+        self.ttl_s = ttl_s
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()  # The query service answers from many threads
+        self.db = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS answers (id INTEGER PRIMARY KEY, namespace TEXT NOT NULL, chunk_key TEXT NOT NULL,"
+            " embedding BLOB NOT NULL, answer TEXT NOT NULL, created REAL NOT NULL, last_used REAL NOT NULL)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS answers_chunks ON answers (namespace, chunk_key)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS answers_last_used ON answers (namespace, last_used)")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS namespaces (namespace TEXT PRIMARY KEY, version TEXT NOT NULL,"
+            " hits INTEGER NOT NULL DEFAULT 0, misses INTEGER NOT NULL DEFAULT 0)"
+        )
+
+    # Clear the namespace if the index changed since its answers were cached (caller holds the lock)
+    def _check_version(self):
+        version = self.version_fn()
+        row = self.db.execute("SELECT version FROM namespaces WHERE namespace = ?", (self.namespace,)).fetchone()
+        if row is None:
+            self.db.execute("INSERT INTO namespaces (namespace, version) VALUES (?, ?)", (self.namespace, version))
+        elif row[0] != version:
+            self.db.execute("DELETE FROM answers WHERE namespace = ?", (self.namespace,))
+            self.db.execute("UPDATE namespaces SET version = ? WHERE namespace = ?", (version, self.namespace))
+
+    def _count(self, column):
+        self.db.execute(f"UPDATE namespaces SET {column} = {column} + 1 WHERE namespace = ?", (self.namespace,))
+
+    # Cached answer for a question embedding and its retrieved chunk texts, or None
+    def lookup(self, q_emb, chunk_texts):
+        q_emb = _normalize(q_emb)
+        now = time.time()
+        with self.lock:
+            self._check_version()
+            self.db.execute("DELETE FROM answers WHERE namespace = ? AND created < ?", (self.namespace, now - self.ttl_s))
+            rows = self.db.execute(
+                "SELECT id, embedding, answer FROM answers WHERE namespace = ? AND chunk_key = ?",
+                (self.namespace, chunk_set_key(chunk_texts))
+            ).fetchall()
+
+            best_id, best_answer, best_score = None, None, self.threshold
+            for row_id, blob, answer in rows:
+                score = float(np.frombuffer(blob, dtype="float32") @ q_emb)
+                if score >= best_score:
+                    best_id, best_answer, best_score = row_id, answer, score
+
+            if best_id is None:
+                tracing.count("answer_cache.misses")
+                self.misses += 1
+                self._count("misses")
+                return None
+            tracing.count("answer_cache.hits")
+            self.hits += 1
+            self._count("hits")
+            self.db.execute("UPDATE answers SET last_used = ? WHERE id = ?", (now, best_id))
+            return best_answer
+
+    def store(self, q_emb, chunk_texts, answer):
+        now = time.time()
+        with self.lock:
+            self._check_version()
+            self.db.execute(
+                "INSERT INTO answers (namespace, chunk_key, embedding, answer, created, last_used) VALUES (?, ?, ?, ?, ?, ?)",
+                (self.namespace, chunk_set_key(chunk_texts), _normalize(q_emb).tobytes(), answer, now, now)
+            )
+            self.db.execute(
+                "DELETE FROM answers WHERE id IN (SELECT id FROM answers WHERE namespace = ? "
+                "ORDER BY last_used DESC LIMIT -1 OFFSET ?)", (self.namespace, self.max_entries)
+            )
+
+    # Return the cached answer (sent to on_token in one piece) or generate, cache and return a new one;
+    # the second value tells whether the answer came from the cache
+    def get_or_generate(self, q_emb, chunk_texts, generate, on_token=None):
+        answer = self.lookup(q_emb, chunk_texts)
+        if answer is not None:
+            if on_token:
+                on_token(answer)
+            return answer, True
+        answer = generate()
+        if answer:
+            self.store(q_emb, chunk_texts, answer)
+        return answer, False
+
+    def invalidate(self):
+        with self.lock:
+            self.db.execute("DELETE FROM answers WHERE namespace = ?", (self.namespace,))
+
+    def stats(self):
+        with self.lock:
+            entries = self.db.execute("SELECT COUNT(*) FROM answers WHERE namespace = ?", (self.namespace,)).fetchone()[0]
+            row = self.db.execute("SELECT hits, misses FROM namespaces WHERE namespace = ?", (self.namespace,)).fetchone()
+        total_hits, total_misses = row if row else (0, 0)
+        lookups = self.hits + self.misses
+        return {
+            "entries": entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "total_hits": total_hits,
+            "total_misses": total_misses,
+            "total_hit_rate": round(total_hits / (total_hits + total_misses), 3) if total_hits + total_misses else 0.0
+        }
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+# Shared cache for a namespace (once per process), opened on first use so importing a script creates no database
+def load_answer_cache(namespace, version_fn, path=ANSWER_CACHE_PATH):
+    with _caches_lock:
+        if (namespace, path) not in _caches:
+            _caches[namespace, path] = AnswerCache(namespace, version_fn, path)
+        return _caches[namespace, path]
+
+
+# One-line summary for interactive scripts
+def format_cache_stats(stats):
+    return f"⚡ Answer cache: {stats['hits']}/{stats['hits'] + stats['misses']} hits ({stats['hit_rate']:.0%}), {stats['entries']} cached"
@@ -0,0 +1,365 @@
+import os
+import sys
+import json
+import time
+import random
+import resource
+import argparse
+import platform
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+# Benchmark scales: corpus and query sizes per preset (override any of them on the command line)
+SCALES = {
+    "small": {"text_docs": 20, "words_per_doc": 3_000, "pdf_docs": 5, "pdf_pages": 4, "csv_rows": 2_000,
+              "bus_stops": 2_000, "users": 500, "events": 200, "queries": 50, "answers": 10},
+    "medium": {"text_docs": 200, "words_per_doc": 10_000, "pdf_docs": 20, "pdf_pages": 10, "csv_rows": 50_000,
+               "bus_stops": 20_000, "users": 5_000, "events": 2_000, "queries": 200, "answers": 20},
+    "large": {"text_docs": 1_000, "words_per_doc": 20_000, "pdf_docs": 100, "pdf_pages": 20, "csv_rows": 500_000,
+              "bus_stops": 100_000, "users": 50_000, "events": 20_000, "queries": 500, "answers": 50},
+}
+BENCH_DIR = "bench_run"  # scratch directory the corpora and indexes are generated in
+TOKEN_LATENCY = 0.005  # fake Ollama seconds between tokens
+FIRST_TOKEN_LATENCY = 0.05
+SEED = 42
+
+SYLLABLES = ["ka", "lo", "mi", "ra", "te", "shi", "no", "vu", "ze", "pa", "qu", "do", "fe", "gri", "bal", "tor"]
+CITIES = [("Tempe", "AZ", 33.4255, -111.94), ("Mesa", "AZ", 33.4152, -111.8315), ("Phoenix", "AZ", 33.4484, -112.074),
+          ("Austin", "TX", 30.2672, -97.7431), ("Denver", "CO", 39.7392, -104.9903)]
+INTERESTS = ["hiking", "music", "art", "coding", "cooking", "yoga", "chess", "cycling", "photography", "gaming"]
+BUS_STOP_FILE = "BusStopsWAmenities_8035766100189484498.csv"
+
+
+def make_vocabulary(rng, size=5000):
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))))
+    return sorted(words)
+
+
+# Zipf-distributed filler words
+def random_words(rng, vocab, count):
+    ranks = np.minimum(np.random.default_rng(rng.randrange(1 << 30)).zipf(1.3, count), len(vocab)) - 1
+    return [vocab[r] for r in ranks]
+
+
+# One planted fact per document, and the (question, answer) used to measure retrieval recall
+def planted_fact(rng, name):
+    code = "".join(rng.choice("0123456789abcdef") for _ in range(8))
+    return f"The secret code of project {name} is {code}.", (f"What is the secret code of project {name}?", code)
+
+
+# Minimal single-font PDF with one text stream per page (enough for PdfReader.extract_text)
+def write_text_pdf(path, pages):
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None, "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for lines in pages:
+        text = "".join(f"({line}) Tj T* " for line in lines)
+        stream = f"BT /F1 10 Tf 12 TL 40 760 Td {text}ET"
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+                       f"/Resources << /Font << /F1 3 0 R >> >> /Contents {len(objects)} 0 R >>")
+        kids.append(f"{len(objects)} 0 R")
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(kids)} >>"
+
+    out, offsets = ["%PDF-1.4\n"], []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(sum(len(part) for part in out))
+        out.append(f"{number} 0 obj\n{body}\nendobj\n")
+    xref = sum(len(part) for part in out)
+    out.append(f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n")
+    out.extend(f"{offset:010d} 00000 n \n" for offset in offsets)
+    out.append(f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n")
+    with open(path, "w", encoding="latin-1") as f:
+        f.write("".join(out))
+
+
+# data/ text, PDF and CSV files for rag.py plus the bus stop CSV; returns the planted (question, answer) pairs
+def generate_documents(rng, scale):
+    os.makedirs("data", exist_ok=True)
+    vocab = make_vocabulary(rng)
+    facts = []
+
+    for i in range(scale["text_docs"]):
+        words = random_words(rng, vocab, scale["words_per_doc"])
+        sentence, fact = planted_fact(rng, f"text{i}")
+        words.insert(rng.randrange(len(words)), sentence)
+        facts.append(fact)
+        with open(f"data/doc_{i:05d}.txt", "w", encoding="utf-8") as f:
+            f.write(" ".join(words))
+
+    for i in range(scale["pdf_docs"]):
+        sentence, fact = planted_fact(rng, f"pdf{i}")
+        pages = []
+        for page in range(scale["pdf_pages"]):
+            words = random_words(rng, vocab, 400)
+            lines = [" ".join(words[j:j + 12]) for j in range(0, len(words), 12)]
+            if page == 0:
+                lines.insert(rng.randrange(len(lines)), sentence.rstrip("."))
+            pages.append(lines)
+        facts.append(fact)
+        write_text_pdf(f"data/doc_{i:05d}.pdf", pages)
+
+    with open("data/records.csv", "w", encoding="utf-8") as f:
+        f.write("id,name,category,notes\n")
+        for i in range(scale["csv_rows"]):
+            f.write(f"{i},{rng.choice(vocab)} {rng.choice(vocab)},{rng.choice(INTERESTS)},{' '.join(random_words(rng, vocab, 8))}\n")
+
+    return facts
+
+
+def generate_bus_stops(rng, scale):
+    stops = []
+    with open(os.path.join("data", BUS_STOP_FILE), "w", encoding="utf-8") as f:
+        f.write("OBJECTID,stop_name,jurisdiction,Routes,BikeRacks\n")
+        for i in range(scale["bus_stops"]):
+            name = f"{rng.choice(SYLLABLES).capitalize()}{rng.choice(SYLLABLES)} Ave & {i}th St"
+            city = rng.choice(CITIES)[0]
+            routes = ", ".join(str(rng.randint(1, 120)) for _ in range(rng.randint(1, 3)))
+            f.write(f'{i},{name},{city},"{routes}",{rng.choice([0, 0, 1, 2, ""])}\n')
+            stops.append(name)
+    return stops
+
+
+# dummy_users.json and events_with_rsvp_semantic.json for the social scripts
+def generate_users_and_events(rng, scale):
+    users = []
+    for i in range(scale["users"]):
+        city, state, lat, lon = rng.choice(CITIES)
+        users.append({
+            "email": f"user{i}@example.com",
+            "bio": f"I live in {city} and enjoy {rng.choice(INTERESTS)}.",
+            "interests": rng.sample(INTERESTS, 3),
+            "location": {"city": city, "state": state, "latitude": lat + rng.uniform(-0.3, 0.3),
+                         "longitude": lon + rng.uniform(-0.3, 0.3)}
+        })
+
+    events = []
+    for i in range(scale["events"]):
+        city, state, lat, lon = rng.choice(CITIES)
+        attendees = rng.sample(users, min(len(users), rng.randint(5, 50)))
+        events.append({
+            "id": f"event{i}",
+            "title": f"{rng.choice(INTERESTS).capitalize()} meetup #{i}",
+            "description": f"A {rng.choice(INTERESTS)} event in {city}.",
+            "categories": rng.sample(INTERESTS, 2),
+            "tags": [],
+            "location": {"city": city, "state": state, "latitude": lat, "longitude": lon},
+            "rsvpList": [{"email": u["email"], "status": rng.choice(["attended", "joined"])} for u in attendees]
+        })
+
+    with open("dummy_users.json", "w") as f:
+        json.dump(users, f)
+    with open("events_with_rsvp_semantic.json", "w") as f:
+        json.dump(events, f)
+
+
+# Peak resident set size of this process so far, in MB (each benchmark runs in its own process, see isolated)
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1 << 20) if sys.platform == "darwin" else peak / 1024, 1)
+
+
+# Run fn in a freshly spawned process, so its peak RSS, imports and caches aren't shared with other benchmarks
+def isolated(fn, *args):
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+        return pool.submit(fn, *args).result()
+
+
+def latency_stats(latencies_s):
+    ms = np.array(latencies_s) * 1000
+    if len(ms) == 0:
+        return {}
+    return {"count": len(ms), "mean_ms": round(float(ms.mean()), 3), "p50_ms": round(float(np.percentile(ms, 50)), 3),
+            "p95_ms": round(float(np.percentile(ms, 95)), 3), "p99_ms": round(float(np.percentile(ms, 99)), 3)}
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def data_bytes():
+    return sum(os.path.getsize(os.path.join("data", name)) for name in os.listdir("data"))
+
+
+def bench_rag(facts, scale, ollama_url):
+    import rag
+    rag.OLLAMA_URL = ollama_url + "/api/chat"
+
+    (index, _, chunks), build_s = timed(rag.load_or_create_index)
+    _, reload_s = timed(rag.load_or_create_index)  # No file changed: manifest check only
+    mb = data_bytes() / (1 << 20)
+
+    queries = [facts[i % len(facts)] for i in range(scale["queries"])]
+    latencies, hits = [], 0
+    for question, answer in queries:
+        top_chunks, seconds = timed(rag.retrieve, question, index, chunks)
+        latencies.append(seconds)
+        hits += any(answer in chunk for chunk in top_chunks)
+
+    answer_latencies = []
+    for question, _ in queries[:scale["answers"]]:
+        start = time.perf_counter()
+        rag.query_ollama(question, "\n\n".join(rag.retrieve(question, index, chunks)))
+        answer_latencies.append(time.perf_counter() - start)
+
+    return {
+        "chunks": len(chunks),
+        "index_build_s": round(build_s, 3),
+        "index_reload_s": round(reload_s, 3),
+        "chunks_per_s": round(len(chunks) / build_s, 1),
+        "mb_per_s": round(mb / build_s, 3),
+        "retrieve": latency_stats(latencies),
+        "recall": round(hits / len(queries), 3),
+        "answer": latency_stats(answer_latencies),
+        "peak_rss_mb": peak_rss_mb()
+    }
+
+
+def bench_busstops(stops, scale, ollama_url):
+    import rag_busstops
+    rag_busstops.OLLAMA_URL = ollama_url + "/api/chat"
+
+    (index, chunks, lexical), build_s = timed(rag_busstops.load_or_create_index)
+
+    rng = random.Random(SEED)
+    names = [rng.choice(stops) for _ in range(scale["queries"])]
+    latencies, hits = [], 0
+    for name in names:
+        top_chunks, seconds = timed(rag_busstops.retrieve, f"Which routes serve {name}?", index, chunks, lexical)
+        latencies.append(seconds)
+        hits += any(chunk["stopName"] == name for chunk in top_chunks)
+
+    answer_latencies = []
+    for name in names[:scale["answers"]]:
+        start = time.perf_counter()
+        question = f"Which routes serve {name}?"
+        rag_busstops.query_llm(question, rag_busstops.retrieve(question, index, chunks, lexical))
+        answer_latencies.append(time.perf_counter() - start)
+
+    return {
+        "stops": len(chunks),
+        "index_build_s": round(build_s, 3),
+        "stops_per_s": round(len(chunks) / build_s, 1),
+        "retrieve": latency_stats(latencies),
+        "recall": round(hits / len(names), 3),
+        "answer": latency_stats(answer_latencies),
+        "peak_rss_mb": peak_rss_mb()
+    }
+
+
+def bench_friends():
+    import friend_recommendation_hybrid as friends
+    from embeddings import load_embedder
+
+    with open("dummy_users.json") as f:
+        users = json.load(f)
+    with open("events_with_rsvp_semantic.json") as f:
+        events = json.load(f)
+
+    # First sync embeds every profile; the re-sync finds nothing changed and only reopens the store
+    _, sync_s = timed(friends.load_user_store, users, events, load_embedder())
+    store, resync_s = timed(friends.load_user_store, users, events, load_embedder())
+    (embeddings, emails, locations, attendance), inputs_s = timed(friends.store_inputs, store)
+
+    recommendations, recommend_s = timed(friends.recommend_friends, embeddings, store, emails, locations, attendance)
+    return {
+        "users": len(emails),
+        "sync_s": round(sync_s, 3),
+        "resync_s": round(resync_s, 3),
+        "store_inputs_s": round(inputs_s, 3),
+        "recommend_s": round(recommend_s, 3),
+        "users_per_s": round(len(emails) / recommend_s, 1) if recommend_s else None,
+        "avg_recommendations": round(float(np.mean([len(r) for r in recommendations.values()])), 2) if recommendations else 0,
+        "peak_rss_mb": peak_rss_mb()
+    }
+
+
+# Flatten nested results into {"rag.retrieve.p50_ms": value}
+def flatten(results, prefix=""):
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[f"{prefix}{key}"] = value
+    return flat
+
+
+def print_comparison(results, baseline):
+    current, previous = flatten(results["benchmarks"]), flatten(baseline["benchmarks"])
+    print(f"\n{'metric':<36} {'baseline':>12} {'current':>12} {'change':>9}")
+    for key in sorted(current):
+        if key in previous:
+            change = f"{(current[key] - previous[key]) / previous[key]:+.1%}" if previous[key] else "-"
+            print(f"{key:<36} {previous[key]:>12} {current[key]:>12} {change:>9}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="End-to-end benchmarks on synthetic corpora with a fake Ollama server")
+    parser.add_argument("--scale", choices=list(SCALES), default="small")
+    parser.add_argument("--workdir", default=BENCH_DIR, help="scratch directory (corpora, indexes and caches)")
+    parser.add_argument("--only", default="rag,busstops,friends", help="comma-separated benchmarks to run")
+    parser.add_argument("--token-latency", type=float, default=TOKEN_LATENCY)
+    parser.add_argument("--first-token-latency", type=float, default=FIRST_TOKEN_LATENCY)
+    parser.add_argument("--output", help="results JSON (default: benchmark_<scale>_<timestamp>.json)")
+    parser.add_argument("--baseline", help="earlier results JSON to compare against")
+    for key, value in SCALES["small"].items():
+        parser.add_argument(f"--{key.replace('_', '-')}", type=int, help=f"override the scale's {key}")
+    args = parser.parse_args()
+
+    scale = dict(SCALES[args.scale])
+    scale.update({key: getattr(args, key) for key in scale if getattr(args, key) is not None})
+    output = os.path.abspath(args.output or f"benchmark_{args.scale}_{time.strftime('%Y%m%d_%H%M%S')}.json")
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    # Everything runs inside the scratch directory, so the scripts' relative paths point at synthetic data
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    if os.path.exists(args.workdir) and os.listdir(args.workdir):
+        sys.exit(f"❌ {args.workdir} is not empty; remove it or pass another --workdir")
+    os.makedirs(args.workdir, exist_ok=True)
+    os.chdir(args.workdir)
+
+    from fake_ollama import start_fake_ollama
+    server, url = start_fake_ollama(token_latency=args.token_latency, first_token_latency=args.first_token_latency)
+
+    rng = random.Random(SEED)
+    print(f"🧪 Generating '{args.scale}' corpora in {args.workdir}...")
+    (facts, stops), generate_s = timed(lambda: (generate_documents(rng, scale), generate_bus_stops(rng, scale)))
+    generate_users_and_events(rng, scale)
+
+    benchmarks = {}
+    only = args.only.split(",")
+    if "rag" in only:
+        print("⏱️ rag...")
+        benchmarks["rag"] = isolated(bench_rag, facts, scale, url)
+    if "busstops" in only:
+        print("⏱️ rag_busstops...")
+        benchmarks["busstops"] = isolated(bench_busstops, stops, scale, url)
+    if "friends" in only:
+        print("⏱️ friend_recommendation_hybrid...")
+        benchmarks["friends"] = isolated(bench_friends)
+    server.shutdown()
+
+    results = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "scale": args.scale,
+        "params": scale,
+        "fake_ollama": {"token_latency": args.token_latency, "first_token_latency": args.first_token_latency},
+        "platform": {"python": platform.python_version(), "machine": platform.machine(), "cpus": os.cpu_count()},
+        "generate_s": round(generate_s, 3),
+        "benchmarks": benchmarks
+    }
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+
+    print(json.dumps(benchmarks, indent=2))
+    if baseline:
+        print_comparison(results, baseline)
+    print(f"✅ Results saved to {output}")
@@ -1,39 +1,149 @@
-import requests
-import json
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from ollama_client import get_client, print_token, format_stats
+from context_packing import estimate_tokens
+import tracing
 
 OLLAMA_URL = "http://localhost:11434/api/chat"
+MODEL_NAME = "llama3"  # or "mistral", "deepseek-chat", etc.
+KEEP_ALIVE = "30m"  # how long Ollama keeps the model loaded after each request (-1 = forever, 0 = unload right away)
+PRELOAD = True  # load the model in the background while the first message is typed
+HISTORY_TOKEN_BUDGET = 1500  # session context kept before older turns are summarized (stay below the model's num_ctx)
+KEEP_RECENT_TURNS = 2  # turns kept word for word when the older ones are summarized
+SUMMARY_PROMPT = ("Summarize the conversation below in a few sentences. Keep names, facts, decisions and open "
+                  "questions; leave out small talk.\n\n")
 
-def ask_ollama(prompt):
-    payload = {
-        "model": "llama3",  # or "mistral", "deepseek-chat", etc.
-        "messages": [{"role": "user", "content": prompt}]
-    }
 
-    response = requests.post(OLLAMA_URL, json=payload)
-    
-    # Streamed JSON — one line per token chunk
-    lines = response.text.strip().splitlines()
+# "-1" / "0" from the command line are durations in seconds for Ollama, anything else ("30m") a duration string
+def keep_alive_value(value):
+    return int(value) if str(value).lstrip("-").isdigit() else value
 
-    # Concatenate all token parts
-    full_response = ""
-    for line in lines:
-        try:
-            data = json.loads(line)
-            content = data.get("message", {}).get("content")
-            if content:
-                full_response += content
-        except json.JSONDecodeError:
-            continue
 
-    return full_response.strip()
+def format_turns(turns):
+    return "\n\n".join(f"User: {question}\nAssistant: {answer}" for question, answer in turns)
+
+
+def ask_ollama(prompt, on_token=None, keep_alive=KEEP_ALIVE):
+    with tracing.span("ask_ollama"):
+        messages = [{"role": "user", "content": prompt}]
+
+        # Tokens are parsed from the NDJSON stream as they arrive
+        return get_client(OLLAMA_URL).chat(MODEL_NAME, messages, on_token=on_token, keep_alive=keep_alive)
+
+
+# Multi-turn conversation over /api/generate. Each turn sends only the new message plus the context
+# tokens Ollama returned for the previous turn, so the server continues from its cached prompt instead
+# of reading the whole history again. Once the context passes token_budget, the older turns are
+# summarized in the background and the next turn starts a fresh context from the summary and the
+# most recent turns, which keeps per-turn latency flat however long the conversation gets.
+class ChatSession:
+    def __init__(self, model=MODEL_NAME, url=OLLAMA_URL, keep_alive=KEEP_ALIVE, token_budget=HISTORY_TOKEN_BUDGET,
+                 keep_turns=KEEP_RECENT_TURNS):
+        self.client = get_client(url)
+        self.model = model
+        self.keep_alive = keep_alive
+        self.token_budget = token_budget
+        self.keep_turns = keep_turns
+        self.turns = []  # (question, answer) since the last summary
+        self.summary = ""
+        self.context = None  # Ollama's token context of the conversation so far
+        self._compaction = None
+        self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="chat")
+
+    # Tokens the server holds for this session (estimated when it returned no context)
+    @property
+    def history_tokens(self):
+        if self.context is not None:
+            return len(self.context)
+        return estimate_tokens(self.summary + format_turns(self.turns)) if self.turns or self.summary else 0
+
+    def preload(self):
+        return self._pool.submit(self.client.load, self.model, self.keep_alive)
+
+    # New message only while the server context is live; after a reset, the summary and recent turns first
+    def _prompt(self, question):
+        if self.context is not None:
+            return question
+        parts = []
+        if self.summary:
+            parts.append(f"Summary of our conversation so far:\n{self.summary}")
+        if self.turns:
+            parts.append(format_turns(self.turns))
+        if not parts:
+            return question
+        return "\n\n".join(parts + [f"User: {question}"])
+
+    def ask(self, question, on_token=None):
+        if self._compaction is not None:
+            try:
+                self._compaction.result()
+            except Exception as e:
+                print(f"⚠️ Could not summarize the conversation ({e}), keeping the full history")
+            self._compaction = None
+
+        with tracing.span("chat.turn", turns=len(self.turns)) as span:
+            extra = {"keep_alive": self.keep_alive}
+            if self.context is not None:
+                extra["context"] = self.context
+            answer = self.client.generate(self.model, self._prompt(question), on_token=on_token, **extra)
+            self.context = self.client.last_stats.get("context")
+            self.turns.append((question, answer))
+            span.set(history_tokens=self.history_tokens)
+
+        # Summarize while the user reads the answer and types the next message
+        if self.history_tokens > self.token_budget and len(self.turns) > self.keep_turns:
+            self._compaction = self._pool.submit(self._compact)
+        return answer
+
+    # Recent turns are kept only while they fit in half the budget, so the fresh context has room to grow
+    def _compact(self):
+        split = len(self.turns) - self.keep_turns
+        while split < len(self.turns) and estimate_tokens(format_turns(self.turns[split:])) > self.token_budget // 2:
+            split += 1
+        transcript = format_turns(self.turns[:split])
+        if self.summary:
+            transcript = f"Earlier summary: {self.summary}\n\n{transcript}"
+        with tracing.span("chat.summarize", turns=split):
+            summary = self.client.generate(self.model, SUMMARY_PROMPT + transcript, keep_alive=self.keep_alive)
+        self.summary, self.turns, self.context = summary, self.turns[split:], None
+        tracing.count("chat.summaries")
+
+    def reset(self):
+        if self._compaction is not None and not self._compaction.cancel():
+            try:
+                self._compaction.result()  # Let a running summary finish before clearing what it writes
+            except Exception:
+                pass
+        self._compaction = None
+        self.turns, self.summary, self.context = [], "", None
+
+    def close(self):
+        self._pool.shutdown(wait=False)
+
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Multi-turn chat with an Ollama model")
+    parser.add_argument("--model", default=MODEL_NAME)
+    parser.add_argument("--keep-alive", default=KEEP_ALIVE, type=keep_alive_value,
+                        help="how long the model stays loaded between turns, e.g. 30m, -1 (forever) or 0")
+    parser.add_argument("--no-preload", action="store_true", help="load the model on the first message instead")
+    args = parser.parse_args()
+
+    session = ChatSession(args.model, keep_alive=args.keep_alive)
+    if PRELOAD and not args.no_preload:
+        session.preload()
+    print("💬 Type 'exit' to quit, '/reset' to start a new conversation")
     while True:
         user_input = input("You: ")
         if user_input.lower() in {"exit", "quit"}:
             break
+        if user_input.strip() == "/reset":
+            session.reset()
+            continue
         try:
-            answer = ask_ollama(user_input)
-            print("AI:", answer)
+            print("AI: ", end="", flush=True)
+            session.ask(user_input, on_token=print_token)
+            print(f"\n{format_stats(session.client.last_stats)} · history {session.history_tokens} tokens")
         except Exception as e:
-            print("❌ Error:", e)
\ No newline at end of file
+            print("❌ Error:", e)
+    session.close()
@@ -0,0 +1,100 @@
+import os
+import json
+import mmap
+import struct
+import itertools
+import numpy as np
+
+# File layout: header | JSON records blob | ids (int64, sorted) | starts (uint64) | ends (uint64)
+MAGIC = b"CHUNKS01"
+HEADER = struct.Struct("<8sQQ")  # magic, record count, offset of the ids table
+
+
+# Write (id, record) pairs to a chunk store file; records are any JSON-serializable value
+def write_chunk_store(path, items):
+    tmp_path = path + ".tmp"
+    ids, starts, ends = [], [], []
+
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, 0, 0))
+        for chunk_id, record in items:
+            data = json.dumps(record, ensure_ascii=False).encode("utf-8")
+            ids.append(int(chunk_id))
+            starts.append(f.tell())
+            f.write(data)
+            ends.append(f.tell())
+
+        # Lookup tables sorted by ID so reads can binary-search them
+        order = np.argsort(np.array(ids, dtype="int64"), kind="stable")
+        table_offset = f.tell()
+        f.write(np.array(ids, dtype="<i8")[order].tobytes())
+        f.write(np.array(starts, dtype="<u8")[order].tobytes())
+        f.write(np.array(ends, dtype="<u8")[order].tobytes())
+
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, len(ids), table_offset))
+
+    os.replace(tmp_path, path)
+
+
+# Read-only, memory-mapped chunk store: records are decoded lazily by ID
+class ChunkStore:
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, count, table_offset = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a chunk store")
+        self._ids = np.frombuffer(self._mmap, dtype="<i8", count=count, offset=table_offset)
+        self._starts = np.frombuffer(self._mmap, dtype="<u8", count=count, offset=table_offset + 8 * count)
+        self._ends = np.frombuffer(self._mmap, dtype="<u8", count=count, offset=table_offset + 16 * count)
+
+    def _position(self, chunk_id):
+        pos = int(np.searchsorted(self._ids, chunk_id))
+        if pos < len(self._ids) and self._ids[pos] == chunk_id:
+            return pos
+        return None
+
+    def _record(self, pos):
+        return json.loads(self._mmap[int(self._starts[pos]):int(self._ends[pos])].decode("utf-8"))
+
+    def __getitem__(self, chunk_id):
+        pos = self._position(chunk_id)
+        if pos is None:
+            raise KeyError(chunk_id)
+        return self._record(pos)
+
+    def get(self, chunk_id, default=None):
+        pos = self._position(chunk_id)
+        return default if pos is None else self._record(pos)
+
+    def __contains__(self, chunk_id):
+        return self._position(chunk_id) is not None
+
+    def __len__(self):
+        return len(self._ids)
+
+    def ids(self):
+        return np.array(self._ids)
+
+    def items(self):
+        for pos in range(len(self._ids)):
+            yield int(self._ids[pos]), self._record(pos)
+
+    def close(self):
+        self._ids = self._starts = self._ends = None
+        self._mmap.close()
+
+
+# Rewrite a store without the removed IDs and with the added (id, record) pairs, returning the reopened store
+def update_chunk_store(store, removed_ids, added):
+    removed = set(removed_ids)
+    path = store.path
+    kept = ((chunk_id, record) for chunk_id, record in store.items() if chunk_id not in removed)
+
+    write_chunk_store(path + ".next", itertools.chain(kept, added))
+    store.close()
+    os.replace(path + ".next", path)
+    return ChunkStore(path)
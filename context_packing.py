@@ -0,0 +1,54 @@
+import numpy as np
+
+# Context assembly settings
+CONTEXT_TOKEN_BUDGET = 3000  # prompt tokens spent on retrieved chunks
+MMR_LAMBDA = 0.7  # 1.0 = pure relevance, lower values favour diversity
+DUPLICATE_THRESHOLD = 0.95  # cosine similarity above which a chunk counts as a near-duplicate
+CHARS_PER_TOKEN = 4
+
+
+# Rough token count (no tokenizer needed; ~4 characters per token for English text)
+def estimate_tokens(text):
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype="float32")
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+# Pick chunks by maximal marginal relevance until the token budget is spent; near-duplicates of
+# already picked chunks are dropped. Returns candidate positions ordered by relevance.
+def pack_context(texts, vectors, query_vector, token_budget=CONTEXT_TOKEN_BUDGET, mmr_lambda=MMR_LAMBDA,
+                 duplicate_threshold=DUPLICATE_THRESHOLD):
+    if len(texts) == 0:
+        return []
+
+    vectors = _normalize(vectors)
+    relevance = vectors @ _normalize(query_vector)
+    tokens = np.array([estimate_tokens(text) for text in texts])
+
+    available = np.ones(len(texts), dtype=bool)
+    max_similarity = np.full(len(texts), -1.0, dtype="float32")  # to the closest picked chunk
+    selected = []
+    used = 0
+
+    while available.any():
+        mmr = mmr_lambda * relevance - (1 - mmr_lambda) * np.maximum(max_similarity, 0)
+        best = int(np.argmax(np.where(available, mmr, -np.inf)))
+        available[best] = False
+
+        if used + tokens[best] > token_budget:
+            if not selected:
+                continue  # Skip an oversized top chunk rather than returning an empty context
+            break
+
+        selected.append(best)
+        used += tokens[best]
+
+        similarity = vectors @ vectors[best]
+        max_similarity = np.maximum(max_similarity, similarity)
+        available &= max_similarity < duplicate_threshold
+
+    return sorted(selected, key=lambda i: -relevance[i])
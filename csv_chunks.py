@@ -0,0 +1,87 @@
+import numpy as np
+import pandas as pd
+
+# CSV settings
+CSV_CHUNK_ROWS = 200_000  # rows parsed per pandas chunk
+BAD_ROW_EXAMPLES = 10  # row numbers listed in the malformed-rows summary
+
+BUS_STOP_COLUMNS = ["OBJECTID", "stop_name", "jurisdiction", "Routes", "BikeRacks"]
+
+
+# "Column: value" lines for every non-empty cell, built column by column instead of row by row
+def frame_text_chunks(df):
+    text = pd.Series("", index=df.index, dtype=object)
+    for col in df.columns:
+        values = df[col]
+        stripped = values.astype(str).str.strip()
+        present = values.notna() & (stripped != "")
+        label = f"{str(col).strip().capitalize()}: "
+        text = text + np.where(present, label + stripped + "\n", "")
+
+    text = text.str[:-1]  # Drop the trailing newline separator
+    return text[text != ""].tolist()
+
+
+# Text chunks of a generic CSV file, one per row, read in chunks with every column kept as text
+def iter_csv_text_chunks(path, chunk_rows=CSV_CHUNK_ROWS):
+    for df in pd.read_csv(path, dtype=str, chunksize=chunk_rows):
+        yield from frame_text_chunks(df)
+
+
+# Print one summary for all malformed rows instead of failing (or skipping silently) row by row
+def report_bad_rows(bad_rows, source):
+    if len(bad_rows) == 0:
+        return
+    reasons = bad_rows["reason"].value_counts()
+    examples = ", ".join(str(row) for row in bad_rows["row"].head(BAD_ROW_EXAMPLES))
+    print(f"⚠️ Skipped {len(bad_rows)} malformed rows in {source} "
+          f"({', '.join(f'{reason}: {count}' for reason, count in reasons.items())}; rows {examples}...)")
+
+
+# Structured bus stop chunks for one DataFrame; returns (chunks, malformed rows)
+def frame_bus_stop_chunks(df, first_row=0):
+    object_ids = pd.to_numeric(df["OBJECTID"], errors="coerce")
+    bike_racks = pd.to_numeric(df["BikeRacks"], errors="coerce")
+    stop_names = df["stop_name"].fillna("nan").astype(str)  # Same text as str(value) per row
+    jurisdictions = df["jurisdiction"].fillna("nan").astype(str)
+    routes = df["Routes"].fillna("nan").astype(str)
+
+    # Missing bike racks count as 0; values that are present but not numbers make the row malformed
+    bad_id = object_ids.isna()
+    bad_racks = (df["BikeRacks"].notna() & bike_racks.isna()) | np.isinf(bike_racks)
+    valid = ~(bad_id | bad_racks)
+
+    racks = np.trunc(bike_racks.where(valid & bike_racks.notna(), 0)).astype("int64")
+    text = ("Bus stop '" + stop_names + "' is located in " + jurisdictions + " and is served by route(s) "
+            + routes + ". It has " + racks.astype(str) + " bike racks.")
+
+    chunks = pd.DataFrame({
+        "objectId": np.trunc(object_ids.where(valid, 0)).astype("int64"),
+        "stopName": stop_names,
+        "jurisdiction": jurisdictions,
+        "routes": routes,
+        "bikeRacks": racks,
+        "text": text
+    })[valid].to_dict("records")
+
+    bad_rows = pd.DataFrame({
+        "row": np.arange(first_row, first_row + len(df))[~valid.to_numpy()],
+        "reason": np.where(bad_id, "OBJECTID", "BikeRacks")[~valid.to_numpy()]
+    })
+    return chunks, bad_rows
+
+
+# Structured bus stop chunks for a whole CSV, parsed in chunks with explicit dtypes
+def read_bus_stop_chunks(path, chunk_rows=CSV_CHUNK_ROWS):
+    chunks, bad_rows = [], []
+    first_row = 0
+    reader = pd.read_csv(path, usecols=BUS_STOP_COLUMNS, dtype={col: str for col in BUS_STOP_COLUMNS},
+                         chunksize=chunk_rows)
+    for df in reader:
+        frame_chunks, frame_bad_rows = frame_bus_stop_chunks(df, first_row)
+        chunks.extend(frame_chunks)
+        bad_rows.append(frame_bad_rows)
+        first_row += len(df)
+
+    report_bad_rows(pd.concat(bad_rows, ignore_index=True) if bad_rows else pd.DataFrame(columns=["row", "reason"]), path)
+    return chunks
@@ -0,0 +1,251 @@
+import os
+import re
+import time
+import hashlib
+import sqlite3
+import threading
+import numpy as np
+from tqdm import tqdm
+import tracing
+
+# Shared embedding settings
+EMBED_MODEL_NAME = "all-MiniLM-L6-v2"
+EMBED_BATCH_SIZE = 64
+EMBED_WORKERS = 1  # >1 spreads encoding over a multi-process pool, None uses every CPU core
+BLOCK_BATCHES = 16  # batches handed to the encoder per progress step
+EMBED_CACHE_DIR = ".embedding_cache"
+EMBED_CACHE_MAX_MB = 512  # least recently used vectors are evicted beyond this size
+
+
+# Encode texts in length-sorted batches straight into a preallocated float32 array
+def encode_texts(embedder, texts, batch_size=EMBED_BATCH_SIZE, workers=EMBED_WORKERS, desc="🔢 Embedding chunks",
+                 show_progress=True):
+    texts = list(texts)
+    dim = embedder.get_sentence_embedding_dimension()
+    embeddings = np.empty((len(texts), dim), dtype="float32")
+    if not texts:
+        return embeddings
+
+    # Sort by length so each batch pads to similar lengths; results are scattered back by position
+    order = np.argsort([-len(t) for t in texts], kind="stable")
+    block = batch_size * BLOCK_BATCHES
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    pool = None
+    if workers > 1:
+        pool = embedder.start_multi_process_pool(target_devices=["cpu"] * workers)
+
+    try:
+        with tqdm(total=len(texts), desc=desc, disable=not show_progress) as progress:
+            for start in range(0, len(texts), block):
+                ids = order[start:start + block]
+                batch = [texts[i] for i in ids]
+                if pool is not None:
+                    vectors = embedder.encode_multi_process(batch, pool, batch_size=batch_size,
+                                                            chunk_size=max(1, len(batch) // workers))
+                else:
+                    vectors = embedder.encode(batch, batch_size=batch_size, convert_to_numpy=True)
+                embeddings[ids] = vectors
+                progress.update(len(ids))
+    finally:
+        if pool is not None:
+            embedder.stop_multi_process_pool(pool)
+
+    return embeddings
+
+
+# Cache key for a text (the model name is part of the cache directory)
+def text_key(text):
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+
+# On-disk embedding cache: vectors live in a memory-mapped float32 file, an SQLite table maps
+# text hashes to rows and tracks last use for LRU eviction once the size bound is reached
+class EmbeddingCache:
+    def __init__(self, model_name, dim, cache_dir=EMBED_CACHE_DIR, max_mb=EMBED_CACHE_MAX_MB):
+        self.dim = dim
+        self.capacity = max(1, (max_mb << 20) // (dim * 4))
+        root = os.path.join(cache_dir, re.sub(r"[^A-Za-z0-9_.-]", "_", model_name))
+        os.makedirs(root, exist_ok=True)
+
+        self.vectors_path = os.path.join(root, f"vectors_{dim}.f32")
+        self.db = sqlite3.connect(os.path.join(root, f"index_{dim}.sqlite"), isolation_level=None, check_same_thread=False)
+        self.lock = threading.Lock()  # Scripts and the query service share one cache across threads
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, slot INTEGER NOT NULL UNIQUE, last_used REAL NOT NULL)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)")
+        self.vectors = None
+        self._open_vectors()
+
+    def _open_vectors(self, rows=0):
+        size = os.path.getsize(self.vectors_path) if os.path.exists(self.vectors_path) else 0
+        if rows * self.dim * 4 > size:
+            self.vectors = None  # Drop the old mapping before resizing the file
+            with open(self.vectors_path, "ab") as f:
+                f.truncate(rows * self.dim * 4)
+            size = rows * self.dim * 4
+        if size:
+            self.vectors = np.memmap(self.vectors_path, dtype="float32", mode="r+", shape=(size // (self.dim * 4), self.dim))
+
+    def __len__(self):
+        return self.db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    # Look up cached vectors, returning {key: vector} for the hits
+    def get_many(self, keys):
+        with self.lock:
+            return self._get_many(keys)
+
+    def _get_many(self, keys):
+        found = {}
+        keys = list(dict.fromkeys(keys))
+        now = time.time()
+        for start in range(0, len(keys), 500):
+            batch = keys[start:start + 500]
+            rows = self.db.execute(
+                f"SELECT key, slot FROM entries WHERE key IN ({','.join('?' * len(batch))})", batch
+            ).fetchall()
+            for key, slot in rows:
+                if self.vectors is not None and slot < len(self.vectors):
+                    found[key] = np.array(self.vectors[slot])
+            if rows:
+                self.db.executemany("UPDATE entries SET last_used = ? WHERE key = ?", [(now, key) for key, _ in rows])
+        return found
+
+    # Store new vectors, reusing the slots of the least recently used entries once full
+    def put_many(self, keys, vectors):
+        with self.lock:
+            self._put_many(keys, vectors)
+
+    def _put_many(self, keys, vectors):
+        keys, vectors = list(keys)[-self.capacity:], np.asarray(vectors, dtype="float32")[-self.capacity:]
+        if not keys:
+            return
+
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            next_slot = self.db.execute("SELECT COALESCE(MAX(slot) + 1, 0) FROM entries").fetchone()[0]
+            fresh = max(0, min(len(keys), self.capacity - next_slot))
+            slots = list(range(next_slot, next_slot + fresh))
+            if fresh < len(keys):
+                evicted = self.db.execute(
+                    "SELECT key, slot FROM entries ORDER BY last_used LIMIT ?", (len(keys) - fresh,)
+                ).fetchall()
+                self.db.executemany("DELETE FROM entries WHERE key = ?", [(key,) for key, _ in evicted])
+                slots.extend(slot for _, slot in evicted)
+
+            needed = max(slots) + 1
+            if self.vectors is None or needed > len(self.vectors):
+                grown = 1024 if self.vectors is None else len(self.vectors) * 2
+                self._open_vectors(min(self.capacity, max(needed, grown)))
+
+            now = time.time()
+            self.vectors[slots] = vectors
+            self.vectors.flush()
+            self.db.executemany(
+                "INSERT OR REPLACE INTO entries (key, slot, last_used) VALUES (?, ?, ?)",
+                [(key, slot, now) for key, slot in zip(keys, slots)]
+            )
+            self.db.execute("COMMIT")
+        except Exception:
+            self.db.execute("ROLLBACK")
+            raise
+
+
+# Embedding dimension recorded by an earlier run, so cached lookups work before the model is loaded
+def _dim_path(model_name, cache_dir=EMBED_CACHE_DIR):
+    return os.path.join(cache_dir, re.sub(r"[^A-Za-z0-9_.-]", "_", model_name), "dim")
+
+
+def _read_dim(model_name):
+    try:
+        with open(_dim_path(model_name)) as f:
+            return int(f.read())
+    except (OSError, ValueError):
+        return None
+
+
+# SentenceTransformer wrapper that only encodes texts missing from the embedding cache. The model (and
+# torch with it) is loaded on first use, so texts that are all cached never wait for it.
+class CachedEmbedder:
+    def __init__(self, model_name=EMBED_MODEL_NAME, model=None, cache=None):
+        self.model_name = model_name
+        self._model = model
+        self._cache = cache
+        self._dim = model.get_sentence_embedding_dimension() if model is not None else _read_dim(model_name)
+        self._lock = threading.Lock()
+
+    @property
+    def model(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    with tracing.span("load_model", model=self.model_name):
+                        from sentence_transformers import SentenceTransformer
+                        model = SentenceTransformer(self.model_name)
+                    self._dim = model.get_sentence_embedding_dimension()
+                    os.makedirs(os.path.dirname(_dim_path(self.model_name)), exist_ok=True)
+                    with open(_dim_path(self.model_name), "w") as f:
+                        f.write(str(self._dim))
+                    self._model = model
+        return self._model
+
+    @property
+    def cache(self):
+        if self._cache is None:
+            dim = self.get_sentence_embedding_dimension()
+            with self._lock:
+                if self._cache is None:
+                    self._cache = EmbeddingCache(self.model_name, dim)
+        return self._cache
+
+    def get_sentence_embedding_dimension(self):
+        if self._dim is None:
+            return self.model.get_sentence_embedding_dimension()
+        return self._dim
+
+    # Load the model in a background thread (e.g. while an interactive prompt is already showing)
+    def warm_up(self):
+        thread = threading.Thread(target=lambda: self.model, name="embedder-warm-up", daemon=True)
+        thread.start()
+        return thread
+
+    def encode(self, texts, batch_size=EMBED_BATCH_SIZE, workers=1, show_progress_bar=False, desc="🔢 Embedding chunks"):
+        single = isinstance(texts, str)
+        texts = [texts] if single else list(texts)
+        with tracing.span("embed", texts=len(texts)) as span:
+            keys = [text_key(text) for text in texts]
+            found = self.cache.get_many(keys)
+
+            missing = {}
+            for key, text in zip(keys, texts):
+                if key not in found:
+                    missing.setdefault(key, text)
+            span.set(encoded=len(missing))
+            tracing.count("embedding_cache.hits", len(texts) - len(missing))
+            tracing.count("embedding_cache.misses", len(missing))
+
+            if missing:
+                vectors = encode_texts(self.model, list(missing.values()), batch_size=batch_size, workers=workers,
+                                       desc=desc, show_progress=show_progress_bar)
+                self.cache.put_many(missing.keys(), vectors)
+                found.update(zip(missing.keys(), vectors))
+
+        embeddings = np.empty((len(texts), self.get_sentence_embedding_dimension()), dtype="float32")
+        for i, key in enumerate(keys):
+            embeddings[i] = found[key]
+        return embeddings[0] if single else embeddings
+
+
+_embedders = {}
+_embedders_lock = threading.Lock()
+
+
+# Shared embedder for a model behind the embedding cache (once per process); the model itself loads lazily
+def load_embedder(model_name=EMBED_MODEL_NAME):
+    with _embedders_lock:
+        if model_name not in _embedders:
+            _embedders[model_name] = CachedEmbedder(model_name)
+        return _embedders[model_name]
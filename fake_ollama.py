@@ -0,0 +1,109 @@
+import json
+import time
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Defaults for the fake server
+FAKE_PORT = 11435
+TOKEN_LATENCY = 0.02  # seconds between streamed tokens
+FIRST_TOKEN_LATENCY = 0.1  # extra delay before the first token (prompt evaluation)
+
+
+# Streams NDJSON like Ollama's /api/chat and /api/generate, echoing the prompt back token by token
+class FakeOllamaHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep-alive, so clients can reuse pooled connections
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_chunk(self, data):
+        body = (json.dumps(data) + "\n").encode("utf-8")
+        self.wfile.write(f"{len(body):x}\r\n".encode("ascii") + body + b"\r\n")
+        self.wfile.flush()
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        payload = json.loads(self.rfile.read(length) or b"{}")
+        with self.server.lock:
+            self.server.requests.append({"path": self.path, "payload": payload})
+
+        if self.path == "/api/chat":
+            messages = payload.get("messages", [])
+            prompt = messages[-1].get("content", "") if messages else ""
+        elif self.path == "/api/generate":
+            prompt = payload.get("prompt", "")
+        else:
+            self.send_error(404)
+            return
+
+        reply = self.server.reply or f"Answer to: {' '.join(prompt.split()[-self.server.echo_words:])}"
+        tokens = [word + " " for word in reply.split()] if prompt else []  # Empty prompt just loads the model
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        model = payload.get("model", "fake")
+        start = time.perf_counter()
+        if tokens:
+            time.sleep(self.server.first_token_latency)
+        for token in tokens:
+            time.sleep(self.server.token_latency)
+            if self.path == "/api/chat":
+                self._send_chunk({"model": model, "message": {"role": "assistant", "content": token}, "done": False})
+            else:
+                self._send_chunk({"model": model, "response": token, "done": False})
+
+        final = {
+            "model": model,
+            "done": True,
+            "eval_count": len(tokens),
+            "eval_duration": int((time.perf_counter() - start) * 1e9),
+            "prompt_eval_count": len(prompt.split())
+        }
+        if self.path == "/api/chat":
+            final["message"] = {"role": "assistant", "content": ""}
+        else:
+            final["response"] = ""
+            final["context"] = list(payload.get("context", [])) + list(range(len(prompt.split()) + len(tokens)))
+        self._send_chunk(final)
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+
+# Start a fake Ollama server on a background thread; returns (server, base URL)
+def start_fake_ollama(port=0, token_latency=TOKEN_LATENCY, first_token_latency=FIRST_TOKEN_LATENCY, reply=None, echo_words=8):
+    server = ThreadingHTTPServer(("127.0.0.1", port), FakeOllamaHandler)
+    server.daemon_threads = True
+    server.token_latency = token_latency
+    server.first_token_latency = first_token_latency
+    server.reply = reply
+    server.echo_words = echo_words
+    server.lock = threading.Lock()
+    server.connections = 0
+    server.requests = []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fake Ollama server for local testing and benchmarks")
+    parser.add_argument("--port", type=int, default=FAKE_PORT)
+    parser.add_argument("--token-latency", type=float, default=TOKEN_LATENCY)
+    parser.add_argument("--first-token-latency", type=float, default=FIRST_TOKEN_LATENCY)
+    args = parser.parse_args()
+
+    server, url = start_fake_ollama(args.port, args.token_latency, args.first_token_latency)
+    print(f"🧪 Fake Ollama listening on {url} (Ctrl+C to stop)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
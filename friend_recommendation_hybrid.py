@@ -1,101 +1,186 @@
 import json
-import faiss
-from sentence_transformers import SentenceTransformer
+import numpy as np
+import scipy.sparse as sp
+from embeddings import load_embedder
+from user_store import VectorStore, print_sync_stats
+from geo_utils import haversine_km
 from geopy.distance import geodesic
 from collections import defaultdict
 
-# Load users and events
-with open("dummy_users.json") as f:
-    users = json.load(f)
-with open("events_with_rsvp_semantic.json") as f:
-    events = json.load(f)
+USER_COLLECTION = "friends"  # user store collection (see user_store.py)
+USER_INDEX_TYPE = "flat"  # "flat", "ivf", "hnsw", "ivfpq", "fp16", "sq8", "binary" or "pca" (see index_factory.py)
+TOP_K = 10
+SEARCH_K = TOP_K + 10  # Extra results for filtering
+SEARCH_BLOCK_SIZE = 4096  # users searched per (multi-threaded) faiss call
+LOCATION_BANDS = [(10, 0.25), (50, 0.1)]  # (max km, bonus)
+GEODESIC_MARGIN = 0.006  # haversine is within ~0.5% of geodesic; re-check pairs this close to a band edge
 
-embedder = SentenceTransformer("all-MiniLM-L6-v2")
 
 # Step 1: Prepare user data
-user_profiles = []
-user_emails = []
-user_locations = {}
-user_lookup = {}
-user_attendance = defaultdict(set)
-
-for user in users:
-    email = user.get("email")
-    interests = user.get("interests", [])
-    bio = user.get("bio", "")
-    location = user.get("location", None)
-
-    if email and interests and isinstance(interests, list):
-        profile = f"{bio} Interests: {', '.join(interests)}"
-        user_profiles.append(profile)
-        user_emails.append(email)
-        user_lookup[email] = user
-        if isinstance(location, dict):
-            lat = location.get("latitude")
-            lon = location.get("longitude")
-            if lat and lon:
-                user_locations[email] = (lat, lon)
-
-# Step 2: Build attendance map
-for event in events:
-    eid = event.get("id", event.get("title", "unknown"))
-    for rsvp in event.get("rsvpList", []):
-        if rsvp.get("status") == "attended":
-            user_attendance[rsvp["email"]].add(eid)
-
-# Step 3: Generate embeddings
-embeddings = embedder.encode(user_profiles, show_progress_bar=True)
-faiss_index = faiss.IndexFlatL2(embeddings.shape[1])
-faiss_index.add(embeddings)
-
-# Step 4: Recommend friends using hybrid scoring
-recommendations = {}
-TOP_K = 10
-
-for idx, email in enumerate(user_emails):
-    query_emb = embeddings[idx].reshape(1, -1)
-    D, I = faiss_index.search(query_emb, TOP_K + 10)  # Extra results for filtering
-    recos = []
-
-    base_events = user_attendance[email]
-    user_loc = user_locations.get(email)
-
-    for result_idx, i in enumerate(I[0]):
-        if i == idx:
-            continue  # Skip self
-
-        reco_email = user_emails[i]
-        emb_score = float(1 / (1 + D[0][result_idx]))
-
-        # Co-attendance score
-        reco_events = user_attendance[reco_email]
-        shared_events = base_events.intersection(reco_events)
-        co_score = len(shared_events) / len(base_events) if base_events else 0.0
-
-        # Location bonus
-        loc_bonus = 0
-        reco_loc = user_locations.get(reco_email)
-        if user_loc and reco_loc:
-            dist_km = geodesic(user_loc, reco_loc).km
-            if dist_km <= 10:
-                loc_bonus = 0.25
-            elif dist_km <= 50:
-                loc_bonus = 0.1
-
-        # Final hybrid score
-        total_score = 0.5 * emb_score + 0.3 * co_score + 0.2 * loc_bonus
-        recos.append({
-            "email": reco_email,
-            "score": round(total_score, 4),
-            "sharedEvents": list(shared_events)
-        })
-
-    # Sort and limit top results
-    recos = sorted(recos, key=lambda x: -x["score"])
-    recommendations[email] = recos[:TOP_K]
-
-# Step 5: Save results
-with open("friend_recommendations_hybrid.json", "w") as f:
-    json.dump(recommendations, f, indent=2)
-
-print("✅ friend_recommendations_hybrid.json generated using embeddings, co-attendance, and location.")
\ No newline at end of file
+def prepare_users(users, events):
+    user_profiles = []
+    user_emails = []
+    user_locations = {}
+    user_attendance = defaultdict(set)
+
+    for user in users:
+        email = user.get("email")
+        interests = user.get("interests", [])
+        bio = user.get("bio", "")
+        location = user.get("location", None)
+
+        if email and interests and isinstance(interests, list):
+            profile = f"{bio} Interests: {', '.join(interests)}"
+            user_profiles.append(profile)
+            user_emails.append(email)
+            if isinstance(location, dict):
+                lat = location.get("latitude")
+                lon = location.get("longitude")
+                if lat and lon:
+                    user_locations[email] = (lat, lon)
+
+    # Step 2: Build attendance map
+    for event in events:
+        eid = event.get("id", event.get("title", "unknown"))
+        for rsvp in event.get("rsvpList", []):
+            if rsvp.get("status") == "attended":
+                user_attendance[rsvp["email"]].add(eid)
+
+    return user_profiles, user_emails, user_locations, user_attendance
+
+
+# Sync profiles into the persistent user store, with coordinates and attended event IDs as metadata
+def load_user_store(users, events, embedder=None):
+    user_profiles, user_emails, user_locations, user_attendance = prepare_users(users, events)
+    records = []
+    for profile, email in zip(user_profiles, user_emails):
+        lat, lon = user_locations.get(email, (None, None))
+        records.append((email, profile, {"latitude": lat, "longitude": lon,
+                                         "attended": sorted(user_attendance.get(email, ()), key=str)}))
+
+    store = VectorStore(USER_COLLECTION, embedder, USER_INDEX_TYPE)
+    print_sync_stats(store, store.sync(records))
+    return store
+
+
+# recommend_friends inputs from the store: vectors, emails, locations and attendance in store order
+def store_inputs(store):
+    user_locations, user_attendance = {}, defaultdict(set)
+    for email, meta in zip(store.keys, store.metadata):
+        if meta["latitude"] is not None:
+            user_locations[email] = (meta["latitude"], meta["longitude"])
+        user_attendance[email].update(meta["attended"])
+    return store.vectors(), store.keys, user_locations, user_attendance
+
+
+# Sparse user x event attendance matrix (rows follow user_emails)
+def attendance_matrix(user_emails, user_attendance):
+    event_ids = {}
+    rows, cols = [], []
+    for row, email in enumerate(user_emails):
+        for eid in user_attendance.get(email, ()):
+            rows.append(row)
+            cols.append(event_ids.setdefault(eid, len(event_ids)))
+    data = np.ones(len(rows), dtype="float32")
+    return sp.csr_matrix((data, (rows, cols)), shape=(len(user_emails), max(1, len(event_ids))))
+
+
+# Location bonus for candidate pairs: vectorized haversine, with an exact geodesic check near band edges
+def location_bonus(lat, lon, has_loc, query_rows, candidates):
+    bonus = np.zeros(candidates.shape)
+    known = has_loc[query_rows][:, None] & has_loc[candidates]
+    q_idx, c_pos = np.nonzero(known)
+    if len(q_idx) == 0:
+        return bonus
+
+    users, others = query_rows[q_idx], candidates[q_idx, c_pos]
+    dist = haversine_km(lat[users], lon[users], lat[others], lon[others])
+    for edge, _ in LOCATION_BANDS:
+        for i in np.nonzero(np.abs(dist - edge) <= edge * GEODESIC_MARGIN)[0]:
+            dist[i] = geodesic((lat[users[i]], lon[users[i]]), (lat[others[i]], lon[others[i]])).km
+
+    values = np.zeros(len(dist))
+    for max_km, value in reversed(LOCATION_BANDS):
+        values[dist <= max_km] = value
+    bonus[q_idx, c_pos] = values
+    return bonus
+
+
+# Step 4: Recommend friends using hybrid scoring, searching and scoring users block by block
+# (faiss_index is a FAISS index over the embeddings or a VectorStore; both return positions)
+def recommend_friends(embeddings, faiss_index, user_emails, user_locations, user_attendance, top_k=TOP_K,
+                      search_k=SEARCH_K, block_size=SEARCH_BLOCK_SIZE):
+    n = len(user_emails)
+    attendance = attendance_matrix(user_emails, user_attendance)
+    attendance_t = attendance.T.tocsr()
+    attended_counts = np.asarray(attendance.sum(axis=1)).ravel()
+    attended_sets = [user_attendance.get(email, set()) for email in user_emails]
+
+    coords = [user_locations.get(email) for email in user_emails]
+    has_loc = np.array([c is not None for c in coords])
+    lat = np.array([c[0] if c else 0.0 for c in coords], dtype="float64")
+    lon = np.array([c[1] if c else 0.0 for c in coords], dtype="float64")
+
+    recommendations = {}
+    for start in range(0, n, block_size):
+        rows = np.arange(start, min(start + block_size, n))
+        D, I = faiss_index.search(np.ascontiguousarray(embeddings[rows]), search_k)
+        valid = (I != -1) & (I != rows[:, None])  # Skip self and empty result slots
+        candidates = np.where(I == -1, 0, I)
+
+        emb_score = (1 / (1 + D)).astype("float64")  # float32 like the per-pair computation
+
+        # Co-attendance: shared events from the sparse product, normalized by the user's own count
+        shared = (attendance[rows] @ attendance_t).tocsr()
+        shared_counts = np.asarray(shared[np.repeat(np.arange(len(rows)), search_k), candidates.ravel()]).reshape(I.shape)
+        base = attended_counts[rows][:, None]
+        co_score = np.divide(shared_counts, base, out=np.zeros(I.shape), where=base > 0)
+
+        loc_bonus = location_bonus(lat, lon, has_loc, rows, candidates)
+
+        # Final hybrid score, rounded like the per-user output
+        total = 0.5 * emb_score + 0.3 * co_score + 0.2 * loc_bonus
+        scores = np.array([round(x, 4) for x in total.ravel().tolist()]).reshape(I.shape)
+
+        # Rank by score, ties in search order: one exact integer key per candidate, then argpartition
+        keys = np.rint(scores * 10000).astype("int64") * (search_k + 1) + (search_k - np.arange(search_k))
+        keys = np.where(valid, keys, -1)
+        kth = min(top_k, search_k) - 1
+        top = np.argpartition(-keys, kth, axis=1)[:, :top_k]
+        top = np.take_along_axis(top, np.argsort(-np.take_along_axis(keys, top, axis=1), axis=1), axis=1)
+
+        for row_pos, row in enumerate(rows):
+            base_events = attended_sets[row]
+            recos = []
+            for col in top[row_pos]:
+                if not valid[row_pos, col]:
+                    continue
+                reco = int(I[row_pos, col])
+                recos.append({
+                    "email": user_emails[reco],
+                    "score": float(scores[row_pos, col]),
+                    "sharedEvents": sorted(base_events.intersection(attended_sets[reco]), key=str)
+                })
+            recommendations[user_emails[row]] = recos
+
+    return recommendations
+
+
+if __name__ == "__main__":
+    # Load users and events
+    with open("dummy_users.json") as f:
+        users = json.load(f)
+    with open("events_with_rsvp_semantic.json") as f:
+        events = json.load(f)
+
+    # Step 3: Sync embeddings (only new or changed profiles are embedded)
+    store = load_user_store(users, events, load_embedder())
+    embeddings, user_emails, user_locations, user_attendance = store_inputs(store)
+
+    recommendations = recommend_friends(embeddings, store, user_emails, user_locations, user_attendance)
+
+    # Step 5: Save results
+    with open("friend_recommendations_hybrid.json", "w") as f:
+        json.dump(recommendations, f, indent=2)
+
+    print("✅ friend_recommendations_hybrid.json generated using embeddings, co-attendance, and location.")
@@ -0,0 +1,122 @@
+import os
+import csv
+import json
+import threading
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0088  # mean Earth radius
+
+# Geocoding settings
+GEOCODE_CACHE_PATH = "geocode_cache.json"  # resolved place names, persisted between runs
+GAZETTEER_PATH = "gazetteer.csv"  # optional local gazetteer: name,latitude,longitude (name may be "city, state")
+GEOCODE_ONLINE = False  # fall back to Nominatim for names missing from the cache and gazetteer
+GEOCODE_USER_AGENT = "sahana-rag"
+
+
+# Great-circle distance in km between coordinate arrays (degrees), vectorized over NumPy broadcasting
+def haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(value, dtype="float64")) for value in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+# Canonical lookup key for a place name ("  New York ,NY" -> "new york, ny")
+def place_key(name):
+    return ", ".join(part.strip().lower() for part in str(name).split(",") if part.strip())
+
+
+# Gazetteer entries (key -> (lat, lon)) from the users' own city / state, averaged per place
+def gazetteer_from_users(users):
+    sums = {}
+    for user in users:
+        loc = user.get("location") or {}
+        lat, lon, city = loc.get("latitude"), loc.get("longitude"), loc.get("city")
+        if lat is None or lon is None or not city:
+            continue
+        names = [city] + ([f"{city}, {loc['state']}"] if loc.get("state") else [])
+        for key in map(place_key, names):
+            total = sums.setdefault(key, [0.0, 0.0, 0])
+            total[0] += lat
+            total[1] += lon
+            total[2] += 1
+    return {key: (lat / n, lon / n) for key, (lat, lon, n) in sums.items()}
+
+
+# Gazetteer entries from a local CSV file (missing file -> empty)
+def read_gazetteer(path=GAZETTEER_PATH):
+    if not os.path.exists(path):
+        return {}
+    with open(path, newline="", encoding="utf-8") as f:
+        return {place_key(row["name"]): (float(row["latitude"]), float(row["longitude"]))
+                for row in csv.DictReader(f) if row.get("name")}
+
+
+# Place name -> (lat, lon) resolver: persistent cache, then local gazetteer, then (optionally) Nominatim
+class Geocoder:
+    def __init__(self, gazetteer=None, cache_path=GEOCODE_CACHE_PATH, online=GEOCODE_ONLINE):
+        self.cache_path = cache_path
+        self.gazetteer = dict(gazetteer or {})
+        self.online = online
+        self.lock = threading.Lock()
+        self._nominatim = None
+        self.cache = {}
+        if os.path.exists(cache_path):
+            with open(cache_path) as f:
+                self.cache = {key: tuple(value) if value else None for key, value in json.load(f).items()}
+
+    def _geocode_online(self, name):
+        if self._nominatim is None:
+            from geopy.geocoders import Nominatim
+            self._nominatim = Nominatim(user_agent=GEOCODE_USER_AGENT)
+        try:
+            location = self._nominatim.geocode(name)
+        except Exception as e:
+            print(f"⚠️ Geocoding failed for '{name}': {e}")
+            return None, False  # Not cached: may succeed next time
+        return ((location.latitude, location.longitude) if location else None), True
+
+    def _save(self):
+        tmp_path = self.cache_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.cache, f, indent=2)
+        os.replace(tmp_path, self.cache_path)
+
+    def resolve(self, name):
+        key = place_key(name)
+        if not key:
+            return None
+        with self.lock:
+            if key in self.cache:
+                return self.cache[key]
+            if key in self.gazetteer:
+                return self.gazetteer[key]
+            if not self.online:
+                return None
+            coords, cacheable = self._geocode_online(name)
+            if cacheable:
+                self.cache[key] = coords  # Misses are cached too, so unknown names cost one call
+                self._save()
+            return coords
+
+
+# Ball tree (haversine metric) over point coordinates; rows without coordinates are left out
+class SpatialIndex:
+    def __init__(self, lats, lons):
+        from sklearn.neighbors import BallTree
+        lats = np.array([np.nan if v is None else v for v in lats], dtype="float64")
+        lons = np.array([np.nan if v is None else v for v in lons], dtype="float64")
+        self.positions = np.nonzero(~(np.isnan(lats) | np.isnan(lons)))[0]
+        points = np.radians(np.column_stack([lats[self.positions], lons[self.positions]]))
+        self.tree = BallTree(points, metric="haversine") if len(points) else None
+
+    def __len__(self):
+        return len(self.positions)
+
+    # Positions within radius_km of (lat, lon) and their distances in km, nearest first
+    def query_radius(self, lat, lon, radius_km):
+        if self.tree is None:
+            return np.array([], dtype="int64"), np.array([])
+        point = np.radians([[lat, lon]])
+        found, dist = self.tree.query_radius(point, r=radius_km / EARTH_RADIUS_KM, return_distance=True,
+                                             sort_results=True)
+        return self.positions[found[0]], dist[0] * EARTH_RADIUS_KM
@@ -0,0 +1,347 @@
+import math
+import time
+import json
+import argparse
+import faiss
+import numpy as np
+
+# Index settings shared by every script
+INDEX_TYPES = ["flat", "ivf", "hnsw", "ivfpq", "fp16", "sq8", "binary", "pca"]
+DEFAULT_INDEX_TYPE = "flat"
+TRAIN_SAMPLE_SIZE = 50_000  # vectors used to train IVF / PQ quantizers
+IVF_NPROBE = 16
+HNSW_M = 32
+HNSW_EF_SEARCH = 64
+PQ_BITS = 8
+BINARY_REFINE = "SQ8"  # codes the binary shortlist is re-ranked with (kept next to the bits: "SQfp16" doubles them)
+REFINE_K_FACTOR = 32  # binary / pca searches shortlist k * REFINE_K_FACTOR candidates before the re-rank
+PCA_DIM = 64  # dimensions of the pca index's coarse stage
+EXACT_BLOCK_SIZE = 50_000  # vectors reconstructed at a time when a subset is scored exactly
+REBUILD_TYPES = ["hnsw", "binary", "pca"]  # cannot remove vectors, so updates rebuild the index instead
+
+
+# Number of IVF lists for a dataset size (~4 * sqrt(n), with at least 39 training points per list)
+def ivf_nlist(n):
+    return max(1, min(65536, int(4 * math.sqrt(n)), n // 39))
+
+
+# Largest PQ sub-quantizer count that divides dim with at least 4 dims per sub-vector
+def pq_subquantizers(dim):
+    return max(m for m in range(1, dim // 4 + 1) if dim % m == 0)
+
+
+# faiss index_factory description for an index type sized to the dataset
+def factory_string(index_type, dim, n):
+    if index_type == "flat":
+        return "Flat"
+    if index_type == "ivf":
+        return f"IVF{ivf_nlist(n)},Flat"
+    if index_type == "hnsw":
+        return f"HNSW{HNSW_M}"
+    if index_type == "ivfpq":
+        return f"IVF{ivf_nlist(n)},PQ{pq_subquantizers(dim)}x{PQ_BITS}"
+    if index_type == "fp16":
+        return "SQfp16"  # float16 copies of the vectors: half the memory, near-identical distances
+    if index_type == "sq8":
+        return "SQ8"  # one byte per dimension (per-dimension min/max scaling): a quarter of the memory
+    if index_type == "binary":
+        return f"LSHrt,Refine({BINARY_REFINE})"  # 1-bit shortlist scan, re-ranked on the refine codes (dim / 8 + dim bytes)
+    if index_type == "pca":
+        return f"PCA{PCA_DIM},Flat,RFlat"  # shortlist from PCA-reduced vectors, re-scored exactly on the originals
+    raise ValueError(f"Unknown index type '{index_type}', expected one of {INDEX_TYPES}")
+
+
+# Apply query-time parameters (IVF nprobe, HNSW efSearch, re-rank shortlist size) to an index or its wrapped base index
+def configure_index(index, nprobe=IVF_NPROBE, ef_search=HNSW_EF_SEARCH, k_factor=REFINE_K_FACTOR):
+    base = faiss.downcast_index(index.index) if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)) else index
+    ivf = faiss.try_extract_index_ivf(base)
+    if ivf is not None:
+        ivf.nprobe = min(nprobe, ivf.nlist)
+    if hasattr(base, "hnsw"):
+        base.hnsw.efSearch = ef_search
+    if hasattr(base, "k_factor"):
+        base.k_factor = k_factor
+    return index
+
+
+# Create an empty index of the given type, trained on a sample of the vectors it will hold
+def create_index(embeddings, index_type=DEFAULT_INDEX_TYPE):
+    embeddings = np.ascontiguousarray(embeddings, dtype="float32")
+    n, dim = embeddings.shape
+
+    # Quantizers need enough points per centroid; tiny datasets stay exact
+    if index_type == "ivfpq" and n < (1 << PQ_BITS) * 4:
+        print(f"⚠️ {n} vectors are too few to train IVF-PQ, using a flat index")
+        index_type = "flat"
+    if index_type == "pca" and (dim <= PCA_DIM or n < dim):
+        print(f"⚠️ PCA{PCA_DIM} needs more than {PCA_DIM} dimensions and at least {dim} vectors, using a flat index")
+        index_type = "flat"
+
+    index = faiss.index_factory(dim, factory_string(index_type, dim, n))
+    if not index.is_trained:
+        sample = embeddings
+        if n > TRAIN_SAMPLE_SIZE:
+            sample = embeddings[np.random.default_rng(42).choice(n, TRAIN_SAMPLE_SIZE, replace=False)]
+        index.train(sample)
+
+    return configure_index(index)
+
+
+# Index that stores vectors under caller-chosen IDs. IVF indexes keep the IDs in their own inverted lists,
+# with a hashtable direct map so vectors stay reconstructable by ID (an IndexIDMap2 around an IVF can
+# neither remove nor reconstruct); every other type is wrapped in IndexIDMap2
+def id_mapped(index):
+    if isinstance(index, faiss.IndexIVF):
+        index.set_direct_map_type(faiss.DirectMap.Hashtable)
+        return index
+    return faiss.IndexIDMap2(index)
+
+
+# Remove vectors by ID (an IVF with a hashtable direct map only accepts an explicit ID array);
+# raises RuntimeError for index types that cannot remove, so callers can rebuild instead
+def remove_ids(index, ids):
+    ids = np.ascontiguousarray(ids, dtype="int64")
+    if isinstance(index, faiss.IndexIVF) and index.direct_map.type == faiss.DirectMap.Hashtable:
+        return index.remove_ids(faiss.IDSelectorArray(ids))
+    return index.remove_ids(ids)
+
+
+# Create an index of the given type and add the vectors to it
+def build_index(embeddings, index_type=DEFAULT_INDEX_TYPE):
+    index = create_index(embeddings, index_type)
+    index.add(np.ascontiguousarray(embeddings, dtype="float32"))
+    return index
+
+
+# Read an index from disk and restore its query-time parameters
+# With mmap=True the vectors / inverted lists stay in the file and are paged in on demand (near-instant
+# loads, shared page cache); such an index is read-only and its file must be replaced, not rewritten in place
+def load_index(path, mmap=False):
+    if mmap:
+        for flag_names in (("IO_FLAG_MMAP", "IO_FLAG_MMAP_IFC"), ("IO_FLAG_MMAP",)):
+            flags = [getattr(faiss, name, None) for name in flag_names]
+            if None in flags:
+                continue  # Older faiss builds lack IO_FLAG_MMAP_IFC
+            try:
+                index = faiss.read_index(path, sum(flags))
+                return configure_index(index)
+            except RuntimeError:
+                continue  # e.g. IVF lists cannot be mapped together with flat codes
+    return configure_index(faiss.read_index(path))
+
+
+# Stored vectors for the given IDs, or None when the index cannot reconstruct them
+def reconstruct_ids(index, ids):
+    try:
+        return index.reconstruct_batch(np.asarray(ids, dtype="int64"))
+    except RuntimeError:
+        return None
+
+
+# Exact top k among the given IDs, scored on their reconstructed vectors one block at a time
+def exact_search_ids(index, queries, k, ids, block_size=EXACT_BLOCK_SIZE):
+    ids = np.asarray(ids, dtype="int64")
+    D = np.full((len(queries), k), np.inf, dtype="float32")
+    I = np.full((len(queries), k), -1, dtype="int64")
+    for start in range(0, len(ids), block_size):
+        block = ids[start:start + block_size]
+        vectors = reconstruct_ids(index, block)
+        if vectors is None:
+            raise RuntimeError("index cannot reconstruct vectors for an exact subset search")
+        block_D, block_I = faiss.knn(queries, np.ascontiguousarray(vectors, dtype="float32"), min(k, len(block)))
+        D = np.concatenate([D, block_D], axis=1)
+        I = np.concatenate([I, np.where(block_I >= 0, block[np.maximum(block_I, 0)], -1)], axis=1)
+        order = np.argsort(D, axis=1, kind="stable")[:, :k]
+        D, I = np.take_along_axis(D, order, axis=1), np.take_along_axis(I, order, axis=1)
+    return D, I
+
+
+# Search restricted to the given IDs (faiss ID selector), keeping the index's nprobe / efSearch. Re-ranking
+# indexes (binary, pca) can't take a selector through their ID map, so their subset is scored exactly
+def search_ids(index, queries, k, ids):
+    queries = np.ascontiguousarray(queries, dtype="float32")
+    base = faiss.downcast_index(index.index) if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)) else index
+    if hasattr(base, "k_factor"):
+        return exact_search_ids(index, queries, k, ids)
+
+    selector = faiss.IDSelectorBatch(np.asarray(ids, dtype="int64"))
+    ivf = faiss.try_extract_index_ivf(base)
+    if ivf is not None:
+        params = faiss.SearchParametersIVF(sel=selector, nprobe=ivf.nprobe)
+    elif hasattr(base, "hnsw"):
+        params = faiss.SearchParametersHNSW(sel=selector, efSearch=base.hnsw.efSearch)
+    else:
+        params = faiss.SearchParameters(sel=selector)
+    return index.search(queries, k, params=params)
+
+
+# Pull every stored vector back out of a (possibly ID-mapped) flat index
+def read_vectors(path):
+    index = faiss.read_index(path)
+    base = faiss.downcast_index(index.index) if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)) else index
+    vectors = np.empty((base.ntotal, base.d), dtype="float32")
+    base.reconstruct_n(0, base.ntotal, vectors)
+    return vectors
+
+
+# Serialized size of an index in bytes
+def index_bytes(index):
+    return int(faiss.serialize_index(index).size)
+
+
+# Search queries one at a time; returns (result IDs, per-query latencies in ms)
+def timed_search(index, queries, k):
+    ids = np.empty((len(queries), k), dtype="int64")
+    latencies = np.empty(len(queries))
+    for i in range(len(queries)):
+        start = time.perf_counter()
+        _, I = index.search(queries[i:i + 1], k)
+        latencies[i] = (time.perf_counter() - start) * 1000
+        ids[i] = I[0]
+    return ids, latencies
+
+
+# Fraction of the exact top-k neighbours found by an approximate search
+def recall_at_k(ids, truth):
+    hits = sum(len(np.intersect1d(row[row >= 0], exact)) for row, exact in zip(ids, truth))
+    return hits / truth.size
+
+
+# Compare index types (and their nprobe / efSearch / re-rank settings) against exact search
+def tune(vectors, index_types, k=10, num_queries=500, nprobes=(1, 4, 16, 64), ef_searches=(16, 64, 256),
+         k_factors=(2, 8, 32)):
+    rng = np.random.default_rng(0)
+    order = rng.permutation(len(vectors))
+    queries = vectors[order[:num_queries]]
+    database = np.ascontiguousarray(vectors[order[num_queries:]])
+    print(f"📊 {len(database)} vectors, {len(queries)} held-out queries, recall@{k} vs exact search")
+
+    flat = build_index(database, "flat")
+    truth, _ = timed_search(flat, queries, k)
+    flat_bytes = index_bytes(flat)
+
+    results = []
+    for index_type in index_types:
+        start = time.perf_counter()
+        index = build_index(database, index_type)
+        build_s = time.perf_counter() - start
+
+        if faiss.try_extract_index_ivf(index) is not None:
+            settings = [{"nprobe": nprobe} for nprobe in nprobes]
+        elif hasattr(index, "hnsw"):
+            settings = [{"ef_search": ef} for ef in ef_searches]
+        elif hasattr(index, "k_factor"):
+            settings = [{"k_factor": k_factor} for k_factor in k_factors]
+        else:
+            settings = [{}]
+
+        for params in settings:
+            configure_index(index, **params)
+            ids, latencies = timed_search(index, queries, k)
+            results.append({
+                "index_type": index_type,
+                "params": params,
+                "recall": round(recall_at_k(ids, truth), 4),
+                "recall_vs_flat": round(recall_at_k(ids, truth) - 1, 4),  # exact flat search has recall 1
+                "p50_ms": round(float(np.percentile(latencies, 50)), 3),
+                "p99_ms": round(float(np.percentile(latencies, 99)), 3),
+                "build_s": round(build_s, 2),
+                "size_mb": round(index_bytes(index) / (1 << 20), 2),
+                "size_vs_flat": round(index_bytes(index) / flat_bytes, 3),
+                "bytes_per_vector": round(index_bytes(index) / len(database), 1),
+                "saved_mb": round((flat_bytes - index_bytes(index)) / (1 << 20), 2)
+            })
+
+    return results
+
+
+# Round-trip every index type through the ID-mapped add / remove / reconstruct / filtered search path the
+# scripts use; returns the failed checks as "type: problem" strings
+def check_index_types(index_types=INDEX_TYPES, n=4000, dim=128):
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(n, dim)).astype("float32")
+    ids = np.arange(n, dtype="int64") * 7 + 3  # Sparse IDs, like chunk IDs after deletes
+    removed, kept = ids[:n // 10], ids[n // 10:]
+    failures = []
+
+    for index_type in index_types:
+        index = id_mapped(create_index(vectors, index_type))
+        index.add_with_ids(vectors, ids)
+        if index.ntotal != n:
+            failures.append(f"{index_type}: add_with_ids stored {index.ntotal} of {n} vectors")
+
+        try:
+            count = remove_ids(index, removed)
+            if count != len(removed) or index.ntotal != len(kept):
+                failures.append(f"{index_type}: remove_ids removed {count} of {len(removed)} vectors")
+            _, I = index.search(vectors[:n // 10], 1)
+            if np.isin(I, removed).any():
+                failures.append(f"{index_type}: search still returns removed IDs")
+            if reconstruct_ids(index, removed[:5]) is not None:
+                failures.append(f"{index_type}: removed IDs are still reconstructable")
+        except RuntimeError as e:
+            if index_type not in REBUILD_TYPES:
+                failures.append(f"{index_type}: remove_ids failed ({str(e).splitlines()[0]})")
+
+        # Lossy codes are fine as long as each reconstruction is still nearest to its own original vector
+        sample = kept[::97]
+        reconstructed = reconstruct_ids(index, sample)
+        if reconstructed is None:
+            failures.append(f"{index_type}: cannot reconstruct vectors by ID")
+        else:
+            originals = vectors[(sample - 3) // 7]
+            nearest = ((reconstructed[:, None, :] - vectors[None, :, :]) ** 2).sum(-1).argmin(1)
+            if not np.array_equal(vectors[nearest], originals):
+                failures.append(f"{index_type}: reconstructed vectors don't match the stored ones")
+
+        # Filtered search may only return allowed IDs and must find an allowed query vector itself
+        allowed = kept[len(kept) // 2:]
+        try:
+            _, I = search_ids(index, vectors[(allowed[:20] - 3) // 7], 10, allowed)
+            if not np.isin(I[I != -1], allowed).all():
+                failures.append(f"{index_type}: search_ids returned IDs outside the allowed subset")
+            if (I[:, 0] != allowed[:20]).mean() > 0.5:
+                failures.append(f"{index_type}: search_ids misses the allowed query vectors")
+        except RuntimeError as e:
+            failures.append(f"{index_type}: search_ids failed ({str(e).splitlines()[0]})")
+
+        print(f"{'❌' if any(f.startswith(index_type + ':') for f in failures) else '✅'} {index_type}")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report recall@k and query latency for each index type")
+    parser.add_argument("--index", default="faiss_index.idx", help="existing flat index to read vectors from")
+    parser.add_argument("--types", default=",".join(INDEX_TYPES), help="comma-separated index types")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--json", help="also write the report to this file")
+    parser.add_argument("--check", action="store_true",
+                        help="check add / remove / reconstruct / filtered search by ID for each type instead")
+    args = parser.parse_args()
+
+    if args.check:
+        failures = check_index_types(args.types.split(","))
+        for failure in failures:
+            print(f"❌ {failure}")
+        raise SystemExit(1 if failures else 0)
+
+    vectors = read_vectors(args.index)
+    results = tune(vectors, args.types.split(","), k=args.k, num_queries=min(args.queries, len(vectors) // 2))
+
+    print(f"\n{'type':<8} {'params':<18} {'recall':>7} {'Δrecall':>8} {'p50 ms':>8} {'p99 ms':>8} {'build s':>8} "
+          f"{'MB':>8} {'vs flat':>8} {'B/vec':>8} {'saved MB':>9}")
+    for r in results:
+        params = ",".join(f"{key}={value}" for key, value in r["params"].items()) or "-"
+        print(f"{r['index_type']:<8} {params:<18} {r['recall']:>7.3f} {r['recall_vs_flat']:>+8.3f} {r['p50_ms']:>8.3f} "
+              f"{r['p99_ms']:>8.3f} {r['build_s']:>8.2f} {r['size_mb']:>8.2f} {r['size_vs_flat']:>8.3f} "
+              f"{r['bytes_per_vector']:>8.1f} {r['saved_mb']:>9.2f}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"✅ Report saved to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+import os
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+# Ingestion settings
+INGEST_WORKERS = os.cpu_count() or 1  # processes extracting PDF / CSV files
+INGEST_MAX_PENDING = 2 * INGEST_WORKERS  # files extracted ahead of the consumer (back-pressure)
+READ_BLOCK_SIZE = 1 << 20  # characters read at a time from text files
+
+
+# Split a stream of words into chunks of chunk_size words
+def _word_chunks(word_blocks, chunk_size):
+    words = []
+    for block in word_blocks:
+        words.extend(block)
+        while len(words) >= chunk_size:
+            yield " ".join(words[:chunk_size])
+            del words[:chunk_size]
+    if words:
+        yield " ".join(words)
+
+
+# Words of a text file, read block by block so huge files are never held whole
+def _iter_file_words(path):
+    tail = ""
+    with open(path, "r", encoding="utf-8") as f:
+        while True:
+            block = f.read(READ_BLOCK_SIZE)
+            if not block:
+                break
+            block = tail + block
+            words = block.split()
+            tail = ""
+            if words and not block[-1].isspace():
+                tail = words.pop()  # May continue in the next block
+            yield words
+    if tail:
+        yield [tail]
+
+
+# Chunks of a text file, streamed (same chunks as splitting the whole text)
+def iter_text_chunks(path, chunk_size):
+    return _word_chunks(_iter_file_words(path), chunk_size)
+
+
+# Extract all chunks of a PDF or CSV file (runs in a worker process)
+def extract_chunks(path, chunk_size):
+    text_chunks = []
+
+    if path.endswith(".txt"):
+        text_chunks = list(iter_text_chunks(path, chunk_size))
+
+    elif path.endswith(".pdf"):
+        from PyPDF2 import PdfReader  # Imported on demand (like pandas below) to keep startup fast
+        reader = PdfReader(path)
+        pages = ((page.extract_text() or "").split() for page in reader.pages)
+        text_chunks = list(_word_chunks(pages, chunk_size))
+
+    elif path.endswith(".csv"):
+        from csv_chunks import iter_csv_text_chunks
+        text_chunks = list(iter_csv_text_chunks(path))
+
+    return text_chunks
+
+
+def _pool_context():
+    # Not fork: ingestion runs while other threads are busy (e.g. the embedding model warming up), and forking
+    # a process mid-import can deadlock its children. A fork server is started from a clean interpreter once
+    # and forks the workers from there; fall back to the platform default (spawn) elsewhere
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("forkserver")
+    return None
+
+
+# Yield (path, chunks) in file order. PDF / CSV files are extracted ahead in a process pool, at most
+# max_pending files at a time, while text files are chunked lazily from a stream by the consumer.
+def iter_documents(paths, chunk_size, workers=INGEST_WORKERS, max_pending=INGEST_MAX_PENDING):
+    paths = list(paths)
+    if workers <= 1:
+        for path in paths:
+            chunks = iter_text_chunks(path, chunk_size) if path.endswith(".txt") else extract_chunks(path, chunk_size)
+            yield path, chunks
+        return
+
+    with ProcessPoolExecutor(workers, mp_context=_pool_context()) as pool:
+        remaining = iter(paths)
+        pending = deque()
+
+        def submit_next():
+            path = next(remaining, None)
+            if path is None:
+                return
+            future = None if path.endswith(".txt") else pool.submit(extract_chunks, path, chunk_size)
+            pending.append((path, future))
+
+        for _ in range(max(1, max_pending)):
+            submit_next()
+
+        while pending:
+            path, future = pending.popleft()
+            submit_next()
+            yield path, iter_text_chunks(path, chunk_size) if future is None else future.result()
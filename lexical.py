@@ -0,0 +1,139 @@
+import re
+import numpy as np
+
+# BM25 settings
+BM25_K1 = 1.5
+BM25_B = 0.75
+RRF_K = 60  # reciprocal rank fusion damping: score = sum of 1 / (RRF_K + rank)
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+# Lowercase alphanumeric tokens ("Route 42A, Oak St." -> ["route", "42a", "oak", "st"])
+def tokenize(text):
+    return TOKEN_PATTERN.findall(str(text).lower())
+
+
+# Top k positions of scores (highest first), ignoring entries that are not positive
+def _top_positive(scores, k):
+    positive = np.nonzero(scores > 0)[0]
+    if len(positive) > k:
+        positive = positive[np.argpartition(-scores[positive], k - 1)[:k]]
+    order = np.argsort(-scores[positive], kind="stable")
+    return positive[order], scores[positive[order]]
+
+
+# Inverted index with BM25 scoring. Documents are identified by position (0..n-1); term weights are
+# precomputed into a sparse document x term matrix so a query is a sum of a few columns.
+class BM25Index:
+    def __init__(self, vocab, weights):
+        self.vocab = vocab  # term -> column
+        self.weights = weights.tocsc()
+
+    @classmethod
+    def build(cls, texts, k1=BM25_K1, b=BM25_B):
+        import scipy.sparse as sp  # Imported on demand to keep startup fast
+        vocab = {}
+        rows, cols = [], []
+        lengths = []
+        for doc, text in enumerate(texts):
+            tokens = tokenize(text)
+            lengths.append(len(tokens))
+            rows.extend([doc] * len(tokens))
+            cols.extend(vocab.setdefault(token, len(vocab)) for token in tokens)
+
+        n = len(lengths)
+        tf = sp.csr_matrix((np.ones(len(rows), dtype="float32"), (rows, cols)), shape=(n, max(1, len(vocab))))
+        tf.sum_duplicates()
+        lengths = np.array(lengths, dtype="float32")
+        avg_length = lengths.mean() if n else 0.0
+
+        df = np.bincount(tf.indices, minlength=tf.shape[1])
+        idf = np.log(1 + (n - df + 0.5) / (df + 0.5)).astype("float32")
+
+        # tf * (k1 + 1) / (tf + k1 * (1 - b + b * len / avg_len)), scaled by idf
+        norm = k1 * (1 - b + b * lengths / avg_length) if avg_length else np.full(n, k1, dtype="float32")
+        doc_of_entry = np.repeat(np.arange(n), np.diff(tf.indptr))
+        tf.data = idf[tf.indices] * tf.data * (k1 + 1) / (tf.data + norm[doc_of_entry])
+        return cls(vocab, tf)
+
+    def __len__(self):
+        return self.weights.shape[0]
+
+    # Scores of every document for a query (0 where no query term occurs)
+    def scores(self, query):
+        cols = sorted({self.vocab[token] for token in tokenize(query) if token in self.vocab})
+        if not cols:
+            return np.zeros(len(self), dtype="float32")
+        return np.asarray(self.weights[:, cols].sum(axis=1)).ravel()
+
+    # Top k (positions, scores), optionally restricted to the allowed positions
+    def search(self, query, k, allowed=None):
+        scores = self.scores(query)
+        if allowed is not None:
+            mask = np.zeros(len(scores), dtype=bool)
+            mask[allowed] = True
+            scores = np.where(mask, scores, 0)
+        return _top_positive(scores, k)
+
+    def to_arrays(self, prefix):
+        terms = sorted(self.vocab, key=self.vocab.get)
+        return {f"{prefix}_terms": np.array(terms, dtype=str), f"{prefix}_data": self.weights.data,
+                f"{prefix}_indices": self.weights.indices, f"{prefix}_indptr": self.weights.indptr,
+                f"{prefix}_shape": np.array(self.weights.shape)}
+
+    @classmethod
+    def from_arrays(cls, arrays, prefix):
+        import scipy.sparse as sp
+        vocab = {term: col for col, term in enumerate(arrays[f"{prefix}_terms"].tolist())}
+        weights = sp.csc_matrix((arrays[f"{prefix}_data"], arrays[f"{prefix}_indices"], arrays[f"{prefix}_indptr"]),
+                                shape=tuple(arrays[f"{prefix}_shape"]))
+        return cls(vocab, weights)
+
+
+# Exact-match field index: value -> sorted array of document positions
+class FieldIndex:
+    def __init__(self, postings):
+        self.postings = postings
+
+    # values_per_doc: one list of (already normalized) values per document
+    @classmethod
+    def build(cls, values_per_doc):
+        postings = {}
+        for doc, values in enumerate(values_per_doc):
+            for value in set(values):
+                postings.setdefault(value, []).append(doc)
+        return cls({value: np.array(docs, dtype="int64") for value, docs in postings.items()})
+
+    def __contains__(self, value):
+        return value in self.postings
+
+    def values(self):
+        return self.postings.keys()
+
+    # Positions matching any of the values
+    def lookup(self, values):
+        found = [self.postings[value] for value in values if value in self.postings]
+        return np.unique(np.concatenate(found)) if found else np.array([], dtype="int64")
+
+    def to_arrays(self, prefix):
+        values = list(self.postings)
+        docs = [self.postings[value] for value in values]
+        return {f"{prefix}_values": np.array(values, dtype=str),
+                f"{prefix}_offsets": np.cumsum([0] + [len(d) for d in docs]),
+                f"{prefix}_docs": np.concatenate(docs) if docs else np.array([], dtype="int64")}
+
+    @classmethod
+    def from_arrays(cls, arrays, prefix):
+        offsets, docs = arrays[f"{prefix}_offsets"], arrays[f"{prefix}_docs"]
+        return cls({value: docs[offsets[i]:offsets[i + 1]]
+                    for i, value in enumerate(arrays[f"{prefix}_values"].tolist())})
+
+
+# Reciprocal rank fusion of several ranked position lists; returns the top k fused positions
+def reciprocal_rank_fusion(rankings, k, rrf_k=RRF_K):
+    fused = {}
+    for ranking in rankings:
+        for rank, pos in enumerate(ranking):
+            fused[int(pos)] = fused.get(int(pos), 0.0) + 1.0 / (rrf_k + rank + 1)
+    return sorted(fused, key=lambda pos: -fused[pos])[:k]
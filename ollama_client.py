@@ -0,0 +1,150 @@
+import json
+import time
+import threading
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+import tracing
+
+# Client settings
+OLLAMA_HOST = "http://localhost:11434"
+POOL_SIZE = 16  # keep-alive connections kept per host
+REQUEST_TIMEOUT = (5, 600)  # (connect, read between streamed lines) in seconds
+
+
+class OllamaError(RuntimeError):
+    pass
+
+
+# Ollama client that streams NDJSON responses token by token over a pooled keep-alive session
+class OllamaClient:
+    def __init__(self, host=OLLAMA_HOST, pool_size=POOL_SIZE, timeout=REQUEST_TIMEOUT):
+        parts = urlsplit(host)
+        self.host = f"{parts.scheme}://{parts.netloc}"  # Accept endpoint URLs such as OLLAMA_URL too
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._local = threading.local()
+
+    # Stats of the last completed stream on this thread
+    @property
+    def last_stats(self):
+        return getattr(self._local, "stats", {})
+
+    # Parsed JSON objects of a streamed response, as they arrive
+    def _stream(self, path, payload):
+        with self.session.post(self.host + path, json=payload, stream=True, timeout=self.timeout) as response:
+            if response.status_code >= 400:
+                raise OllamaError(f"{path} returned {response.status_code}: {response.text.strip()}")
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                try:
+                    data = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if "error" in data:
+                    raise OllamaError(data["error"])
+                yield data
+
+    def _stream_tokens(self, path, payload, extract):
+        start = time.perf_counter()
+        first_token = None
+        tokens = 0
+        final = {}
+
+        for data in self._stream(path, payload):
+            content = extract(data)
+            if content:
+                if first_token is None:
+                    first_token = time.perf_counter()
+                tokens += 1
+                yield content
+            if data.get("done"):
+                final = data  # Keep reading to the end of the body so the connection returns to the pool
+
+        end = time.perf_counter()
+        stats = {
+            "ttft_s": round(first_token - start, 4) if first_token is not None else None,
+            "total_s": round(end - start, 4),
+            "tokens": final.get("eval_count", tokens)
+        }
+        if final.get("eval_duration"):
+            stats["tokens_per_s"] = round(final["eval_count"] / (final["eval_duration"] / 1e9), 2)
+        elif first_token is not None and end > first_token:
+            stats["tokens_per_s"] = round(tokens / (end - first_token), 2)
+        if final.get("prompt_eval_count") is not None:
+            stats["prompt_tokens"] = final["prompt_eval_count"]
+        if "context" in final:
+            stats["context"] = final["context"]
+        self._local.stats = stats
+
+    # Stream a chat completion as a generator of content tokens
+    def stream_chat(self, model, messages, **extra):
+        payload = {"model": model, "messages": messages, "stream": True, **extra}
+        return self._stream_tokens("/api/chat", payload, lambda data: data.get("message", {}).get("content", ""))
+
+    # Stream a raw completion as a generator of tokens
+    def stream_generate(self, model, prompt, **extra):
+        payload = {"model": model, "prompt": prompt, "stream": True, **extra}
+        return self._stream_tokens("/api/generate", payload, lambda data: data.get("response", ""))
+
+    def _complete(self, name, model, tokens, on_token):
+        answer = []
+        with tracing.span(name, model=model) as span:
+            for token in tokens:
+                answer.append(token)
+                if on_token:
+                    on_token(token)
+            stats = self.last_stats
+            span.set(ttft_s=stats.get("ttft_s"), tokens=stats.get("tokens"), prompt_tokens=stats.get("prompt_tokens"))
+            tracing.count("ollama.requests")
+            tracing.count("ollama.tokens", stats.get("tokens") or 0)
+        return "".join(answer).strip()
+
+    # Full chat answer, handing each token to on_token as it arrives
+    def chat(self, model, messages, on_token=None, **extra):
+        return self._complete("ollama.chat", model, self.stream_chat(model, messages, **extra), on_token)
+
+    # Full raw completion; pass context=last_stats["context"] to continue the previous one
+    def generate(self, model, prompt, on_token=None, **extra):
+        return self._complete("ollama.generate", model, self.stream_generate(model, prompt, **extra), on_token)
+
+    # Load a model into memory without generating, kept for keep_alive (0 unloads it instead)
+    def load(self, model, keep_alive):
+        with tracing.span("ollama.load", model=model, keep_alive=keep_alive):
+            for _ in self._stream("/api/generate", {"model": model, "keep_alive": keep_alive}):
+                pass
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+# Shared client per Ollama host, so every caller reuses the same connection pool
+def get_client(url=OLLAMA_HOST):
+    parts = urlsplit(url)
+    host = f"{parts.scheme}://{parts.netloc}"
+    with _clients_lock:
+        if host not in _clients:
+            _clients[host] = OllamaClient(host)
+        return _clients[host]
+
+
+# Print a token immediately (for on_token)
+def print_token(token):
+    print(token, end="", flush=True)
+
+
+# One-line summary of a stream's timing stats
+def format_stats(stats):
+    if not stats:
+        return ""
+    parts = []
+    if stats.get("ttft_s") is not None:
+        parts.append(f"first token {stats['ttft_s']:.2f}s")
+    if stats.get("tokens_per_s") is not None:
+        parts.append(f"{stats['tokens_per_s']:.1f} tok/s")
+    parts.append(f"{stats['tokens']} tokens in {stats['total_s']:.2f}s")
+    return "⏱️ " + " · ".join(parts)
@@ -0,0 +1,117 @@
+import os
+import pickle
+import numpy as np
+import tracing
+
+# Projection settings
+PROJECTION_SAMPLE_SIZE = 20_000  # points UMAP is fitted on; the rest are placed with the fitted model's transform
+PROJECTION_PCA_DIM = 50  # vectors are PCA-reduced to this many dimensions before UMAP (skipped for smaller inputs)
+PROJECTION_BATCH_SIZE = 10_000  # points read and projected per step
+UMAP_NEIGHBORS = 15
+PROJECTION_SEED = 42
+
+
+# Model and coordinate cache files for a prefix: faiss_index -> faiss_index.projection.pkl / .npz
+def projection_paths(prefix):
+    return prefix + ".projection.pkl", prefix + ".projection.npz"
+
+
+# Random positions with every label represented in proportion to its size (at least one point per label)
+def stratified_sample(labels, size, seed=PROJECTION_SEED):
+    n = len(labels)
+    rng = np.random.default_rng(seed)
+    if n <= size:
+        return np.arange(n)
+
+    _, inverse, counts = np.unique(np.asarray(labels), return_inverse=True, return_counts=True)
+    quotas = np.maximum(1, counts * size // n)
+    shuffled = rng.permutation(n)
+    grouped = shuffled[np.argsort(inverse[shuffled], kind="stable")]  # Random order within each label
+    ranks = np.empty(n, dtype="int64")
+    ranks[grouped] = np.arange(n) - np.repeat(np.cumsum(counts) - counts, counts)
+    return np.flatnonzero(ranks < quotas[inverse])
+
+
+# 2-D projection of a growing vector collection. UMAP (after PCA for wide vectors) is fitted on a stratified
+# sample and pickled; every other point is placed with the model's out-of-sample transform, in batches, and
+# the coordinates are cached by key, so a later run only reads and projects the keys it hasn't seen.
+class Projector:
+    def __init__(self, prefix, sample_size=PROJECTION_SAMPLE_SIZE, pca_dim=PROJECTION_PCA_DIM,
+                 batch_size=PROJECTION_BATCH_SIZE):
+        self.model_path, self.coords_path = projection_paths(prefix)
+        self.sample_size = sample_size
+        self.pca_dim = pca_dim
+        self.batch_size = batch_size
+        self.model = None
+        if os.path.exists(self.model_path):
+            with open(self.model_path, "rb") as f:
+                self.model = pickle.load(f)
+
+    # Fit on a sample of the points; returns the sampled positions and their coordinates
+    def fit(self, vectors_fn, n, labels=None):
+        from sklearn.decomposition import PCA
+        from umap import UMAP
+
+        positions = stratified_sample(np.zeros(n) if labels is None else labels, self.sample_size)
+        with tracing.span("projection.fit", points=len(positions)):
+            vectors = vectors_fn(positions)
+            pca = None
+            if vectors.shape[1] > self.pca_dim and len(vectors) > self.pca_dim:
+                pca = PCA(self.pca_dim, random_state=PROJECTION_SEED).fit(vectors)
+                vectors = pca.transform(vectors)
+            umap = UMAP(n_components=2, n_neighbors=max(2, min(UMAP_NEIGHBORS, len(vectors) - 1)),
+                        random_state=PROJECTION_SEED)
+            coords = umap.fit_transform(vectors).astype("float32")
+
+        self.model = {"pca": pca, "umap": umap, "version": os.urandom(8).hex()}
+        with open(self.model_path + ".tmp", "wb") as f:
+            pickle.dump(self.model, f)
+        os.replace(self.model_path + ".tmp", self.model_path)
+        return positions, coords
+
+    def transform(self, vectors):
+        if self.model["pca"] is not None:
+            vectors = self.model["pca"].transform(vectors)
+        return self.model["umap"].transform(vectors).astype("float32")
+
+    # Cached (keys, coords) written by the current model
+    def _cached(self):
+        if self.model is None or not os.path.exists(self.coords_path):
+            return None
+        with np.load(self.coords_path, allow_pickle=False) as cache:
+            if str(cache["version"]) != self.model["version"]:
+                return None
+            return cache["keys"], cache["coords"]
+
+    # Coordinates for every key. A key must name the vector's content, e.g. text_key of the embedded text,
+    # not a reusable ID: equal keys share cached coordinates. vectors_fn returns the vectors at positions
+    # of keys and is only called for points that are not cached
+    def project(self, keys, vectors_fn, labels=None, refit=False):
+        keys = np.asarray(keys)
+        coords = np.full((len(keys), 2), np.nan, dtype="float32")
+        fitted = 0
+        if self.model is None or refit:
+            positions, sample_coords = self.fit(vectors_fn, len(keys), labels)
+            coords[positions] = sample_coords
+            fitted = len(positions)
+        else:
+            cached = self._cached()
+            if cached is not None and len(cached[0]) and cached[0].dtype.kind == keys.dtype.kind:
+                order = np.argsort(cached[0])
+                cached_keys = cached[0][order]
+                pos = np.minimum(np.searchsorted(cached_keys, keys), len(cached_keys) - 1)
+                hit = cached_keys[pos] == keys
+                coords[hit] = cached[1][order][pos[hit]]
+
+        missing = np.flatnonzero(np.isnan(coords[:, 0]))
+        with tracing.span("projection.transform", points=len(missing)):
+            for start in range(0, len(missing), self.batch_size):
+                batch = missing[start:start + self.batch_size]
+                coords[batch] = self.transform(vectors_fn(batch))
+                print(f"🧭 Projected {min(start + self.batch_size, len(missing))}/{len(missing)} new points")
+
+        np.savez(self.coords_path + ".tmp.npz", keys=keys, coords=coords, version=self.model["version"])
+        os.replace(self.coords_path + ".tmp.npz", self.coords_path)
+        print(f"🗺️ {len(keys)} points: {fitted} fitted, {len(missing)} projected, "
+              f"{len(keys) - fitted - len(missing)} from cache")
+        return coords
@@ -1,138 +1,345 @@
 import os
+import hashlib
 import faiss
 import json
-import requests
-import pandas as pd
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 from tqdm import tqdm
-from PyPDF2 import PdfReader
-from sentence_transformers import SentenceTransformer
+from embeddings import load_embedder, EMBED_BATCH_SIZE, EMBED_WORKERS
+from index_factory import create_index, id_mapped, load_index, reconstruct_ids, remove_ids
+from ollama_client import get_client, print_token, format_stats
+from context_packing import pack_context, CONTEXT_TOKEN_BUDGET
+from chunk_store import ChunkStore, write_chunk_store, update_chunk_store
+from ingest import iter_documents
+from shards import ShardedIndex, shard_path
+from answer_cache import load_answer_cache, index_version, format_cache_stats
+import tracing
 
 # Constants
 OLLAMA_URL = "http://localhost:11434/api/chat"
 MODEL_NAME = "llama3.2"
 DATA_DIR = "data"
 CHUNK_SIZE = 300
+EMBED_BLOCK_SIZE = 4096  # chunks embedded at a time while ingestion keeps extracting
 INDEX_PATH = "faiss_index.idx"
-CHUNKS_PATH = "chunks.json"
+INDEX_TYPE = "flat"  # "flat", "ivf", "hnsw", "ivfpq", "fp16", "sq8", "binary" or "pca" (see index_factory.py)
+INDEX_MMAP = True  # memory-map the saved index instead of reading it into RAM (see load_index)
+INDEX_SHARDS = 1  # >1 splits the index by chunk ID into shards searched in parallel (see shards.py)
+SHARD_MODE = "process"  # "process" searches each shard in a local worker process, "thread" in this process
+SHARD_ADDRESSES = []  # "host:port" of shard servers (python shards.py --index ...) to use instead of local workers
+WARM_UP = True  # load the index and embedding model in the background while the prompt is shown
+RETRIEVE_TOP_K = 100  # candidates considered when packing the context
+CHUNKS_PATH = "chunks.bin"
+MANIFEST_PATH = "index_manifest.json"
+SUPPORTED_EXTENSIONS = (".txt", ".pdf", ".csv")
 
 # Initialize embedding model
-embedder = SentenceTransformer("all-MiniLM-L6-v2")
+embedder = load_embedder()
 
-# Load and chunk data
-def load_documents():
-    docs = []
+# List indexable files in the data directory
+def list_data_files():
+    return sorted(
+        filename for filename in os.listdir(DATA_DIR)
+        if not filename.startswith(".") and filename.endswith(SUPPORTED_EXTENSIONS)  # Skip hidden files like .DS_Store
+    )
 
-    for filename in os.listdir(DATA_DIR):
+# Stream (chunk ID, chunk) pairs for the given files in order, recording each file's ID range in the manifest
+def iter_file_chunks(filenames, manifest, sha256s=None):
+    sha256s = sha256s or {}
+    paths = [os.path.join(DATA_DIR, filename) for filename in filenames]
+
+    for filename, (path, file_chunks) in zip(filenames, iter_documents(paths, CHUNK_SIZE)):
+        start = manifest["next_id"]
+        for chunk in file_chunks:
+            yield manifest["next_id"], chunk
+            manifest["next_id"] += 1
+        manifest["files"][filename] = file_record(path, start, manifest["next_id"], sha256s.get(filename))
+
+# Load and chunk data, recording each file's chunk ID range when a manifest is given
+def load_documents(manifest=None):
+    if manifest is None:
+        manifest = {"next_id": 0, "files": {}}
+    with tracing.span("load_documents") as span:
+        chunks = [chunk for _, chunk in iter_file_chunks(list_data_files(), manifest)]
+        span.set(chunks=len(chunks))
+    return chunks
+
+# Content hash of a data file
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+# Manifest entry: content hash, mtime/size for the cheap change check, and the [start, end) chunk ID range
+def file_record(path, start, end, sha256=None):
+    stat = os.stat(path)
+    return {
+        "sha256": sha256 or file_sha256(path),
+        "mtime": stat.st_mtime,
+        "size": stat.st_size,
+        "ids": [start, end]
+    }
+
+# Pass (ID, chunk) pairs through while embedding them in blocks, so encoding overlaps extraction;
+# each block's IDs and embeddings are appended to ids_out / blocks_out
+def embed_chunks(items, ids_out, blocks_out):
+    block = []
+    with tqdm(desc="🔢 Embedding chunks", unit=" chunks") as progress:
+        for item in items:
+            block.append(item)
+            yield item
+            if len(block) >= EMBED_BLOCK_SIZE:
+                embed_block(block, ids_out, blocks_out)
+                progress.update(len(block))
+                block = []
+        if block:
+            embed_block(block, ids_out, blocks_out)
+            progress.update(len(block))
+
+def embed_block(block, ids_out, blocks_out):
+    tracing.count("chunks.indexed", len(block))
+    ids_out.extend(chunk_id for chunk_id, _ in block)
+    blocks_out.append(embedder.encode([chunk for _, chunk in block], batch_size=EMBED_BATCH_SIZE, workers=EMBED_WORKERS))
+
+# FAISS index with chunk IDs mapped onto the vectors
+def index_embeddings(embeddings, ids):
+    with tracing.span("index.add", vectors=len(ids), index_type=INDEX_TYPE, shards=INDEX_SHARDS):
+        if INDEX_SHARDS > 1:
+            return ShardedIndex.build(INDEX_PATH, INDEX_SHARDS, embeddings, ids, INDEX_TYPE, mode=SHARD_MODE,
+                                      addresses=SHARD_ADDRESSES, mmap=INDEX_MMAP)
+        index = id_mapped(create_index(embeddings, INDEX_TYPE))
+        index.add_with_ids(embeddings, np.asarray(ids, dtype="int64"))
+    return index
+
+# Open the saved index: one (memory-mapped) file, or its shards behind their searchers
+def open_index():
+    if INDEX_SHARDS > 1:
+        return ShardedIndex(INDEX_PATH, INDEX_SHARDS, mode=SHARD_MODE, addresses=SHARD_ADDRESSES, mmap=INDEX_MMAP)
+    return load_index(INDEX_PATH, mmap=INDEX_MMAP)
+
+def index_exists():
+    if INDEX_SHARDS > 1:
+        return all(os.path.exists(shard_path(INDEX_PATH, shard, INDEX_SHARDS)) for shard in range(INDEX_SHARDS))
+    return os.path.exists(INDEX_PATH)
+
+# Build FAISS index for a list of chunks
+def build_index(chunks, ids=None):
+    print(f"📄 Total chunks to embed: {len(chunks)}")
+    with tracing.span("build_index", chunks=len(chunks)):
+        embeddings = embedder.encode(chunks, batch_size=EMBED_BATCH_SIZE, workers=EMBED_WORKERS, show_progress_bar=True)
+        ids = np.arange(len(chunks), dtype="int64") if ids is None else np.asarray(ids, dtype="int64")
+        index = index_embeddings(embeddings, ids)
+    return index, embeddings, dict(zip(ids.tolist(), chunks))
+
+# Compare data files against the manifest: (new or changed files with their hashes, deleted files)
+def diff_manifest(manifest):
+    files = manifest["files"]
+    current = list_data_files()
+    changed = []
+
+    for filename in current:
         path = os.path.join(DATA_DIR, filename)
-        text_chunks = []
+        entry = files.get(filename)
+        if entry is None:
+            changed.append((filename, file_sha256(path)))
+            continue
 
-        if filename.startswith("."):  # Skip hidden files like .DS_Store
+        stat = os.stat(path)
+        if stat.st_mtime == entry["mtime"] and stat.st_size == entry["size"]:
             continue
+        sha256 = file_sha256(path)
+        if sha256 == entry["sha256"]:
+            entry["mtime"] = stat.st_mtime  # Touched but not modified
+        else:
+            changed.append((filename, sha256))
 
-        if filename.endswith(".txt"):
-            with open(path, "r", encoding="utf-8") as f:
-                text = f.read()
-                words = text.split()
-                text_chunks = [" ".join(words[i:i + CHUNK_SIZE]) for i in range(0, len(words), CHUNK_SIZE)]
-
-        elif filename.endswith(".pdf"):
-            reader = PdfReader(path)
-            text = "\n".join([page.extract_text() or "" for page in reader.pages])
-            words = text.split()
-            text_chunks = [" ".join(words[i:i + CHUNK_SIZE]) for i in range(0, len(words), CHUNK_SIZE)]
-
-        elif filename.endswith(".csv"):
-            df = pd.read_csv(path)
-            for _, row in df.iterrows():
-                fields = []
-                for col in df.columns:
-                    value = row[col]
-                    if pd.notna(value) and str(value).strip() != "":
-                        fields.append(f"{col.strip().capitalize()}: {str(value).strip()}")
-                if fields:
-                    chunk = "\n".join(fields)
-                    text_chunks.append(chunk)
-
-        docs.extend(text_chunks)
-
-    return docs
-
-# Build FAISS index
-def build_index(chunks):
-    print(f"📄 Total chunks to embed: {len(chunks)}")
-    embeddings = []
+    deleted = [filename for filename in files if filename not in current]
+    return changed, deleted
 
-    for chunk in tqdm(chunks, desc="🔢 Embedding chunks"):
-        emb = embedder.encode([chunk])[0]
-        embeddings.append(emb)
+# Re-chunk and re-embed only new or changed files, and drop the chunks of deleted ones;
+# returns (new embeddings, updated chunk store, whether anything changed)
+def update_index(index, chunks, manifest):
+    changed, deleted = diff_manifest(manifest)
+    if not changed and not deleted:
+        return index, None, chunks, False
 
-    embeddings = np.array(embeddings)
-    index = faiss.IndexFlatL2(embeddings.shape[1])
-    index.add(embeddings)
-    return index, embeddings, chunks
+    print(f"🔄 Reindexing {len(changed)} new/changed and {len(deleted)} deleted file(s)...")
+    invalidate_manifest()
+    with tracing.span("update_index", changed=len(changed), deleted=len(deleted)):
+        if not isinstance(index, ShardedIndex):  # Shards keep their own writable copies
+            index = load_index(INDEX_PATH)  # A memory-mapped index is read-only; edit an in-memory copy
+        stale = [filename for filename, _ in changed if filename in manifest["files"]] + deleted
+        removed_ids = []
+        for filename in stale:
+            start, end = manifest["files"].pop(filename)["ids"]
+            remove_ids(index, np.arange(start, end, dtype="int64"))
+            removed_ids.extend(range(start, end))
 
-# Retrieve relevant chunks
-def retrieve(query, index, chunks, top_k=1000):
-    q_emb = embedder.encode([query])
-    D, I = index.search(q_emb, top_k)
-    return [chunks[i] for i in I[0]]
-
-# Query Ollama
-def query_ollama(question, context):
-    prompt = f"Use the context below to answer the question.\n\nContext:\n{context}\n\nQuestion: {question}"
-    payload = {
-        "model": MODEL_NAME,
-        "messages": [{"role": "user", "content": prompt}]
-    }
+        # New chunks stream from ingestion through embedding into the rewritten chunk store
+        new_ids, blocks = [], []
+        new_chunks = iter_file_chunks([filename for filename, _ in changed], manifest, dict(changed))
+        chunks = update_chunk_store(chunks, removed_ids, embed_chunks(new_chunks, new_ids, blocks))
 
-    response = requests.post(OLLAMA_URL, json=payload)
-    lines = response.text.strip().splitlines()
-    answer = ""
-
-    for line in lines:
-        try:
-            data = json.loads(line)
-            content = data.get("message", {}).get("content", "")
-            if content:
-                answer += content
-        except:
-            continue
+        embeddings = None
+        if blocks:
+            embeddings = np.concatenate(blocks)
+            index.add_with_ids(embeddings, np.array(new_ids, dtype="int64"))
 
-    return answer.strip()
+    return index, embeddings, chunks, True
 
-# Load or create index
-def load_or_create_index():
-    if os.path.exists(INDEX_PATH) and os.path.exists(CHUNKS_PATH):
-        print("📦 Loading existing FAISS index and chunks...")
-        index = faiss.read_index(INDEX_PATH)
-        with open(CHUNKS_PATH, "r") as f:
-            chunks = json.load(f)
-        return index, None, chunks
+# Retrieve relevant chunks for several queries with one encode and one index search
+def retrieve_batch(queries, index, chunks, top_k=RETRIEVE_TOP_K, token_budget=CONTEXT_TOKEN_BUDGET):
+    with tracing.span("retrieve", queries=len(queries)):
+        q_embs = embedder.encode(queries)
+        with tracing.span("search", k=top_k):
+            D, I = index.search(q_embs, top_k)
+        results = []
+
+        for q_emb, row in zip(q_embs, I):
+            ids = [int(i) for i in row if i != -1]
+            with tracing.span("read_chunks", chunks=len(ids)):
+                texts = [chunks[i] for i in ids]
+
+            # Reuse the indexed vectors; indexes that can't reconstruct fall back to the embedding cache
+            with tracing.span("pack_context") as span:
+                vectors = reconstruct_ids(index, ids)
+                if vectors is None:
+                    vectors = embedder.encode(texts)
+                packed = [texts[i] for i in pack_context(texts, vectors, q_emb, token_budget)]
+                span.set(packed=len(packed))
+            tracing.count("chunks.retrieved", len(packed))
+            results.append(packed)
+
+    return results
+
+# Retrieve relevant chunks, packed by relevance and diversity into the context token budget
+def retrieve(query, index, chunks, top_k=RETRIEVE_TOP_K, token_budget=CONTEXT_TOKEN_BUDGET):
+    return retrieve_batch([query], index, chunks, top_k, token_budget)[0]
+
+# Query Ollama, streaming tokens to on_token as they arrive
+def query_ollama(question, context, on_token=None):
+    with tracing.span("query_ollama"):
+        with tracing.span("prompt", chars=len(context)):
+            prompt = f"Use the context below to answer the question.\n\nContext:\n{context}\n\nQuestion: {question}"
+            messages = [{"role": "user", "content": prompt}]
+        return get_client(OLLAMA_URL).chat(MODEL_NAME, messages, on_token=on_token)
+
+# Semantic answer cache, cleared whenever the index or chunk store changes on disk (opened on first use)
+def get_answer_cache():
+    return load_answer_cache("rag", lambda: index_version(INDEX_PATH, CHUNKS_PATH))
+
+# Answer from the answer cache when a similar question retrieved the same chunks, otherwise ask Ollama;
+# returns (answer, cached)
+def answer_question(question, top_chunks, on_token=None):
+    q_emb = embedder.encode([question])[0]  # Already in the embedding cache from retrieval
+    return get_answer_cache().get_or_generate(
+        q_emb, top_chunks, lambda: query_ollama(question, "\n\n".join(top_chunks), on_token=on_token), on_token
+    )
+
+# Save index and manifest (the chunk store is written as chunks are indexed)
+# Both files are written next to the originals and swapped in, so a memory-mapped index is never rewritten in place
+def save_index(index, manifest):
+    if isinstance(index, ShardedIndex):
+        index.save()
     else:
-        print("🔍 Indexing documents...")
-        chunks = load_documents()
-        index, embeddings, chunks = build_index(chunks)
-        faiss.write_index(index, INDEX_PATH)
-        with open(CHUNKS_PATH, "w") as f:
-            json.dump(chunks, f)
-        return index, embeddings, chunks
+        faiss.write_index(index, INDEX_PATH + ".tmp")
+        os.replace(INDEX_PATH + ".tmp", INDEX_PATH)
+    with open(MANIFEST_PATH + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(MANIFEST_PATH + ".tmp", MANIFEST_PATH)
+
+# Drop the manifest before the chunk store or index change; written again last by save_index, so a run
+# stopped midway (e.g. by exiting while the index loads) is rebuilt instead of trusted
+def invalidate_manifest():
+    if os.path.exists(MANIFEST_PATH):
+        os.remove(MANIFEST_PATH)
+
+# Chunk and embed every data file from scratch
+def rebuild_index():
+    print("🔍 Indexing documents...")
+    invalidate_manifest()
+    manifest = {"next_id": 0, "index_type": INDEX_TYPE, "shards": INDEX_SHARDS, "files": {}}
+
+    with tracing.span("rebuild_index") as span:
+        # Chunks stream from ingestion through embedding into the chunk store; only vectors are kept
+        ids, blocks = [], []
+        write_chunk_store(CHUNKS_PATH, embed_chunks(iter_file_chunks(list_data_files(), manifest), ids, blocks))
+        embeddings = np.concatenate(blocks) if blocks else np.empty((0, embedder.get_sentence_embedding_dimension()), dtype="float32")
+
+        index = index_embeddings(embeddings, ids)
+        save_index(index, manifest)
+        span.set(chunks=len(ids), files=len(manifest["files"]))
+    return index, embeddings, ChunkStore(CHUNKS_PATH)
+
+# Load or create index, re-embedding only files that changed since the last run
+def load_or_create_index():
+    if not (index_exists() and os.path.exists(CHUNKS_PATH) and os.path.exists(MANIFEST_PATH)):
+        return rebuild_index()
+
+    with open(MANIFEST_PATH, "r") as f:
+        manifest = json.load(f)
+    if manifest.get("index_type", "flat") != INDEX_TYPE:
+        print(f"⚠️ Index type changed to '{INDEX_TYPE}'")
+        return rebuild_index()
+    if manifest.get("shards", 1) != INDEX_SHARDS:
+        print(f"⚠️ Shard count changed to {INDEX_SHARDS}")
+        return rebuild_index()
+
+    print("📦 Loading existing FAISS index and chunks...")
+    index = open_index()
+    chunks = ChunkStore(CHUNKS_PATH)  # Memory-mapped; texts are read only when retrieved
+
+    try:
+        index, embeddings, chunks, updated = update_index(index, chunks, manifest)
+    except RuntimeError as e:  # e.g. HNSW indexes cannot remove vectors
+        print(f"⚠️ Incremental update failed ({e})")
+        chunks.close()
+        if isinstance(index, ShardedIndex):
+            index.close()
+        return rebuild_index()
+
+    if updated:
+        save_index(index, manifest)
+    return index, embeddings, chunks
 
 # Main interaction loop
 if __name__ == "__main__":
-    index, embeddings, chunks = load_or_create_index()
-
-    print(f"📈 Vector count: {index.ntotal}")
-    if embeddings is not None:
-        print(f"🧠 Embedding shape: {embeddings.shape}")
+    # The prompt shows right away; the first question waits for whatever is still loading
+    loader = ThreadPoolExecutor(max_workers=1)
+    loading = loader.submit(load_or_create_index)
+    if WARM_UP:
+        embedder.warm_up()
+    else:
+        loading.result()
 
+    index = None
     while True:
         question = input("\n❓ Ask a question (or type 'exit'): ")
         if question.lower() in ["exit", "quit"]:
             break
 
-        top_chunks = retrieve(question, index, chunks)
-        context = "\n\n".join(top_chunks)
-        answer = query_ollama(question, context)
+        if index is None:
+            index, embeddings, chunks = loading.result()
+            print(f"📈 Vector count: {index.ntotal}")
+            if embeddings is not None:
+                print(f"🧠 Embedding shape: {embeddings.shape}")
+
+        with tracing.span("question"):
+            top_chunks = retrieve(question, index, chunks)
+
+            print("\n🤖 Answer:\n", end="", flush=True)
+            _, cached = answer_question(question, top_chunks, on_token=print_token)
+        print(f"\n{format_cache_stats(get_answer_cache().stats()) if cached else format_stats(get_client(OLLAMA_URL).last_stats)}")
+        if tracing.TRACING_ENABLED:
+            print(tracing.format_trace(tracing.last_trace("question")))
 
-        print("\n🤖 Answer:\n", answer)
\ No newline at end of file
+    # Leave without waiting for a load or rebuild still running in the background: its files are swapped in
+    # atomically and the manifest is written last, so the next run redoes whatever didn't finish
+    if not loading.done():
+        print("👋 Stopping the background indexing", flush=True)
+        if tracing.TRACING_ENABLED and tracing.TRACE_DUMP_PATH:
+            tracing.dump_metrics(tracing.TRACE_DUMP_PATH)  # os._exit skips the atexit dump
+        os._exit(0)
+    loader.shutdown()
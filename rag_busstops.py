@@ -1,109 +1,258 @@
 import os
+import re
 import faiss
-import json
-import requests
-import pandas as pd
 import numpy as np
-from tqdm import tqdm
-from sentence_transformers import SentenceTransformer
+from concurrent.futures import ThreadPoolExecutor
+from embeddings import load_embedder, EMBED_BATCH_SIZE, EMBED_WORKERS
+from index_factory import build_index as build_vector_index, load_index, reconstruct_ids, search_ids
+from lexical import BM25Index, FieldIndex, tokenize, reciprocal_rank_fusion
+from ollama_client import get_client, print_token, format_stats
+from chunk_store import ChunkStore, write_chunk_store
+from answer_cache import load_answer_cache, index_version, format_cache_stats
+import tracing
 
 # Constants
 OLLAMA_URL = "http://localhost:11434/api/chat"
 MODEL_NAME = "llama3.2"
 DATA_FILE = "data/BusStopsWAmenities_8035766100189484498.csv"
-CHUNKS_PATH = "busstop_chunks.json"
+CHUNKS_PATH = "busstop_chunks.bin"
 INDEX_PATH = "busstop_index.idx"
+INDEX_TYPE = "flat"  # "flat", "ivf", "hnsw", "ivfpq", "fp16", "sq8", "binary" or "pca" (see index_factory.py)
+LEXICAL_PATH = "busstop_lexical.npz"  # BM25 + field indexes over the chunks
+CANDIDATE_K = 100  # candidates taken from each of the vector and BM25 rankings before fusion
+CONTEXT_TOP_K = 20  # fused chunks sent to the LLM
+INDEX_MMAP = True  # memory-map the saved index instead of reading it into RAM (see load_index)
+WARM_UP = True  # load the index and embedding model in the background while the prompt is shown
+EXACT_FILTER_MAX = 20_000  # filtered subsets up to this size are scored exactly instead of searched
 
 # Embedding model
-embedder = SentenceTransformer("all-MiniLM-L6-v2")
+embedder = load_embedder()
 
 # Custom chunking from bus stops CSV
 def preprocess_bus_stops():
     print("📂 Reading and processing bus stop CSV...")
-    df = pd.read_csv(DATA_FILE)
-    chunks = []
-
-    for _, row in df.iterrows():
-        try:
-            # Construct semantic chunk
-            chunk = {
-                "objectId": row["OBJECTID"],
-                "stopName": str(row["stop_name"]),
-                "jurisdiction": str(row["jurisdiction"]),
-                "routes": str(row["Routes"]),
-                "bikeRacks": int(row["BikeRacks"]) if pd.notna(row["BikeRacks"]) else 0,
-                "text": f"Bus stop '{row['stop_name']}' is located in {row['jurisdiction']} and is served by route(s) {row['Routes']}. It has {int(row['BikeRacks']) if pd.notna(row['BikeRacks']) else 0} bike racks."
-            }
-            chunks.append(chunk)
-        except Exception as e:
-            continue  # Skip malformed rows
-
+    from csv_chunks import read_bus_stop_chunks  # pandas is only needed when (re)building
+    chunks = read_bus_stop_chunks(DATA_FILE)  # Vectorized; malformed rows are reported together
     print(f"✅ Created {len(chunks)} structured chunks.")
     return chunks
 
+# Lexical side: BM25 over the chunk text plus field indexes for filtering
+class BusStopLexicalIndex:
+    def __init__(self, bm25, jurisdictions, routes, bike_racks):
+        self.bm25 = bm25
+        self.jurisdictions = jurisdictions  # normalized jurisdiction -> positions
+        self.routes = routes  # route token -> positions
+        self.bike_racks = bike_racks  # bike rack count per position
+
+    @classmethod
+    def build(cls, chunks):
+        chunks = list(chunks)
+        return cls(
+            BM25Index.build(chunk["text"] for chunk in chunks),
+            FieldIndex.build([[" ".join(tokenize(chunk["jurisdiction"]))] for chunk in chunks]),
+            FieldIndex.build([tokenize(chunk["routes"]) for chunk in chunks]),
+            np.array([chunk["bikeRacks"] for chunk in chunks], dtype="int64")
+        )
+
+    def save(self, path):
+        np.savez(path, bike_racks=self.bike_racks, **self.bm25.to_arrays("bm25"),
+                 **self.jurisdictions.to_arrays("jurisdiction"), **self.routes.to_arrays("routes"))
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as arrays:
+            return cls(BM25Index.from_arrays(arrays, "bm25"), FieldIndex.from_arrays(arrays, "jurisdiction"),
+                       FieldIndex.from_arrays(arrays, "routes"), arrays["bike_racks"])
+
+    # Structured filters named in a question: jurisdictions, route numbers and bike rack requirements ("with bike racks")
+    def parse_filters(self, question):
+        text = " ".join(tokenize(question))
+        filters = {}
+
+        jurisdictions = [value for value in self.jurisdictions.values() if value and re.search(rf"\b{re.escape(value)}\b", text)]
+        if jurisdictions:
+            filters["jurisdiction"] = jurisdictions
+
+        routes = []
+        for match in re.finditer(r"\broutes? ((?:[a-z]?\d+[a-z]?(?: and | or | )?)+)", text):
+            routes.extend(token for token in match.group(1).split() if token in self.routes)
+        if routes:
+            filters["routes"] = routes
+
+        # Only requirement phrasing filters: "how many bike racks does stop X have" must still find stop X
+        if re.search(r"\b(no|without) bike racks?\b", text):
+            filters["max_bike_racks"] = 0
+        elif re.search(r"\b(with|having|(that|which|where) (has|have)) (a |an |any )?bike racks?\b", text):
+            filters["min_bike_racks"] = 1
+        return filters
+
+    # Positions satisfying every filter (None when nothing is filtered)
+    def filter_positions(self, filters):
+        allowed = None
+        if filters.get("jurisdiction"):
+            allowed = self.jurisdictions.lookup(filters["jurisdiction"])
+        if filters.get("routes"):
+            found = self.routes.lookup(filters["routes"])
+            allowed = found if allowed is None else np.intersect1d(allowed, found)
+        if "min_bike_racks" in filters or "max_bike_racks" in filters:
+            racks = self.bike_racks
+            mask = (racks >= filters.get("min_bike_racks", racks.min(initial=0))) & \
+                   (racks <= filters.get("max_bike_racks", racks.max(initial=0)))
+            found = np.nonzero(mask)[0]
+            allowed = found if allowed is None else np.intersect1d(allowed, found)
+        return allowed
+
+
 # Embed and index
 def build_index(chunks):
     print("🔢 Embedding and indexing chunks...")
-    texts = [chunk["text"] for chunk in chunks]
-    embeddings = np.array([embedder.encode([txt])[0] for txt in tqdm(texts)])
+    if os.path.exists(INDEX_PATH):
+        os.remove(INDEX_PATH)  # Written again last, so a build stopped midway is redone on the next run
+    with tracing.span("build_index", chunks=len(chunks)):
+        texts = [chunk["text"] for chunk in chunks]
+        embeddings = embedder.encode(texts, batch_size=EMBED_BATCH_SIZE, workers=EMBED_WORKERS, show_progress_bar=True)
+        tracing.count("chunks.indexed", len(texts))
 
-    index = faiss.IndexFlatL2(embeddings.shape[1])
-    index.add(embeddings)
+        with tracing.span("index.add", vectors=len(texts), index_type=INDEX_TYPE):
+            index = build_vector_index(embeddings, INDEX_TYPE)
+        with tracing.span("lexical.build"):
+            lexical = BusStopLexicalIndex.build(chunks)
 
-    # Save for reuse
-    faiss.write_index(index, INDEX_PATH)
-    with open(CHUNKS_PATH, "w") as f:
-        json.dump(chunks, f)
-    return index, chunks
+        # Save for reuse; the index file is swapped in whole since other processes may have it memory-mapped
+        write_chunk_store(CHUNKS_PATH, enumerate(chunks))
+        lexical.save(LEXICAL_PATH)
+        faiss.write_index(index, INDEX_PATH + ".tmp")
+        os.replace(INDEX_PATH + ".tmp", INDEX_PATH)
+    return index, ChunkStore(CHUNKS_PATH), lexical
 
 # Load from disk or build
 def load_or_create_index():
     if os.path.exists(INDEX_PATH) and os.path.exists(CHUNKS_PATH):
         print("📦 Loading existing index and chunks...")
-        index = faiss.read_index(INDEX_PATH)
-        with open(CHUNKS_PATH, "r") as f:
-            chunks = json.load(f)
-        return index, chunks
+        index = load_index(INDEX_PATH, mmap=INDEX_MMAP)
+        chunks = ChunkStore(CHUNKS_PATH)  # Memory-mapped; records are read only when retrieved
+        if os.path.exists(LEXICAL_PATH):
+            lexical = BusStopLexicalIndex.load(LEXICAL_PATH)
+        else:
+            print("🔤 Building lexical index...")
+            lexical = BusStopLexicalIndex.build(record for _, record in chunks.items())
+            lexical.save(LEXICAL_PATH)
+        return index, chunks, lexical
     else:
         chunks = preprocess_bus_stops()
         return build_index(chunks)
 
-# Semantic retrieval
-def retrieve(query, index, chunks, top_k=100):
-    q_emb = embedder.encode([query])
-    D, I = index.search(q_emb, top_k)
-    return [chunks[i] for i in I[0]]
-
-# Query Ollama with context
-def query_llm(question, context_chunks):
-    context = "\n".join([c["text"] for c in context_chunks])
-    prompt = f"Use the following bus stop context to answer the question:\n\n{context}\n\nQuestion: {question}"
-
-    payload = {
-        "model": MODEL_NAME,
-        "messages": [{"role": "user", "content": prompt}]
-    }
-    response = requests.post(OLLAMA_URL, json=payload)
-    answer = ""
-    for line in response.text.strip().splitlines():
-        try:
-            data = json.loads(line)
-            content = data.get("message", {}).get("content", "")
-            if content:
-                answer += content
-        except:
-            continue
-    return answer.strip()
+# Vector ranking inside a filtered subset: exact scores for small subsets, ID-selector search otherwise
+def filtered_vector_ranking(index, q_emb, allowed, k):
+    if len(allowed) <= EXACT_FILTER_MAX:
+        vectors = reconstruct_ids(index, allowed)
+        if vectors is not None:
+            D = ((vectors - q_emb) ** 2).sum(axis=1)
+            order = np.argsort(D, kind="stable")[:k]
+            return allowed[order]
+    D, I = search_ids(index, q_emb.reshape(1, -1), k, allowed)
+    return I[0][I[0] != -1]
+
+# Hybrid retrieval for several queries: filters from the question (or given) restrict both rankings,
+# then vector and BM25 rankings are fused with reciprocal rank fusion
+def retrieve_batch(queries, index, chunks, lexical=None, top_k=CONTEXT_TOP_K, filters=None):
+    with tracing.span("retrieve", queries=len(queries)):
+        results = _retrieve_batch(queries, index, chunks, lexical, top_k, filters)
+        tracing.count("chunks.retrieved", sum(len(result) for result in results))
+    return results
+
+def _retrieve_batch(queries, index, chunks, lexical, top_k, filters):
+    q_embs = embedder.encode(queries)
+    if lexical is None:
+        with tracing.span("search", k=top_k):
+            D, I = index.search(q_embs, top_k)
+        return [[chunks[i] for i in row if i != -1] for row in I]
+
+    query_filters = [lexical.parse_filters(query) if filters is None else filters for query in queries]
+    allowed = [lexical.filter_positions(f) for f in query_filters]
+
+    # Unfiltered queries share one index search
+    unfiltered = [i for i, a in enumerate(allowed) if a is None]
+    vector_rankings = [None] * len(queries)
+    if unfiltered:
+        with tracing.span("search", k=CANDIDATE_K):
+            D, I = index.search(q_embs[unfiltered], CANDIDATE_K)
+        for i, row in zip(unfiltered, I):
+            vector_rankings[i] = row[row != -1]
+
+    results = []
+    for i, query in enumerate(queries):
+        if allowed[i] is not None:
+            if len(allowed[i]) == 0:
+                results.append([])
+                continue
+            with tracing.span("search.filtered", allowed=len(allowed[i])):
+                vector_rankings[i] = filtered_vector_ranking(index, q_embs[i], allowed[i], CANDIDATE_K)
+        with tracing.span("bm25"):
+            lexical_ranking, _ = lexical.bm25.search(query, CANDIDATE_K, allowed[i])
+        with tracing.span("fuse"):
+            fused = reciprocal_rank_fusion([vector_rankings[i], lexical_ranking], top_k)
+            results.append([chunks[pos] for pos in fused])
+    return results
+
+# Hybrid retrieval
+def retrieve(query, index, chunks, lexical=None, top_k=CONTEXT_TOP_K, filters=None):
+    return retrieve_batch([query], index, chunks, lexical, top_k, filters)[0]
+
+# Query Ollama with context, streaming tokens to on_token as they arrive
+def query_llm(question, context_chunks, on_token=None):
+    with tracing.span("query_llm"):
+        with tracing.span("prompt", chunks=len(context_chunks)):
+            context = "\n".join([c["text"] for c in context_chunks])
+            prompt = f"Use the following bus stop context to answer the question:\n\n{context}\n\nQuestion: {question}"
+
+            messages = [{"role": "user", "content": prompt}]
+        return get_client(OLLAMA_URL).chat(MODEL_NAME, messages, on_token=on_token)
+
+# Semantic answer cache, cleared whenever the bus stop index is rebuilt (opened on first use)
+def get_answer_cache():
+    return load_answer_cache("busstops", lambda: index_version(INDEX_PATH, CHUNKS_PATH))
+
+# Answer from the answer cache when a similar question retrieved the same stops, otherwise ask Ollama;
+# returns (answer, cached)
+def answer_question(question, context_chunks, on_token=None):
+    q_emb = embedder.encode([question])[0]  # Already in the embedding cache from retrieval
+    return get_answer_cache().get_or_generate(
+        q_emb, [c["text"] for c in context_chunks], lambda: query_llm(question, context_chunks, on_token=on_token), on_token
+    )
 
 # Interactive mode
 if __name__ == "__main__":
-    index, chunks = load_or_create_index()
-    print(f"📈 Vector count: {index.ntotal}")
+    # The prompt shows right away; the first question waits for whatever is still loading
+    loader = ThreadPoolExecutor(max_workers=1)
+    loading = loader.submit(load_or_create_index)
+    if WARM_UP:
+        embedder.warm_up()
+    else:
+        loading.result()
 
+    index = None
     while True:
         query = input("\n❓ Ask a question (or type 'exit'): ")
         if query.lower() in ['exit', 'quit']:
             break
-        top_chunks = retrieve(query, index, chunks)
-        answer = query_llm(query, top_chunks)
-        print("\n🤖 Answer:\n", answer)
\ No newline at end of file
+
+        if index is None:
+            index, chunks, lexical = loading.result()
+            print(f"📈 Vector count: {index.ntotal}")
+
+        with tracing.span("question"):
+            top_chunks = retrieve(query, index, chunks, lexical)
+            print("\n🤖 Answer:\n", end="", flush=True)
+            _, cached = answer_question(query, top_chunks, on_token=print_token)
+        print(f"\n{format_cache_stats(get_answer_cache().stats()) if cached else format_stats(get_client(OLLAMA_URL).last_stats)}")
+        if tracing.TRACING_ENABLED:
+            print(tracing.format_trace(tracing.last_trace("question")))
+
+    # Leave without waiting for a build still running in the background (the index file is written last)
+    if not loading.done():
+        print("👋 Stopping the background indexing", flush=True)
+        if tracing.TRACING_ENABLED and tracing.TRACE_DUMP_PATH:
+            tracing.dump_metrics(tracing.TRACE_DUMP_PATH)  # os._exit skips the atexit dump
+        os._exit(0)
+    loader.shutdown()
@@ -1,54 +1,20 @@
+import os
 import json
-import faiss
 import random
-from sentence_transformers import SentenceTransformer
-
-# Load users and events
-with open("dummy_users.json") as f:
-    users = json.load(f)
-with open("events_collection.json") as f:
-    events = json.load(f)
-
-embedder = SentenceTransformer("all-MiniLM-L6-v2")
-
-# Build user embeddings and location map
-user_profiles, user_emails = [], []
-user_locations = {}
-
-for user in users:
-    if isinstance(user.get("interests"), list):
-        profile = f"{user.get('bio', '')} Interests: {', '.join(user['interests'])}"
-        user_profiles.append(profile)
-        user_emails.append(user["email"])
-        loc = user.get("location", {})
-        user_locations[user["email"]] = {
-            "city": loc.get("city", "").strip().lower(),
-            "state": loc.get("state", "").strip().lower()
-        }
-
-user_embeddings = embedder.encode(user_profiles, show_progress_bar=True)
-faiss_user_index = faiss.IndexFlatL2(user_embeddings.shape[1])
-faiss_user_index.add(user_embeddings)
-
-# Build event embeddings and location map
-event_descriptions, event_ids = [], []
-event_locations = {}
-
-for event in events:
-    desc = event.get("description", "")
-    cats = ", ".join(event.get("categories", []) + event.get("tags", []))
-    title = event.get("title", "")
-    combined = f"{title}\nCategories: {cats}\n{desc}"
-    event_descriptions.append(combined)
-    eid = event.get("id", title)
-    event_ids.append(eid)
-    loc = event.get("location", {})
-    event_locations[eid] = {
-        "city": loc.get("city", "").strip().lower(),
-        "state": loc.get("state", "").strip().lower()
-    }
-
-event_embeddings = embedder.encode(event_descriptions, show_progress_bar=True)
+import argparse
+import numpy as np
+from tqdm import tqdm
+from embeddings import load_embedder
+from user_store import VectorStore, print_sync_stats
+
+USER_INDEX_TYPE = "flat"  # "flat", "ivf", "hnsw", "ivfpq", "fp16", "sq8", "binary" or "pca" (see index_factory.py)
+USER_COLLECTION = "rsvp_users"  # user store collection (see user_store.py)
+USERS_PATH = "dummy_users.json"
+EVENTS_PATH = "events_collection.json"  # JSON array, or JSONL (one event per line) for very large inputs
+OUTPUT_JSONL = "events_with_rsvp_semantic.jsonl"  # written incrementally, one event per line
+OUTPUT_JSON = "events_with_rsvp_semantic.json"  # optional final JSON array, streamed from the JSONL
+EVENT_BATCH_SIZE = 8192  # events encoded, searched and scored together
+TOP_K = 50
 
 # Sample reviews
 sample_reviews = [
@@ -60,50 +26,158 @@ sample_reviews = [
     "Not what I expected, but still enjoyable."
 ]
 
-# Compute RSVPs with location boost
-rsvp_map = {}
-top_k = 50
-D, I = faiss_user_index.search(event_embeddings, top_k)
 
-for event_idx, user_idxs in enumerate(I):
-    eid = event_ids[event_idx]
-    event_loc = event_locations.get(eid, {})
-    scored_users = []
+def normalize_place(value):
+    return (value or "").strip().lower()
+
+
+# Stream events from a JSON array or a JSONL file
+def iter_events(path):
+    if path.endswith(".jsonl"):
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+    else:
+        with open(path) as f:
+            yield from json.load(f)
+
+
+def batched(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+# Interest profile records (email, text, city / state metadata) of the users the RSVP matching considers
+def rsvp_user_records(users):
+    for user in users:
+        if isinstance(user.get("interests"), list):
+            loc = user.get("location", {})
+            yield user["email"], f"{user.get('bio', '')} Interests: {', '.join(user['interests'])}", {
+                "city": loc.get("city"),
+                "state": loc.get("state")
+            }
+
+
+# Sync user embeddings into the persistent store and build integer city / state codes ("" -> -1, which never matches)
+def prepare_users(users, embedder):
+    store = VectorStore(USER_COLLECTION, embedder, USER_INDEX_TYPE)
+    print_sync_stats(store, store.sync(rsvp_user_records(users)))
+
+    city_codes, state_codes = {}, {}
+    user_city, user_state = [], []
+    for meta in store.metadata:
+        city, state = normalize_place(meta["city"]), normalize_place(meta["state"])
+        user_city.append(city_codes.setdefault(city, len(city_codes)) if city else -1)
+        user_state.append(state_codes.setdefault(state, len(state_codes)) if state else -1)
+
+    return {
+        "emails": store.keys,
+        "store": store,
+        "city": np.array(user_city, dtype="int64"),
+        "state": np.array(user_state, dtype="int64"),
+        "city_codes": city_codes,
+        "state_codes": state_codes,
+        "email_rank": np.argsort(np.argsort(np.array(store.keys, dtype=object), kind="stable"), kind="stable")
+    }
 
-    for rank, user_idx in enumerate(user_idxs):
-        email = user_emails[user_idx]
-        sim_score = 1 / (1 + D[event_idx][rank])
 
-        # Location boost
-        user_loc = user_locations.get(email, {})
-        loc_boost = 0
-        if user_loc.get("city") == event_loc.get("city") and user_loc["city"]:
-            loc_boost = 0.3
-        elif user_loc.get("state") == event_loc.get("state") and user_loc["state"]:
-            loc_boost = 0.1
+def event_text(event):
+    desc = event.get("description", "")
+    cats = ", ".join(event.get("categories", []) + event.get("tags", []))
+    title = event.get("title", "")
+    return f"{title}\nCategories: {cats}\n{desc}"
+
+
+# Ranked user positions per event of a batch, with the location boost applied to the whole batch at once
+def rank_users(events, user_data, embedder, top_k=TOP_K):
+    event_embeddings = embedder.encode([event_text(event) for event in events])
+    D, I = user_data["store"].search(event_embeddings, top_k)
+    valid = I != -1  # Approximate indexes may return fewer than top_k users
+    users = np.where(valid, I, 0)
+
+    # Unknown or empty event places get -2, which matches no user
+    locs = [event.get("location", {}) for event in events]
+    event_city = np.array([user_data["city_codes"].get(normalize_place(loc.get("city")), -2) for loc in locs])
+    event_state = np.array([user_data["state_codes"].get(normalize_place(loc.get("state")), -2) for loc in locs])
 
-        final_score = 0.7 * sim_score + 0.3 * loc_boost
-        scored_users.append((final_score, email))
+    same_city = user_data["city"][users] == event_city[:, None]
+    same_state = user_data["state"][users] == event_state[:, None]
+    loc_boost = np.where(same_city, np.float32(0.3 * 0.3), np.where(same_state, np.float32(0.3 * 0.1), np.float32(0)))
 
-    scored_users.sort(reverse=True)
-    rsvp_map[eid] = []
+    sim_score = 1 / (1 + D)
+    final_score = np.where(valid, 0.7 * sim_score + loc_boost, -np.inf)
 
-    for i, (_, email) in enumerate(scored_users[:top_k]):
+    # Highest score first, ties by email (descending), like sorting (score, email) tuples in reverse
+    order = np.lexsort((-user_data["email_rank"][users], -final_score), axis=1)
+    return [row_users[row_order][row_valid[row_order]] for row_users, row_order, row_valid in zip(users, order, valid)]
+
+
+def make_rsvps(ranked_users, emails):
+    rsvps = []
+    for i, user_idx in enumerate(ranked_users):
         rsvp = {
-            "email": email,
+            "email": emails[user_idx],
             "status": "attended" if i % 5 == 0 else "joined"
         }
         if rsvp["status"] == "attended":
             rsvp["rating"] = random.randint(3, 5)
             rsvp["review"] = random.choice(sample_reviews)
-        rsvp_map[eid].append(rsvp)
-
-# Attach and save
-for event in events:
-    eid = event.get("id", event.get("title", ""))
-    event["rsvpList"] = rsvp_map.get(eid, [])
-
-    with open("events_with_rsvp_semantic.json", "w") as f:
-        json.dump(events, f, indent=2)
-
-print("✅ events_with_rsvp_semantic.json generated with location-aware RSVP matching.")
\ No newline at end of file
+        rsvps.append(rsvp)
+    return rsvps
+
+
+# Score events batch by batch and append them (with rsvpList) to a JSONL file; memory stays bounded by the batch
+def generate_rsvps(events, user_data, embedder, output_path=OUTPUT_JSONL, batch_size=EVENT_BATCH_SIZE, top_k=TOP_K):
+    count = 0
+    tmp_path = output_path + ".tmp"
+    with open(tmp_path, "w") as out, tqdm(desc="🎟️ Generating RSVPs", unit=" events") as progress:
+        for batch in batched(events, batch_size):
+            for event, ranked in zip(batch, rank_users(batch, user_data, embedder, top_k)):
+                event["rsvpList"] = make_rsvps(ranked, user_data["emails"])
+                out.write(json.dumps(event) + "\n")
+            count += len(batch)
+            progress.update(len(batch))
+    os.replace(tmp_path, output_path)
+    return count
+
+
+# Convert the JSONL output into a JSON array (same layout as json.dump(events, f, indent=2)) one event at a time
+def jsonl_to_json(jsonl_path, json_path):
+    tmp_path = json_path + ".tmp"
+    with open(jsonl_path) as src, open(tmp_path, "w") as out:
+        first = True
+        for line in src:
+            element = "\n".join("  " + part for part in json.dumps(json.loads(line), indent=2).split("\n"))
+            out.write(("[\n" if first else ",\n") + element)
+            first = False
+        out.write("[]" if first else "\n]")
+    os.replace(tmp_path, json_path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate location-aware semantic RSVPs for every event")
+    parser.add_argument("--users", default=USERS_PATH)
+    parser.add_argument("--events", default=EVENTS_PATH, help="JSON array or .jsonl file of events")
+    parser.add_argument("--jsonl", default=OUTPUT_JSONL, help="incremental JSONL output")
+    parser.add_argument("--json", default=OUTPUT_JSON, help="final JSON array output ('' to skip)")
+    parser.add_argument("--batch-size", type=int, default=EVENT_BATCH_SIZE)
+    args = parser.parse_args()
+
+    with open(args.users) as f:
+        users = json.load(f)
+
+    embedder = load_embedder()
+    user_data = prepare_users(users, embedder)
+    count = generate_rsvps(iter_events(args.events), user_data, embedder, args.jsonl, args.batch_size)
+    print(f"✅ {args.jsonl} generated with location-aware RSVP matching for {count} events.")
+
+    if args.json:
+        jsonl_to_json(args.jsonl, args.json)
+        print(f"✅ {args.json} generated with location-aware RSVP matching.")
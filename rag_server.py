@@ -0,0 +1,230 @@
+import os
+import json
+import time
+import asyncio
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from aiohttp import web
+import tracing
+
+# Service settings
+HOST = "127.0.0.1"
+PORT = 8000
+MAX_BATCH_SIZE = 32  # queries encoded and searched together
+MAX_WAIT_MS = 10  # how long the first query of a batch waits for company
+CPU_WORKERS = os.cpu_count() or 4  # threads for encode/search (torch and faiss release the GIL)
+LLM_WORKERS = 64  # threads blocked on streaming Ollama responses
+
+
+# Gathers concurrent requests into micro-batches and runs batch_fn on them in a worker pool
+class MicroBatcher:
+    def __init__(self, batch_fn, executor, max_batch_size=MAX_BATCH_SIZE, max_wait_ms=MAX_WAIT_MS, max_in_flight=CPU_WORKERS):
+        self.batch_fn = batch_fn
+        self.executor = executor
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.queue = asyncio.Queue()
+        self.slots = asyncio.Semaphore(max_in_flight)
+        self.batches = 0
+        self.items = 0
+        self.task = None
+
+    def start(self):
+        self.task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+
+    # Queue one item and wait for its result
+    async def submit(self, item):
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((item, future))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+
+            await self.slots.acquire()
+            self.batches += 1
+            self.items += len(batch)
+            loop.create_task(self._dispatch(batch))
+
+    async def _dispatch(self, batch):
+        try:
+            results = await asyncio.get_running_loop().run_in_executor(
+                self.executor, self.batch_fn, [item for item, _ in batch]
+            )
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            self.slots.release()
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "queries": self.items,
+            "avg_batch_size": round(self.items / self.batches, 2) if self.batches else 0.0
+        }
+
+
+# One RAG pipeline exposed by the service: batched retrieval plus a streamed LLM answer
+class Pipeline:
+    def __init__(self, name, retrieve_batch, answer, to_context, answer_cache=None):
+        self.name = name
+        self.answer_cache = answer_cache
+        self.answer = answer
+        self.to_context = to_context
+        self.retrieve_batch = retrieve_batch
+        self.batcher = None
+
+
+def rag_pipeline():
+    import rag
+    index, _, chunks = rag.load_or_create_index()
+    return Pipeline(
+        "rag",
+        lambda questions: rag.retrieve_batch(questions, index, chunks),
+        lambda question, top_chunks, on_token: rag.answer_question(question, top_chunks, on_token=on_token),
+        lambda top_chunks: top_chunks,
+        rag.get_answer_cache()
+    )
+
+
+def busstops_pipeline():
+    import rag_busstops
+    index, chunks, lexical = rag_busstops.load_or_create_index()
+    return Pipeline(
+        "busstops",
+        lambda questions: rag_busstops.retrieve_batch(questions, index, chunks, lexical),
+        lambda question, top_chunks, on_token: rag_busstops.answer_question(question, top_chunks, on_token=on_token),
+        lambda top_chunks: [chunk["text"] for chunk in top_chunks],
+        rag_busstops.get_answer_cache()
+    )
+
+
+PIPELINES = {"rag": rag_pipeline, "busstops": busstops_pipeline}
+
+
+# Run a blocking streamed LLM call in a thread, yielding its tokens on the event loop
+async def stream_answer(pipeline, question, top_chunks, executor):
+    loop = asyncio.get_running_loop()
+    tokens = asyncio.Queue()
+    done = object()
+
+    def produce():
+        try:
+            pipeline.answer(question, top_chunks, lambda token: loop.call_soon_threadsafe(tokens.put_nowait, token))
+        finally:
+            loop.call_soon_threadsafe(tokens.put_nowait, done)
+
+    worker = loop.run_in_executor(executor, produce)
+    while True:
+        token = await tokens.get()
+        if token is done:
+            break
+        yield token
+    await worker  # Surface LLM errors
+
+
+def make_handler(pipeline):
+    async def handle(request):
+        try:
+            body = await request.json()
+            question = body["question"].strip()
+        except (json.JSONDecodeError, KeyError, TypeError, AttributeError):  # TypeError: JSON that is not an object
+            return web.json_response({"error": "expected a JSON body with a 'question'"}, status=400)
+
+        start = time.perf_counter()
+        top_chunks = await pipeline.batcher.submit(question)
+        retrieve_ms = round((time.perf_counter() - start) * 1000, 2)
+        context = pipeline.to_context(top_chunks)
+
+        if body.get("retrieve_only"):
+            return web.json_response({"chunks": context, "retrieve_ms": retrieve_ms})
+
+        llm_executor = request.app["llm_executor"]
+        if not body.get("stream"):
+            tokens = [token async for token in stream_answer(pipeline, question, top_chunks, llm_executor)]
+            return web.json_response({"answer": "".join(tokens).strip(), "chunks": context, "retrieve_ms": retrieve_ms})
+
+        # NDJSON: one line per token, then a final summary line
+        response = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+        await response.prepare(request)
+        async for token in stream_answer(pipeline, question, top_chunks, llm_executor):
+            await response.write((json.dumps({"token": token}) + "\n").encode("utf-8"))
+        await response.write((json.dumps({"done": True, "chunks": context, "retrieve_ms": retrieve_ms}) + "\n").encode("utf-8"))
+        await response.write_eof()
+        return response
+
+    return handle
+
+
+def create_app(pipelines, max_batch_size=MAX_BATCH_SIZE, max_wait_ms=MAX_WAIT_MS, cpu_workers=CPU_WORKERS):
+    app = web.Application()
+    cpu_executor = ThreadPoolExecutor(cpu_workers, thread_name_prefix="retrieve")
+    app["llm_executor"] = ThreadPoolExecutor(LLM_WORKERS, thread_name_prefix="llm")
+
+    for pipeline in pipelines:
+        pipeline.batcher = MicroBatcher(pipeline.retrieve_batch, cpu_executor, max_batch_size, max_wait_ms, cpu_workers)
+        app.router.add_post(f"/{pipeline.name}", make_handler(pipeline))
+
+    async def health(request):
+        return web.json_response({
+            pipeline.name: {**pipeline.batcher.stats(),
+                            **({"answer_cache": pipeline.answer_cache.stats()} if pipeline.answer_cache else {})}
+            for pipeline in pipelines
+        })
+
+    async def on_startup(app):
+        for pipeline in pipelines:
+            pipeline.batcher.start()
+
+    async def on_cleanup(app):
+        for pipeline in pipelines:
+            await pipeline.batcher.stop()
+        cpu_executor.shutdown(wait=False)
+        app["llm_executor"].shutdown(wait=False)
+
+    # Prometheus text, or JSON with ?format=json (stages are only timed when RAG_TRACING=1)
+    async def metrics(request):
+        if request.query.get("format") == "json":
+            return web.json_response(tracing.metrics())
+        return web.Response(text=tracing.prometheus_text(), content_type="text/plain")
+
+    app.router.add_get("/health", health)
+    app.router.add_get("/metrics", metrics)
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    return app
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Async HTTP query service for the RAG pipelines")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--pipelines", default="rag,busstops", help=f"comma-separated subset of {list(PIPELINES)}")
+    parser.add_argument("--max-batch-size", type=int, default=MAX_BATCH_SIZE)
+    parser.add_argument("--max-wait-ms", type=float, default=MAX_WAIT_MS)
+    parser.add_argument("--workers", type=int, default=CPU_WORKERS)
+    args = parser.parse_args()
+
+    pipelines = [PIPELINES[name]() for name in args.pipelines.split(",")]
+    print(f"🚀 Serving {', '.join('/' + p.name for p in pipelines)} on http://{args.host}:{args.port}")
+    web.run_app(create_app(pipelines, args.max_batch_size, args.max_wait_ms, args.workers), host=args.host, port=args.port)
@@ -1,8 +1,12 @@
 import json
-import faiss
-from sentence_transformers import SentenceTransformer
-from geopy.distance import geodesic
-from geopy.geocoders import Nominatim
+import numpy as np
+from embeddings import load_embedder
+from user_store import load_social_store
+from geo_utils import Geocoder, SpatialIndex, gazetteer_from_users, read_gazetteer
+
+USER_INDEX_TYPE = "flat"  # "flat", "ivf", "hnsw", "ivfpq", "fp16", "sq8", "binary" or "pca" (see index_factory.py)
+RESULTS_K = 50
+RADIUS_KM = 50
 
 # Load data
 with open("dummy_users.json") as f:
@@ -10,59 +14,32 @@ with open("dummy_users.json") as f:
 with open("events_with_rsvp_semantic.json") as f:
     events = json.load(f)
 
-# Map users to events they attended
-user_events = {}
-for event in events:
-    eid = event.get("id", event.get("title", ""))
-    for rsvp in event.get("rsvpList", []):
-        if rsvp.get("status") == "attended":
-            user_events.setdefault(rsvp["email"], []).append(event.get("title"))
-
-# Prepare embedding input for each user
-embedder = SentenceTransformer("all-MiniLM-L6-v2")
-user_chunks = []
-user_emails = []
-user_metadata = []
-
-for user in users:
-    email = user["email"]
-    bio = user.get("bio", "")
-    interests = ", ".join(user.get("interests", []))
-    loc = user.get("location", {})
-    lat = loc.get("latitude")
-    lon = loc.get("longitude")
-    city = loc.get("city", "")
-    state = loc.get("state", "")
-    attended = user_events.get(email, [])
-    attended_str = ", ".join([title for title in attended[:5] if title]) if attended else "None"
-
-    text = f"{bio}. Interests: {interests}. Location: {city}, {state}. Attended events: {attended_str}."
-    user_chunks.append(text)
-    user_emails.append(email)
-    user_metadata.append({
-        "email": email,
-        "city": city,
-        "state": state,
-        "latitude": lat,
-        "longitude": lon,
-        "attended": attended
-    })
-
-# Embed and index
-embeddings = embedder.encode(user_chunks, show_progress_bar=True)
-index = faiss.IndexFlatL2(embeddings.shape[1])
-index.add(embeddings)
-
-# Geolocate helper
-def get_coordinates_for_city(city_name):
-    try:
-        geolocator = Nominatim(user_agent="sahana-rag")
-        location = geolocator.geocode(city_name)
-        if location:
-            return (location.latitude, location.longitude)
-    except:
-        return None
-    return None
+# Sync user profiles into the persistent store; only new or changed profiles are embedded
+embedder = load_embedder()
+store = load_social_store(users, events, USER_INDEX_TYPE, embedder)
+user_metadata = store.metadata
+
+# Spatial index over user coordinates; users without coordinates are never filtered out by distance
+spatial_index = SpatialIndex([m["latitude"] for m in user_metadata], [m["longitude"] for m in user_metadata])
+unlocated = np.setdiff1d(np.arange(len(user_metadata)), spatial_index.positions)
+
+# Offline geocoding: cached lookups, then the local gazetteer and the users' own cities
+gazetteer = gazetteer_from_users(users)
+gazetteer.update(read_gazetteer())
+geocoder = Geocoder(gazetteer)
+
+
+# Semantic search restricted to users near query_coords: prefilter by location, then rank candidates exactly
+def search_near(q_emb, query_coords, k=RESULTS_K, radius_km=RADIUS_KM):
+    nearby, dist_km = spatial_index.query_radius(query_coords[0], query_coords[1], radius_km)
+    candidates = np.concatenate([nearby, unlocated])
+    distances = dict(zip(nearby.tolist(), dist_km.tolist()))
+    if len(candidates) == 0:
+        return []
+
+    D, I = store.search(q_emb, k, candidates)
+    return [(int(idx), float(d), distances.get(int(idx))) for d, idx in zip(D[0], I[0]) if idx != -1]
+
 
 # Run search
 print("🔍 Ask a question like: 'I like rock music and hiking' (type 'exit' to quit)")
@@ -73,27 +50,23 @@ while True:
         break
 
     city_input = input("📍 Enter your city (for distance filtering): ").strip()
-    query_coords = get_coordinates_for_city(city_input)
+    query_coords = geocoder.resolve(city_input)
 
     if not query_coords:
         print("❌ Could not resolve location. Showing all results.")
         query_coords = None
 
     q_emb = embedder.encode([query])
-    D, I = index.search(q_emb, 50)
+    if query_coords:
+        results = search_near(q_emb[0], query_coords)
+    else:
+        D, I = store.search(q_emb, RESULTS_K)
+        results = [(int(idx), float(d), None) for d, idx in zip(D[0], I[0]) if idx != -1]
 
     print("\n👥 Top Matching Users:")
-    for result_idx, idx in enumerate(I[0]):
+    for idx, l2_distance, dist in results:
         meta = user_metadata[idx]
-        user_coords = (meta["latitude"], meta["longitude"])
-        score = round(1 / (1 + D[0][result_idx]), 4)
-
-        if query_coords and all(user_coords):
-            dist = geodesic(query_coords, user_coords).km
-            if dist > 50:
-                continue
-        else:
-            dist = "N/A"
-
-        print(f"- {meta['email']} ({meta['city']}) | Score: {score}, Distance: {round(dist, 1) if isinstance(dist, float) else 'N/A'} km")
-        print(f"  Attended: {', '.join([title for title in meta['attended'] if title]) if meta['attended'] else 'None'}\n")
\ No newline at end of file
+        score = round(1 / (1 + l2_distance), 4)
+
+        print(f"- {meta['email']} ({meta['city']}) | Score: {score}, Distance: {round(dist, 1) if dist is not None else 'N/A'} km")
+        print(f"  Attended: {', '.join([title for title in meta['attended'] if title]) if meta['attended'] else 'None'}\n")
@@ -1,43 +1,258 @@
+import os
 import json
+import argparse
+from functools import reduce
+import numpy as np
+import pandas as pd
 import folium
-from folium.plugins import MarkerCluster
-
-# Load RSVP event data
-with open("events_with_rsvp_semantic.json") as f:
-    events = json.load(f)
-
-# Create map centered around Phoenix metro (adjust as needed)
-rsvp_map = folium.Map(location=[33.4255, -111.9400], zoom_start=10)
-marker_cluster = MarkerCluster().add_to(rsvp_map)
-
-# Plot each event with RSVP count and avg rating
-for event in events:
-    loc = event.get("location", {})
-    lat = loc.get("latitude")
-    lon = loc.get("longitude")
-    if lat is None or lon is None:
-        continue
-
-    rsvps = event.get("rsvpList", [])
-    ratings = [r.get("rating") for r in rsvps if r.get("status") == "attended" and "rating" in r]
-    avg_rating = round(sum(ratings) / len(ratings), 2) if ratings else "N/A"
-
-    popup_text = f"""
-    <strong>{event.get('title')}</strong><br>
-    City: {loc.get('city')}<br>
-    RSVPs: {len(rsvps)}<br>
-    Avg Rating: {avg_rating}
-    """
-
-    folium.CircleMarker(
-        location=[lat, lon],
-        radius=min(len(rsvps) / 5, 15),  # size based on RSVP count
-        popup=popup_text,
-        color="purple",
-        fill=True,
-        fill_opacity=0.7
-    ).add_to(marker_cluster)
-
-# Save map to file
-rsvp_map.save("rsvp_heatmap.html")
-print("✅ Map saved as rsvp_heatmap.html")
\ No newline at end of file
+from folium.plugins import MarkerCluster, HeatMap
+from branca.element import MacroElement
+from jinja2 import Template
+
+EVENTS_PATH = "events_with_rsvp_semantic.json"
+MAP_PATH = "rsvp_heatmap.html"
+CELLS_DIR = "rsvp_cells"  # per-cell event lists, fetched by the map when a cell is opened
+MAP_CENTER = [33.4255, -111.9400]  # Phoenix metro (adjust as needed)
+MAP_ZOOM = 10
+MARKER_LIMIT = 2000  # "auto" draws one marker per event up to this many events, aggregated cells above
+GEOHASH_LEVELS = [(3, 0), (4, 7), (5, 10), (6, 13)]  # (geohash precision, zoom level it is shown from)
+DETAIL_LIMIT = 200  # events listed per cell when it is opened (most RSVPs first)
+DETAIL_FILE_PRECISION = 4  # cell details are bundled into one file per geohash prefix of this length
+GEOHASH_BASE32 = np.array(list("0123456789bcdefghjkmnpqrstuvwxyz"))
+
+
+# Geohash of many points at once: longitude / latitude cell indices interleaved bit by bit, then base32
+def geohash_cells(lats, lons, precision):
+    bits = 5 * precision
+    lon_bits, lat_bits = (bits + 1) // 2, bits // 2
+    x = np.clip(((np.asarray(lons) + 180) / 360 * (1 << lon_bits)).astype("int64"), 0, (1 << lon_bits) - 1)
+    y = np.clip(((np.asarray(lats) + 90) / 180 * (1 << lat_bits)).astype("int64"), 0, (1 << lat_bits) - 1)
+
+    code = np.zeros(len(x), dtype="int64")
+    for i in range(bits):
+        if i % 2 == 0:
+            bit = (x >> (lon_bits - 1 - i // 2)) & 1
+        else:
+            bit = (y >> (lat_bits - 1 - i // 2)) & 1
+        code = (code << 1) | bit
+
+    chars = [GEOHASH_BASE32[(code >> (5 * (precision - 1 - c))) & 31] for c in range(precision)]
+    return reduce(np.char.add, chars) if chars else np.array([""] * len(x))
+
+
+# One row per located event: position, RSVP count and the sum / count of attended ratings
+def event_table(events):
+    located = []
+    for i, event in enumerate(events):
+        loc = event.get("location", {})
+        if loc.get("latitude") is not None and loc.get("longitude") is not None:
+            located.append((i, float(loc["latitude"]), float(loc["longitude"]), event.get("title"), loc.get("city")))
+    table = pd.DataFrame(located, columns=["event", "lat", "lon", "title", "city"]).set_index("event")
+
+    rsvps = pd.DataFrame(
+        [(i, rsvp.get("status"), rsvp.get("rating")) for i in table.index for rsvp in events[i].get("rsvpList", [])],
+        columns=["event", "status", "rating"]
+    )
+    rated = rsvps[(rsvps["status"] == "attended") & rsvps["rating"].notna()]
+    table["rsvps"] = rsvps.groupby("event").size().reindex(table.index, fill_value=0)
+    ratings = rated.groupby("event")["rating"].agg(["sum", "count"]).reindex(table.index, fill_value=0)
+    table["rating_sum"], table["rating_count"] = ratings["sum"].astype(float), ratings["count"]
+    return table
+
+
+def average_rating(rating_sum, rating_count):
+    return (rating_sum / rating_count.where(rating_count > 0)).round(2)
+
+
+# Events, RSVPs and mean rating per geohash cell, placed at the events' centroid
+def aggregate_cells(table, precision):
+    cells = table.assign(cell=geohash_cells(table["lat"].to_numpy(), table["lon"].to_numpy(), precision))
+    grouped = cells.groupby("cell").agg(events=("title", "size"), rsvps=("rsvps", "sum"), rating_sum=("rating_sum", "sum"),
+                                        rating_count=("rating_count", "sum"), lat=("lat", "mean"), lon=("lon", "mean"))
+    grouped["avg_rating"] = average_rating(grouped["rating_sum"], grouped["rating_count"])
+    return grouped
+
+
+# Write the event lists of the cells, bundled into one JSON file per DETAIL_FILE_PRECISION prefix
+# ({cell: [events]}), so the map loads them only when a cell is opened
+def write_cell_details(table, precision, cells_dir=CELLS_DIR, limit=DETAIL_LIMIT, file_precision=DETAIL_FILE_PRECISION):
+    os.makedirs(cells_dir, exist_ok=True)
+    cells = table.assign(cell=geohash_cells(table["lat"].to_numpy(), table["lon"].to_numpy(), precision),
+                         avg_rating=average_rating(table["rating_sum"], table["rating_count"]))
+    top = cells.sort_values(["cell", "rsvps"], ascending=[True, False], kind="stable")
+    top = top[top.groupby("cell").cumcount() < limit]
+
+    bundles = {}
+    for cell, title, city, rsvps, avg in zip(top["cell"].tolist(), top["title"].tolist(), top["city"].tolist(),
+                                             top["rsvps"].tolist(), top["avg_rating"].tolist()):
+        bundle = bundles.setdefault(cell[:file_precision], {})
+        bundle.setdefault(cell, []).append({"title": title, "city": city, "rsvps": int(rsvps),
+                                            "avg_rating": None if pd.isna(avg) else float(avg)})
+    for prefix, bundle in bundles.items():
+        with open(os.path.join(cells_dir, f"{prefix}.json"), "w") as f:
+            json.dump(bundle, f)
+    return len(bundles)
+
+
+# Leaflet layers of aggregated cells, one per geohash level, swapped as the map zooms; cells of the
+# finest level fetch their event list from the details directory when their popup opens
+class ZoomCellLayers(MacroElement):
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+        (function() {
+            var map = {{ this._parent.get_name() }};
+            var levels = {{ this.levels | tojson }};
+            var detailsUrl = {{ this.details_url | tojson }};
+            var detailPrecision = {{ this.detail_precision }};
+            var filePrecision = {{ this.file_precision }};
+
+            function escapeHtml(text) {
+                var div = document.createElement("div");
+                div.textContent = text === null || text === undefined ? "" : String(text);
+                return div.innerHTML;
+            }
+
+            function rating(value) {
+                return value === null ? "N/A" : value;
+            }
+
+            levels.forEach(function(level) {
+                level.layer = L.layerGroup(level.cells.map(function(c) {
+                    var summary = "<strong>" + c[3] + " events</strong><br>RSVPs: " + c[4] + "<br>Avg Rating: " + rating(c[5]);
+                    var marker = L.circleMarker([c[1], c[2]], {
+                        radius: Math.min(4 + Math.sqrt(c[4]) / 2, 25), color: "purple", fill: true, fillOpacity: 0.6
+                    });
+                    if (level.precision !== detailPrecision) {
+                        return marker.bindPopup(summary + "<br><em>Zoom in for event details</em>");
+                    }
+                    marker.bindPopup(summary + "<br><em>Loading events...</em>");
+                    marker.on("popupopen", function(e) {
+                        fetch(detailsUrl + "/" + c[0].slice(0, filePrecision) + ".json").then(function(response) {
+                            return response.json();
+                        }).then(function(bundle) {
+                            var events = bundle[c[0]] || [];
+                            e.popup.setContent(summary + "<hr>" + events.map(function(event) {
+                                return "<strong>" + escapeHtml(event.title) + "</strong> (" + escapeHtml(event.city) + ")<br>RSVPs: "
+                                    + event.rsvps + ", Avg Rating: " + rating(event.avg_rating);
+                            }).join("<br>"));
+                        }).catch(function() {
+                            e.popup.setContent(summary + "<br><em>Event details unavailable (serve this folder over HTTP)</em>");
+                        });
+                    });
+                    return marker;
+                }));
+            });
+
+            function showLevel() {
+                var zoom = map.getZoom();
+                levels.forEach(function(level) {
+                    var visible = zoom >= level.min_zoom && (level.max_zoom === null || zoom < level.max_zoom);
+                    if (visible && !map.hasLayer(level.layer)) {
+                        level.layer.addTo(map);
+                    } else if (!visible && map.hasLayer(level.layer)) {
+                        map.removeLayer(level.layer);
+                    }
+                });
+            }
+            map.on("zoomend", showLevel);
+            showLevel();
+        })();
+        {% endmacro %}
+    """)
+
+    def __init__(self, levels, details_url, detail_precision, file_precision=DETAIL_FILE_PRECISION):
+        super().__init__()
+        self._name = "ZoomCellLayers"
+        self.levels = levels
+        self.details_url = details_url
+        self.detail_precision = detail_precision
+        self.file_precision = file_precision
+
+
+# Original rendering: one clustered marker with an HTML popup per event
+def render_markers(events, rsvp_map):
+    marker_cluster = MarkerCluster().add_to(rsvp_map)
+
+    # Plot each event with RSVP count and avg rating
+    for event in events:
+        loc = event.get("location", {})
+        lat = loc.get("latitude")
+        lon = loc.get("longitude")
+        if lat is None or lon is None:
+            continue
+
+        rsvps = event.get("rsvpList", [])
+        ratings = [r.get("rating") for r in rsvps if r.get("status") == "attended" and "rating" in r]
+        avg_rating = round(sum(ratings) / len(ratings), 2) if ratings else "N/A"
+
+        popup_text = f"""
+        <strong>{event.get('title')}</strong><br>
+        City: {loc.get('city')}<br>
+        RSVPs: {len(rsvps)}<br>
+        Avg Rating: {avg_rating}
+        """
+
+        folium.CircleMarker(
+            location=[lat, lon],
+            radius=min(len(rsvps) / 5, 15),  # size based on RSVP count
+            popup=popup_text,
+            color="purple",
+            fill=True,
+            fill_opacity=0.7
+        ).add_to(marker_cluster)
+
+
+# Aggregated rendering: an RSVP-weighted heat layer plus per-zoom geohash cell layers with lazily loaded details
+def render_cells(events, rsvp_map, map_path=MAP_PATH, cells_dir=CELLS_DIR, levels=GEOHASH_LEVELS):
+    table = event_table(events)
+    finest = max(precision for precision, _ in levels)
+
+    finest_cells = aggregate_cells(table, finest)
+    HeatMap(finest_cells[["lat", "lon", "rsvps"]].to_numpy().tolist(), name="RSVP heat", radius=18).add_to(rsvp_map)
+
+    layer_data = []
+    for i, (precision, min_zoom) in enumerate(levels):
+        cells = finest_cells if precision == finest else aggregate_cells(table, precision)
+        layer_data.append({
+            "precision": precision,
+            "min_zoom": min_zoom,
+            "max_zoom": levels[i + 1][1] if i + 1 < len(levels) else None,
+            "cells": [[cell, round(lat, 5), round(lon, 5), int(n), int(rsvps), None if pd.isna(avg) else float(avg)]
+                      for cell, lat, lon, n, rsvps, avg in zip(cells.index, cells["lat"], cells["lon"], cells["events"],
+                                                               cells["rsvps"], cells["avg_rating"])]
+        })
+
+    written = write_cell_details(table, finest, cells_dir)
+    details_url = os.path.relpath(cells_dir, os.path.dirname(os.path.abspath(map_path))).replace(os.sep, "/")
+    ZoomCellLayers(layer_data, details_url, finest).add_to(rsvp_map)
+    folium.LayerControl().add_to(rsvp_map)
+    print(f"🗺️ {len(table)} events in {len(finest_cells)} cells; details in {written} files under {cells_dir}/")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Render RSVP counts and ratings of events on a map")
+    parser.add_argument("--events", default=EVENTS_PATH)
+    parser.add_argument("--output", default=MAP_PATH)
+    parser.add_argument("--cells-dir", default=CELLS_DIR, help="where per-cell event details are written")
+    parser.add_argument("--mode", choices=["auto", "markers", "cells"], default="auto",
+                        help=f"'auto' aggregates into cells above {MARKER_LIMIT} events")
+    args = parser.parse_args()
+
+    # Load RSVP event data
+    with open(args.events) as f:
+        events = json.load(f)
+
+    mode = args.mode
+    if mode == "auto":
+        mode = "markers" if len(events) <= MARKER_LIMIT else "cells"
+
+    # Create map centered around Phoenix metro (adjust as needed); canvas keeps thousands of cells responsive
+    rsvp_map = folium.Map(location=MAP_CENTER, zoom_start=MAP_ZOOM, prefer_canvas=mode == "cells")
+    if mode == "markers":
+        render_markers(events, rsvp_map)
+    else:
+        render_cells(events, rsvp_map, args.output, args.cells_dir)
+
+    # Save map to file
+    rsvp_map.save(args.output)
+    print(f"✅ Map saved as {args.output}")
@@ -0,0 +1,325 @@
+import os
+import sys
+import heapq
+import argparse
+import threading
+import subprocess
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor, wait
+from multiprocessing.connection import Listener, Client
+import faiss
+import numpy as np
+from index_factory import create_index, id_mapped, load_index, reconstruct_ids, remove_ids
+import tracing
+
+# Shard settings
+SHARD_TIMEOUT_S = 2.0  # a shard that hasn't answered by then is left out of the merged results
+SHARD_HOST = "127.0.0.1"
+SHARD_AUTHKEY = os.environ.get("RAG_SHARD_AUTHKEY", "").encode() or None  # required by shard servers and their clients
+SHARD_MODES = ["thread", "process"]
+
+
+# File of one shard: faiss_index.idx -> faiss_index.shard0of4.idx
+def shard_path(path, shard, num_shards):
+    root, ext = os.path.splitext(path)
+    return f"{root}.shard{shard}of{num_shards}{ext}"
+
+
+# Chunk IDs are spread over shards by value, so updates route by ID alone
+def shard_of(ids, num_shards):
+    return np.asarray(ids, dtype="int64") % num_shards
+
+
+# Merge per-shard (D, I) results, each sorted by distance, into the global top k per query
+def merge_results(results, k):
+    n = len(results[0][0])
+    D = np.full((n, k), np.inf, dtype="float32")
+    I = np.full((n, k), -1, dtype="int64")
+    for q in range(n):
+        rows = [zip(d[q].tolist(), i[q].tolist()) for d, i in results]
+        merged = (pair for pair in heapq.merge(*rows, key=lambda pair: pair[0]) if pair[1] != -1)
+        for rank, (dist, idx) in enumerate(islice(merged, k)):
+            D[q, rank], I[q, rank] = dist, idx
+    return D, I
+
+
+# Run one request against a shard index
+def handle_request(index, op, args):
+    if op == "search":
+        return index.search(*args)
+    if op == "reconstruct":
+        return reconstruct_ids(index, args[0])  # None when the index type cannot reconstruct
+    if op == "ntotal":
+        return index.ntotal
+    raise ValueError(f"Unknown shard request '{op}'")
+
+
+# Shard searched in this process (faiss releases the GIL, so shards still run in parallel threads)
+class LocalShard:
+    def __init__(self, path, mmap=True):
+        self.path = path
+        self.mmap = mmap
+        self.index = load_index(path, mmap=mmap)
+
+    def call(self, op, *args, timeout=None):
+        if op == "reload":
+            self.index = load_index(self.path, mmap=self.mmap)
+            return self.index.ntotal
+        return handle_request(self.index, op, args)
+
+    def close(self):
+        pass
+
+
+# Shard served by another process (see serve_shard); idle connections are pooled so concurrent
+# searches from several threads don't wait on each other
+class ShardClient:
+    def __init__(self, address, authkey, process=None):
+        self.address = address
+        self.authkey = authkey
+        self.process = process  # Local worker started by start_worker, stopped on close
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def call(self, op, *args, timeout=SHARD_TIMEOUT_S):
+        with self._lock:
+            conn = self._idle.pop() if self._idle else None
+        if conn is None:
+            conn = Client(self.address, authkey=self.authkey)
+
+        conn.send((op, args))
+        if not conn.poll(timeout):
+            conn.close()  # The late reply would confuse the next request on this connection
+            raise TimeoutError(f"shard {self.address} did not answer within {timeout}s")
+        status, result = conn.recv()
+        with self._lock:
+            self._idle.append(conn)
+        if status == "error":
+            raise RuntimeError(result)
+        return result
+
+    def close(self):
+        with self._lock:
+            for conn in self._idle:
+                conn.close()
+            self._idle = []
+        if self.process is not None:
+            self.process.terminate()
+            self.process.wait()
+
+
+def _serve_connection(conn, state):
+    with conn:
+        while True:
+            try:
+                op, args = conn.recv()
+            except (EOFError, OSError):
+                return
+            try:
+                if op == "reload":
+                    with state["lock"]:
+                        state["index"] = load_index(state["path"], mmap=state["mmap"])
+                    result = state["index"].ntotal
+                else:
+                    result = handle_request(state["index"], op, args)
+                conn.send(("ok", result))
+            except Exception as e:
+                conn.send(("error", f"{type(e).__name__}: {e}"))
+
+
+# Serve one shard index over multiprocessing.connection (one thread per client connection);
+# prints "READY host port" once listening. Messages are pickles, so a client holding the authkey
+# can run code here: the key must be secret, never a default
+def serve_shard(path, host=SHARD_HOST, port=0, authkey=SHARD_AUTHKEY, mmap=True, threads=None):
+    if not authkey:
+        raise ValueError("shard servers need an authkey (set RAG_SHARD_AUTHKEY)")
+    if threads:
+        faiss.omp_set_num_threads(threads)
+    state = {"path": path, "mmap": mmap, "index": load_index(path, mmap=mmap), "lock": threading.Lock()}
+    listener = Listener((host, port), authkey=authkey)
+    print(f"READY {listener.address[0]} {listener.address[1]}", flush=True)
+    while True:
+        try:
+            conn = listener.accept()
+        except Exception as e:  # e.g. a client with the wrong authkey
+            print(f"⚠️ Rejected shard client: {e}", file=sys.stderr)
+            continue
+        threading.Thread(target=_serve_connection, args=(conn, state), daemon=True).start()
+
+
+# Start a local worker process serving a shard and connect to it. The worker gets a random authkey
+# for this run as the first line on its stdin (not argv or the environment, which other users may read)
+def start_worker(path, threads=None, mmap=True):
+    command = [sys.executable, os.path.abspath(__file__), "--index", path, "--port", "0", "--exit-with-parent"]
+    if threads:
+        command += ["--threads", str(threads)]
+    if not mmap:
+        command.append("--no-mmap")
+    authkey = os.urandom(32)
+    process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+    process.stdin.write(authkey.hex() + "\n")
+    process.stdin.flush()
+    line = process.stdout.readline().split()
+    if not line or line[0] != "READY":
+        process.kill()
+        raise RuntimeError(f"shard worker for {path} failed to start")
+    return ShardClient((line[1], int(line[2])), authkey, process=process)
+
+
+# FAISS-like index split into shards by chunk ID. Queries fan out to every shard in parallel and the
+# per-shard top k are merged with a heap; a shard that misses the timeout is skipped. Shards are
+# searched in threads of this process ("thread"), in local worker processes ("process"), or on shard
+# servers at the given "host:port" addresses. Updates are applied to writable copies loaded here and
+# become visible to the searchers on save().
+class ShardedIndex:
+    def __init__(self, path, num_shards, mode="process", addresses=(), timeout=SHARD_TIMEOUT_S, mmap=True):
+        if mode not in SHARD_MODES:
+            raise ValueError(f"Unknown shard mode '{mode}', expected one of {SHARD_MODES}")
+        self.paths = [shard_path(path, shard, num_shards) for shard in range(num_shards)]
+        self.num_shards = num_shards
+        self.mode = mode
+        self.addresses = list(addresses)
+        self.timeout = timeout
+        self.mmap = mmap
+        self.shards = None
+        self.reconstructable = True  # Cleared once a shard reports that it cannot reconstruct vectors
+        self._writable = {}
+        self._pool = ThreadPoolExecutor(4 * num_shards, thread_name_prefix="shard")
+
+    # Split vectors over shards; every shard starts from one quantizer trained on all of them
+    @classmethod
+    def build(cls, path, num_shards, embeddings, ids, index_type, **kwargs):
+        sharded = cls(path, num_shards, **kwargs)
+        ids = np.asarray(ids, dtype="int64")
+        empty = create_index(embeddings, index_type)
+        owners = shard_of(ids, num_shards)
+        for shard in range(num_shards):
+            index = id_mapped(faiss.clone_index(empty))
+            index.add_with_ids(np.ascontiguousarray(embeddings[owners == shard]), ids[owners == shard])
+            sharded._writable[shard] = index
+        return sharded
+
+    def exists(self):
+        return all(os.path.exists(path) for path in self.paths)
+
+    def _connect(self):
+        if self.shards is not None:
+            return
+        if self.addresses:
+            if not SHARD_AUTHKEY:
+                raise RuntimeError("shard servers need RAG_SHARD_AUTHKEY set to the key they were started with")
+            self.shards = [ShardClient((host, int(port)), SHARD_AUTHKEY)
+                           for host, port in (a.rsplit(":", 1) for a in self.addresses)]
+        elif self.mode == "process":
+            threads = max(1, (os.cpu_count() or 1) // self.num_shards)
+            self.shards = list(self._pool.map(lambda path: start_worker(path, threads, self.mmap), self.paths))
+        else:
+            self.shards = [LocalShard(path, self.mmap) for path in self.paths]
+
+    # Send per-shard requests in parallel; returns {shard: result} for the shards that answered in time
+    def _fan_out(self, requests):
+        self._connect()
+        futures = {self._pool.submit(self.shards[shard].call, op, *args, timeout=self.timeout): shard
+                   for shard, (op, args) in requests.items()}
+        done, late = wait(futures, timeout=self.timeout)
+        results = {}
+        for future in done:
+            try:
+                results[futures[future]] = future.result()
+            except Exception as e:
+                tracing.count("shards.errors")
+                print(f"⚠️ Shard {futures[future]} failed: {e}")
+        for future in late:
+            tracing.count("shards.timeouts")
+            print(f"⚠️ Shard {futures[future]} timed out after {self.timeout}s")
+        return results
+
+    @property
+    def ntotal(self):
+        return sum(self._fan_out({shard: ("ntotal", ()) for shard in range(self.num_shards)}).values())
+
+    def search(self, queries, k):
+        queries = np.ascontiguousarray(queries, dtype="float32")
+        with tracing.span("search.shards", shards=self.num_shards) as span:
+            results = self._fan_out({shard: ("search", (queries, k)) for shard in range(self.num_shards)})
+            span.set(answered=len(results))
+            if not results:
+                raise RuntimeError("no shard answered")
+            return merge_results(list(results.values()), k)
+
+    # Stored vectors by ID (RuntimeError if a shard cannot provide them, like faiss). An index type that
+    # can't reconstruct is remembered, so callers falling back to re-embedding don't query the shards again
+    def reconstruct_batch(self, ids):
+        if not self.reconstructable:
+            raise RuntimeError("index cannot reconstruct vectors")
+        ids = np.asarray(ids, dtype="int64")
+        owners = shard_of(ids, self.num_shards)
+        requests = {shard: ("reconstruct", (ids[owners == shard],)) for shard in np.unique(owners).tolist()}
+        results = self._fan_out(requests)
+        if any(part is None for part in results.values()):
+            self.reconstructable = False
+            raise RuntimeError("index cannot reconstruct vectors")
+        if len(results) < len(requests):
+            raise RuntimeError("not every shard returned its vectors")
+        vectors = np.empty((len(ids), 0), dtype="float32")
+        for shard, part in results.items():
+            if vectors.shape[1] == 0:
+                vectors = np.empty((len(ids), part.shape[1]), dtype="float32")
+            vectors[owners == shard] = part
+        return vectors
+
+    def _writable_shard(self, shard):
+        if shard not in self._writable:
+            self._writable[shard] = load_index(self.paths[shard])
+        return self._writable[shard]
+
+    def remove_ids(self, ids):
+        ids = np.asarray(ids, dtype="int64")
+        owners = shard_of(ids, self.num_shards)
+        return sum(remove_ids(self._writable_shard(shard), ids[owners == shard]) for shard in np.unique(owners).tolist())
+
+    def add_with_ids(self, vectors, ids):
+        ids = np.asarray(ids, dtype="int64")
+        owners = shard_of(ids, self.num_shards)
+        for shard in np.unique(owners).tolist():
+            self._writable_shard(shard).add_with_ids(np.ascontiguousarray(vectors[owners == shard]), ids[owners == shard])
+
+    # Write changed shards (swapped in whole, searchers may have them mapped) and reload their searchers
+    def save(self):
+        for shard, index in self._writable.items():
+            faiss.write_index(index, self.paths[shard] + ".tmp")
+            os.replace(self.paths[shard] + ".tmp", self.paths[shard])
+        if self.shards is not None and self._writable:
+            self._fan_out({shard: ("reload", ()) for shard in self._writable})
+        self._writable = {}
+
+    def close(self):
+        for shard in self.shards or []:
+            shard.close()
+        self.shards = None
+        self._pool.shutdown(wait=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve one index shard to ShardedIndex clients")
+    parser.add_argument("--index", required=True, help="shard file, e.g. faiss_index.shard0of4.idx")
+    parser.add_argument("--host", default=SHARD_HOST)
+    parser.add_argument("--port", type=int, default=0, help="0 picks a free port")
+    parser.add_argument("--threads", type=int, help="faiss threads for this shard")
+    parser.add_argument("--no-mmap", action="store_true", help="read the shard into memory instead of mapping it")
+    parser.add_argument("--exit-with-parent", action="store_true",
+                        help="read the authkey from the first stdin line and stop when stdin closes (local workers)")
+    args = parser.parse_args()
+
+    authkey = SHARD_AUTHKEY
+    if args.exit_with_parent:
+        authkey = bytes.fromhex(sys.stdin.readline().strip())
+        threading.Thread(target=lambda: (sys.stdin.read(), os._exit(0)), daemon=True).start()
+    if not authkey:
+        sys.exit("❌ Set RAG_SHARD_AUTHKEY to a long random secret (the same on the clients), "
+                 "e.g. export RAG_SHARD_AUTHKEY=$(python -c 'import secrets; print(secrets.token_hex(32))')")
+    serve_shard(args.index, args.host, args.port, authkey=authkey, mmap=not args.no_mmap, threads=args.threads)
+
+
+if __name__ == "__main__":
+    main()
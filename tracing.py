@@ -0,0 +1,213 @@
+import os
+import re
+import json
+import time
+import atexit
+import cProfile
+import pstats
+import threading
+from collections import deque
+
+# Tracing settings (environment variables, so scripts need no changes to turn it on)
+TRACING_ENABLED = os.environ.get("RAG_TRACING", "") not in ("", "0")
+TRACE_DUMP_PATH = os.environ.get("RAG_TRACE_DUMP", "")  # metrics written at exit: *.json, otherwise Prometheus text
+PROFILE_PATH = os.environ.get("RAG_PROFILE", "")  # cProfile stats of the first traced request
+PROFILE_SPAN = os.environ.get("RAG_PROFILE_SPAN", "question")  # root span that counts as a request
+RECENT_TRACES = 20  # completed root spans kept for inspection
+LATENCY_BUCKETS_S = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+METRIC_PREFIX = "rag"
+
+_lock = threading.Lock()
+_local = threading.local()
+_span_stats = {}  # name -> {"count", "total_s", "max_s", "buckets"}
+_counters = {}
+_recent = deque(maxlen=RECENT_TRACES)
+_profile = (PROFILE_PATH, PROFILE_SPAN) if PROFILE_PATH else None  # (path, root span name) to profile next
+
+
+# Timed section of work; spans opened inside it on the same thread become its children
+class Span:
+    __slots__ = ("name", "attrs", "start", "duration_s", "children", "_profiler")
+
+    def __init__(self, name, attrs):
+        self.name = name
+        self.attrs = attrs
+        self.children = []
+        self.duration_s = None
+        self._profiler = None
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+        return self
+
+    def __enter__(self):
+        global _profile
+        stack = getattr(_local, "stack", None)
+        if stack is None:
+            stack = _local.stack = []
+        if stack:
+            stack[-1].children.append(self)
+        elif _profile is not None and _profile[1] == self.name:
+            # Matched by name: background roots (model warm-up, index loads) run on other threads meanwhile
+            with _lock:
+                armed, _profile = _profile, None
+            if armed is not None and armed[1] == self.name:
+                self._profiler = (cProfile.Profile(), armed[0])
+                self._profiler[0].enable()
+        stack.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.duration_s = time.perf_counter() - self.start
+        stack = _local.stack
+        stack.pop()
+        if exc_type is not None:
+            self.attrs["error"] = exc_type.__name__
+        _record(self.name, self.duration_s)
+
+        if not stack:
+            with _lock:
+                _recent.append(self)
+        if self._profiler:
+            profiler, path = self._profiler
+            profiler.disable()
+            profiler.dump_stats(path)
+            print(f"🧪 Profile of '{self.name}' saved to {path} (top functions by cumulative time):")
+            pstats.Stats(path).sort_stats("cumulative").print_stats(10)
+        return False
+
+
+class _NoopSpan:
+    def set(self, **attrs):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP = _NoopSpan()
+
+
+def _record(name, seconds):
+    with _lock:
+        stats = _span_stats.get(name)
+        if stats is None:
+            stats = _span_stats[name] = {"count": 0, "total_s": 0.0, "max_s": 0.0, "buckets": [0] * len(LATENCY_BUCKETS_S)}
+        stats["count"] += 1
+        stats["total_s"] += seconds
+        stats["max_s"] = max(stats["max_s"], seconds)
+        for i, bound in enumerate(LATENCY_BUCKETS_S):
+            if seconds <= bound:
+                stats["buckets"][i] += 1
+
+
+# Context manager timing a section; a shared no-op object when tracing is off
+def span(name, **attrs):
+    return Span(name, attrs) if TRACING_ENABLED else _NOOP
+
+
+# Add to a counter (chunks, tokens, cache hits...); does nothing when tracing is off
+def count(name, value=1):
+    if TRACING_ENABLED:
+        with _lock:
+            _counters[name] = _counters.get(name, 0) + value
+
+
+def enable():
+    global TRACING_ENABLED
+    TRACING_ENABLED = True
+
+
+def disable():
+    global TRACING_ENABLED
+    TRACING_ENABLED = False
+
+
+def reset():
+    with _lock:
+        _span_stats.clear()
+        _counters.clear()
+        _recent.clear()
+
+
+# Capture a cProfile of the next root span called name (the next request) into path
+def profile_next(path, name=PROFILE_SPAN):
+    global _profile
+    with _lock:
+        _profile = (path, name)
+
+
+# Most recent completed root span, or the most recent one called name (skips background work)
+def last_trace(name=None):
+    with _lock:
+        for root in reversed(_recent):
+            if name is None or root.name == name:
+                return root
+        return None
+
+
+# Indented span tree with durations, e.g. for printing after an interactive question
+def format_trace(root):
+    lines = []
+
+    def walk(node, depth):
+        attrs = " ".join(f"{key}={value}" for key, value in node.attrs.items())
+        lines.append(f"{'  ' * depth}{node.name:<{max(1, 28 - 2 * depth)}} {node.duration_s * 1000:>10.2f} ms  {attrs}".rstrip())
+        for child in node.children:
+            walk(child, depth + 1)
+
+    if root is not None:
+        walk(root, 0)
+    return "\n".join(lines)
+
+
+def metrics():
+    with _lock:
+        return {
+            "spans": {name: {"count": s["count"], "total_s": round(s["total_s"], 6), "max_s": round(s["max_s"], 6),
+                             "mean_ms": round(s["total_s"] / s["count"] * 1000, 3)}
+                      for name, s in _span_stats.items()},
+            "counters": dict(_counters)
+        }
+
+
+def _metric_name(name):
+    return re.sub(r"[^a-zA-Z0-9_]", "_", name)
+
+
+# Prometheus text exposition: one histogram for all spans (labelled by span) plus one counter per name
+def prometheus_text():
+    with _lock:
+        spans = {name: dict(stats, buckets=list(stats["buckets"])) for name, stats in _span_stats.items()}
+        counters = dict(_counters)
+
+    lines = [f"# HELP {METRIC_PREFIX}_span_seconds Duration of traced pipeline stages",
+             f"# TYPE {METRIC_PREFIX}_span_seconds histogram"]
+    for name, stats in sorted(spans.items()):
+        for bound, bucket_count in zip(LATENCY_BUCKETS_S, stats["buckets"]):
+            lines.append(f'{METRIC_PREFIX}_span_seconds_bucket{{span="{name}",le="{bound}"}} {bucket_count}')
+        lines.append(f'{METRIC_PREFIX}_span_seconds_bucket{{span="{name}",le="+Inf"}} {stats["count"]}')
+        lines.append(f'{METRIC_PREFIX}_span_seconds_sum{{span="{name}"}} {stats["total_s"]:.6f}')
+        lines.append(f'{METRIC_PREFIX}_span_seconds_count{{span="{name}"}} {stats["count"]}')
+    for name, value in sorted(counters.items()):
+        metric = f"{METRIC_PREFIX}_{_metric_name(name)}_total"
+        lines.append(f"# TYPE {metric} counter")
+        lines.append(f"{metric} {value}")
+    return "\n".join(lines) + "\n"
+
+
+# Write metrics to path: JSON for *.json, Prometheus text otherwise
+def dump_metrics(path):
+    with open(path, "w") as f:
+        if path.endswith(".json"):
+            json.dump(metrics(), f, indent=2)
+        else:
+            f.write(prometheus_text())
+
+
+if TRACING_ENABLED and TRACE_DUMP_PATH:
+    atexit.register(dump_metrics, TRACE_DUMP_PATH)
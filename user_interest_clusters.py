@@ -1,32 +1,38 @@
+import os
 import json
+import argparse
 import pandas as pd
 import matplotlib.pyplot as plt
-from umap import UMAP
-from sentence_transformers import SentenceTransformer
+from embeddings import load_embedder, text_key
+from projection import Projector
+from user_store import VectorStore, USER_STORE_INDEX_DIR, print_sync_stats
+
+USER_COLLECTION = "interests"
+
+parser = argparse.ArgumentParser(description="Plot users by interest, coloured by city")
+parser.add_argument("--refit", action="store_true", help="fit a new projection instead of reusing the saved one")
+args = parser.parse_args()
 
 # Load users
 with open("dummy_users.json") as f:
     users = json.load(f)
 
-embedder = SentenceTransformer("all-MiniLM-L6-v2")
-
-user_profiles = []
-user_labels = []
-user_cities = []
-
+records = []
 for user in users:
     if isinstance(user.get("interests"), list) and user.get("email"):
         text = f"{user.get('bio', '')} Interests: {', '.join(user['interests'])}"
-        user_profiles.append(text)
-        user_labels.append(user["email"])
-        user_cities.append(user.get("location", {}).get("city", "Unknown"))
+        records.append((user["email"], text, {"city": user.get("location", {}).get("city", "Unknown")}))
 
-# Compute embeddings
-embeddings = embedder.encode(user_profiles, show_progress_bar=True)
+# Embeddings are kept in the user store; only new or changed profiles are encoded
+store = VectorStore(USER_COLLECTION, load_embedder())
+print_sync_stats(store, store.sync(records))
+texts = {email: text for email, text, _ in records}
+user_cities = [meta["city"] for meta in store.metadata]
 
-# Dimensionality reduction
-umap = UMAP(n_components=2, random_state=42)
-embedding_2d = umap.fit_transform(embeddings)
+# Dimensionality reduction; coordinates are cached per profile text, so only new or edited profiles are projected
+projector = Projector(os.path.join(USER_STORE_INDEX_DIR, USER_COLLECTION))
+embedding_2d = projector.project([text_key(texts[email]) for email in store.keys], store.vectors,
+                                 labels=user_cities, refit=args.refit)
 
 # Create DataFrame
 df = pd.DataFrame({
@@ -48,4 +54,4 @@ plt.legend(title="City", loc="best", fontsize='small')
 plt.grid(True)
 plt.tight_layout()
 plt.savefig("user_interest_clusters.png")
-plt.show()
\ No newline at end of file
+plt.show()
@@ -0,0 +1,323 @@
+import os
+import json
+import sqlite3
+import faiss
+import numpy as np
+from embeddings import load_embedder, text_key
+from index_factory import DEFAULT_INDEX_TYPE, create_index, id_mapped, load_index, reconstruct_ids, remove_ids, search_ids
+import tracing
+
+# User / event vector store settings
+USER_STORE_PATH = "user_store.sqlite"
+USER_STORE_INDEX_DIR = "user_store"  # one FAISS index file per collection
+EXACT_SUBSET_MAX = 20_000  # subsets up to this size are scored exactly instead of searched with an ID selector
+
+
+# Persistent vector store for one collection of keyed records (users by email, events by ID). SQLite keeps
+# each record's stable integer ID, profile text hash and JSON metadata; the vectors live in an ID-mapped
+# FAISS index (see id_mapped) saved next to it. Upserts only embed records whose text changed, deletes
+# remove their vectors, and the positional view (keys, metadata, search results) follows ID order.
+class VectorStore:
+    def __init__(self, collection, embedder=None, index_type=DEFAULT_INDEX_TYPE, path=USER_STORE_PATH,
+                 index_dir=USER_STORE_INDEX_DIR):
+        self.collection = collection
+        self.embedder = embedder or load_embedder()
+        self.index_type = index_type
+        self.index_path = os.path.join(index_dir, f"{collection}.idx")
+        os.makedirs(index_dir, exist_ok=True)
+
+        self.db = sqlite3.connect(path, isolation_level=None)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS records (collection TEXT NOT NULL, key TEXT NOT NULL, id INTEGER NOT NULL,"
+            " text TEXT NOT NULL, text_hash TEXT NOT NULL, metadata TEXT NOT NULL, PRIMARY KEY (collection, key))"
+        )
+        self.db.execute("CREATE UNIQUE INDEX IF NOT EXISTS records_id ON records (collection, id)")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS collections (collection TEXT PRIMARY KEY, next_id INTEGER NOT NULL,"
+            " index_type TEXT NOT NULL, dirty INTEGER NOT NULL DEFAULT 0)"
+        )
+        self._snapshot = None
+
+        row = self.db.execute("SELECT index_type, dirty FROM collections WHERE collection = ?", (collection,)).fetchone()
+        if row is None:
+            self.db.execute("INSERT INTO collections (collection, next_id, index_type) VALUES (?, 0, ?)",
+                            (collection, index_type))
+        self.index = None
+        if os.path.exists(self.index_path):
+            self.index = load_index(self.index_path)
+
+        # The index is rebuilt from the stored texts (embedding cache hits) if it no longer matches the records,
+        # e.g. after the index type changed or a run stopped between writing the records and saving the index
+        if row is not None and row[0] != index_type:
+            print(f"⚠️ {collection}: index type changed to '{index_type}'")
+            self.rebuild()
+        elif (row is not None and row[1]) or (self.index.ntotal if self.index is not None else 0) != len(self):
+            self.rebuild()
+
+    def __len__(self):
+        return self.db.execute("SELECT COUNT(*) FROM records WHERE collection = ?", (self.collection,)).fetchone()[0]
+
+    # Write the index next to the old file and swap it in
+    def _save_index(self):
+        if self.index is None:
+            if os.path.exists(self.index_path):
+                os.remove(self.index_path)
+            return
+        faiss.write_index(self.index, self.index_path + ".tmp")
+        os.replace(self.index_path + ".tmp", self.index_path)
+
+    def _add(self, ids, vectors):
+        if self.index is None:
+            self.index = id_mapped(create_index(vectors, self.index_type))
+        self.index.add_with_ids(vectors, np.asarray(ids, dtype="int64"))
+
+    # Re-create the index from every stored text (trains quantizers on the current data)
+    def rebuild(self):
+        with tracing.span("store.rebuild", collection=self.collection):
+            rows = self.db.execute("SELECT id, text FROM records WHERE collection = ? ORDER BY id",
+                                   (self.collection,)).fetchall()
+            self.index = None
+            if rows:
+                vectors = self.embedder.encode([text for _, text in rows], show_progress_bar=True,
+                                               desc=f"🔢 Embedding {self.collection}")
+                self._add([row_id for row_id, _ in rows], vectors)
+            self.db.execute("UPDATE collections SET index_type = ?, dirty = 0 WHERE collection = ?",
+                            (self.index_type, self.collection))
+            self._save_index()
+            self._snapshot = None
+
+    # Apply record changes in one transaction that marks the index stale, then update and save the index;
+    # if the index cannot apply them (e.g. binary indexes cannot remove vectors) it is rebuilt from the records
+    def _commit(self, write_records, update_index):
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            write_records()
+            self.db.execute("UPDATE collections SET dirty = 1 WHERE collection = ?", (self.collection,))
+            self.db.execute("COMMIT")
+        except Exception:
+            self.db.execute("ROLLBACK")
+            raise
+        try:
+            update_index()
+        except RuntimeError as e:
+            print(f"⚠️ {self.collection}: index update failed ({e}), rebuilding")
+            self.rebuild()
+        self._save_index()
+        self.db.execute("UPDATE collections SET dirty = 0 WHERE collection = ?", (self.collection,))
+        self._snapshot = None
+
+    # Insert or update (key, text, metadata) records, embedding only new or changed texts; returns counts
+    def upsert(self, records):
+        records = {str(key): (text, json.dumps(metadata, sort_keys=True)) for key, text, metadata in records}
+        stats = {"added": 0, "updated": 0, "metadata": 0, "unchanged": 0}
+        if not records:
+            return stats
+
+        with tracing.span("store.upsert", collection=self.collection, records=len(records)) as span:
+            existing = self._existing(records.keys())
+            embed, meta_only = [], []
+            for key, (text, metadata) in records.items():
+                old = existing.get(key)
+                if old is None or old[1] != text_key(text):
+                    embed.append(key)
+                    stats["added" if old is None else "updated"] += 1
+                elif old[2] != metadata:
+                    meta_only.append(key)
+                    stats["metadata"] += 1
+                else:
+                    stats["unchanged"] += 1
+            span.set(embedded=len(embed))
+            tracing.count("store.embedded", len(embed))
+
+            if meta_only:
+                self.db.execute("BEGIN IMMEDIATE")
+                self.db.executemany("UPDATE records SET metadata = ? WHERE collection = ? AND key = ?",
+                                    [(records[key][1], self.collection, key) for key in meta_only])
+                self.db.execute("COMMIT")
+                self._snapshot = None
+            if not embed:
+                return stats
+
+            vectors = self.embedder.encode([records[key][0] for key in embed], show_progress_bar=True,
+                                           desc=f"🔢 Embedding {self.collection}")
+            next_id = self.db.execute("SELECT next_id FROM collections WHERE collection = ?",
+                                      (self.collection,)).fetchone()[0]
+            ids = [existing[key][0] if key in existing else next_id + i for i, key in enumerate(embed)]
+            ids = np.array(ids, dtype="int64")
+            stale_ids = np.array([existing[key][0] for key in embed if key in existing], dtype="int64")
+
+            def write_records():
+                self.db.execute("UPDATE collections SET next_id = ? WHERE collection = ?",
+                                (next_id + len(embed), self.collection))
+                self.db.executemany(
+                    "INSERT OR REPLACE INTO records (collection, key, id, text, text_hash, metadata) VALUES (?, ?, ?, ?, ?, ?)",
+                    [(self.collection, key, int(row_id), records[key][0], text_key(records[key][0]), records[key][1])
+                     for key, row_id in zip(embed, ids)]
+                )
+
+            def update_index():
+                if len(stale_ids):
+                    remove_ids(self.index, stale_ids)
+                self._add(ids, vectors)
+
+            self._commit(write_records, update_index)
+        return stats
+
+    # Delete records by key; returns how many existed
+    def delete(self, keys):
+        existing = self._existing(str(key) for key in keys)
+        if not existing:
+            return 0
+
+        def write_records():
+            self.db.executemany("DELETE FROM records WHERE collection = ? AND key = ?",
+                                [(self.collection, key) for key in existing])
+
+        def update_index():
+            remove_ids(self.index, np.array([row_id for row_id, _, _ in existing.values()], dtype="int64"))
+            if self.index.ntotal == 0:
+                self.index = None
+
+        with tracing.span("store.delete", collection=self.collection, records=len(existing)):
+            self._commit(write_records, update_index)
+        return len(existing)
+
+    # Make the collection hold exactly these records: upsert them and delete every other key
+    def sync(self, records):
+        records = list(records)
+        stats = self.upsert(records)
+        current = {str(key) for key, _, _ in records}
+        stale = [key for (key,) in self.db.execute("SELECT key FROM records WHERE collection = ?", (self.collection,))
+                 if key not in current]
+        stats["deleted"] = self.delete(stale)
+        return stats
+
+    # key -> (id, text hash, metadata JSON) for the stored keys among the given ones
+    def _existing(self, keys):
+        found = {}
+        keys = list(keys)
+        for start in range(0, len(keys), 500):
+            batch = keys[start:start + 500]
+            rows = self.db.execute(
+                f"SELECT key, id, text_hash, metadata FROM records WHERE collection = ? AND key IN ({','.join('?' * len(batch))})",
+                [self.collection] + batch
+            ).fetchall()
+            found.update((key, (row_id, text_hash, metadata)) for key, row_id, text_hash, metadata in rows)
+        return found
+
+    # Positional view in ID order: ids, keys and decoded metadata, loaded once per change
+    def _view(self):
+        if self._snapshot is None:
+            rows = self.db.execute("SELECT id, key, metadata FROM records WHERE collection = ? ORDER BY id",
+                                   (self.collection,)).fetchall()
+            self._snapshot = (np.array([row[0] for row in rows], dtype="int64"), [row[1] for row in rows],
+                              [json.loads(row[2]) for row in rows])
+        return self._snapshot
+
+    @property
+    def ids(self):
+        return self._view()[0]
+
+    @property
+    def keys(self):
+        return self._view()[1]
+
+    @property
+    def metadata(self):
+        return self._view()[2]
+
+    # Map index IDs to positions in the view (-1 stays -1)
+    def positions(self, ids):
+        ids = np.asarray(ids, dtype="int64")
+        positions = np.searchsorted(self.ids, ids)
+        return np.where(ids == -1, -1, positions)
+
+    # Stored vectors for positions (all when None), re-embedded from the texts if the index can't reconstruct them
+    def vectors(self, positions=None):
+        ids = self.ids if positions is None else self.ids[np.asarray(positions, dtype="int64")]
+        if len(ids) == 0:
+            return np.empty((0, self.embedder.get_sentence_embedding_dimension()), dtype="float32")
+        vectors = reconstruct_ids(self.index, ids)
+        if vectors is None:
+            keys = [self.keys[pos] for pos in np.searchsorted(self.ids, ids)]
+            texts = dict(self.db.execute(
+                f"SELECT key, text FROM records WHERE collection = ? AND key IN ({','.join('?' * len(keys))})",
+                [self.collection] + keys
+            ).fetchall())
+            vectors = self.embedder.encode([texts[key] for key in keys])
+        return vectors
+
+    # k nearest records per query as (distances, positions); positions restricts the search to a subset
+    def search(self, queries, k, positions=None):
+        queries = np.ascontiguousarray(np.atleast_2d(queries), dtype="float32")
+        if self.index is None or (positions is not None and len(positions) == 0):
+            return np.full((len(queries), k), np.inf, dtype="float32"), np.full((len(queries), k), -1, dtype="int64")
+
+        with tracing.span("store.search", collection=self.collection, k=k):
+            if positions is None:
+                D, I = self.index.search(queries, k)
+                return D, self.positions(I)
+
+            positions = np.asarray(positions, dtype="int64")
+            if len(positions) > EXACT_SUBSET_MAX:
+                D, I = search_ids(self.index, queries, k, self.ids[positions])
+                return D, self.positions(I)
+
+            # Small subsets: exact distances to the stored vectors
+            vectors = self.vectors(positions)
+            D = ((queries[:, None, :] - vectors[None, :, :]) ** 2).sum(axis=2)
+            order = np.argsort(D, axis=1, kind="stable")[:, :k]
+            D_top = np.take_along_axis(D, order, axis=1)
+            P_top = positions[order]
+            if order.shape[1] < k:
+                pad = k - order.shape[1]
+                D_top = np.pad(D_top, ((0, 0), (0, pad)), constant_values=np.inf)
+                P_top = np.pad(P_top, ((0, 0), (0, pad)), constant_values=-1)
+            return D_top.astype("float32"), P_top
+
+
+# Attended event titles per email, in event order
+def attended_titles(events):
+    user_events = {}
+    for event in events:
+        for rsvp in event.get("rsvpList", []):
+            if rsvp.get("status") == "attended":
+                user_events.setdefault(rsvp.get("email"), []).append(event.get("title"))
+    return user_events
+
+
+# Records of the "social" collection shared by the social match scripts: profile text with location and
+# up to five attended events, metadata with city, coordinates and every attended title
+def social_profile_records(users, events):
+    user_events = attended_titles(events)
+    for user in users:
+        email = user.get("email")
+        bio = user.get("bio", "")
+        interests = ", ".join(user.get("interests", []))
+        loc = user.get("location", {})
+        city = loc.get("city", "")
+        state = loc.get("state", "")
+        attended = user_events.get(email, [])
+        attended_str = ", ".join([title for title in attended[:5] if title]) if attended else "None"
+
+        text = f"{bio}. Interests: {interests}. Location: {city}, {state}. Attended events: {attended_str}."
+        yield email, text, {
+            "email": email,
+            "city": city,
+            "state": state,
+            "latitude": loc.get("latitude"),
+            "longitude": loc.get("longitude"),
+            "attended": attended
+        }
+
+
+# Sync the social collection from the user and event files and print what changed
+def load_social_store(users, events, index_type=DEFAULT_INDEX_TYPE, embedder=None):
+    store = VectorStore("social", embedder, index_type)
+    print_sync_stats(store, store.sync(social_profile_records(users, events)))
+    return store
+
+
+def print_sync_stats(store, stats):
+    print(f"🗂️ {store.collection}: {len(store)} records ({stats['added']} added, {stats['updated']} re-embedded, "
+          f"{stats['metadata']} metadata-only, {stats.get('deleted', 0)} deleted)")
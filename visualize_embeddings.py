@@ -1,45 +1,66 @@
+import os
 import json
-import faiss
+import argparse
 import numpy as np
 import matplotlib.pyplot as plt
-from sklearn.manifold import TSNE
-from sklearn.decomposition import PCA
-from umap import UMAP
-import scipy.sparse
+from chunk_store import ChunkStore
+from embeddings import load_embedder, text_key
+from index_factory import load_index, reconstruct_ids
+from projection import Projector
+from shards import ShardedIndex
 
 # Load data
-CHUNKS_PATH = "chunks.json"
+CHUNKS_PATH = "chunks.bin"
 INDEX_PATH = "faiss_index.idx"
+MANIFEST_PATH = "index_manifest.json"
 
-with open(CHUNKS_PATH, "r") as f:
-    chunks = json.load(f)
+parser = argparse.ArgumentParser(description="Plot the RAG chunk embeddings in 2-D")
+parser.add_argument("--refit", action="store_true", help="fit a new projection instead of reusing the saved one")
+args = parser.parse_args()
 
-index = faiss.read_index(INDEX_PATH)
+chunks = ChunkStore(CHUNKS_PATH)
+with open(MANIFEST_PATH) as f:
+    manifest = json.load(f)
 
-# Extract embeddings from index
-num_vectors = index.ntotal
-dimension = index.d
-embeddings = np.empty((num_vectors, dimension), dtype="float32")
-index.reconstruct_n(0, num_vectors, embeddings)
+# Vectors are read from the index only for chunks that have no cached coordinates yet
+num_shards = manifest.get("shards", 1)
+if num_shards > 1:
+    index = ShardedIndex(INDEX_PATH, num_shards, mode="thread")
+else:
+    index = load_index(INDEX_PATH, mmap=True)
+chunk_ids = chunks.ids()
+
+
+def chunk_vectors(positions):
+    vectors = reconstruct_ids(index, chunk_ids[positions])
+    if vectors is None:  # e.g. ivfpq codes can't be decoded back to vectors; embed the texts again
+        vectors = load_embedder().encode([chunks[int(chunk_id)] for chunk_id in chunk_ids[positions]])
+    return vectors
 
-# Reduce dimensions
-print("Reducing dimensions with UMAP...")
-umap_model = UMAP(n_components=2, random_state=42)
-reduced = umap_model.fit_transform(embeddings)
 
-reduced = np.array(reduced)
+# The projection is fitted on a sample spread over the source files (chunk IDs are per-file ranges)
+starts = np.array(sorted(record["ids"][0] for record in manifest["files"].values()), dtype="int64")
+sources = np.searchsorted(starts, chunk_ids, side="right") - 1
+
+# Coordinates are cached per chunk text: chunk IDs start over when rag.py rebuilds the index
+print("Reducing dimensions with UMAP...")
+projector = Projector(os.path.splitext(INDEX_PATH)[0])
+keys = [text_key(chunks[int(chunk_id)]) for chunk_id in chunk_ids]
+reduced = projector.project(keys, chunk_vectors, labels=sources, refit=args.refit)
 print(f"Reduced shape: {reduced.shape}, type: {type(reduced)}")
 
 # Plot
 plt.figure(figsize=(12, 8))
-plt.scatter(reduced[:, 0], reduced[:, 1], s=10, alpha=0.7, c='purple')
+plt.scatter(reduced[:, 0], reduced[:, 1], s=10 if len(reduced) < 10_000 else 1, alpha=0.7, c='purple',
+            rasterized=True)
 
 # Optional: annotate a few points
-for i, txt in enumerate(chunks[:10]):
+for i, chunk_id in enumerate(chunk_ids[:10]):
+    txt = chunks[int(chunk_id)]
     plt.annotate(txt[:30] + "...", (reduced[i, 0], reduced[i, 1]), fontsize=8)
 
 plt.title("2D Visualization of RAG Text Embeddings")
 plt.xlabel("UMAP Dim 1")
 plt.ylabel("UMAP Dim 2")
 plt.grid(True)
-plt.show()
\ No newline at end of file
+plt.show()